@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+"""
+Microbenchmark of the filter engine on the LSU and SSU tables.
+
+Compares selecting rows with one `.loc` per predicate, as LocalBroker used to,
+against a single-pass FilterPlan, reporting latency and the peak memory
+allocated while filtering.
+
+    python benchmarks/bench_filters.py
+"""
+
+import pathlib
+import sys
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from mgo import filters  # noqa: E402
+
+
+CONTRACTS = pathlib.Path(__file__).parent.parent / "contracts"
+RANKS = ['superkingdom', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+
+def chained(data, predicates):
+    for predicate in predicates:
+        data = data.loc[filters.mask(data, predicate)]
+    return data
+
+
+def compiled(data, predicates):
+    return filters.FilterPlan(predicates).apply(data)
+
+
+def peak_bytes(function, *args) -> int:
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def workloads(data: pd.DataFrame):
+    # a broad lineage keeps most predicates selective only at the end
+    row = data.dropna(subset=RANKS[:6]).iloc[0]
+    lineage = {rank: [row[rank]] for rank in RANKS[:6]}
+    yield 'ranks+abundance', {**lineage, 'abundance_lower': 1, 'abundance_upper': 10_000}
+    yield 'ref_code', {'ref_code': row['ref_code']}
+    yield 'abundance', {'abundance_lower': 2}
+
+
+def main(repeat: int = 20):
+    print(f"{'table':<6} {'workload':<16} {'chained ms':>11} {'plan ms':>9} {'chained KiB':>12} {'plan KiB':>9}")
+    for table in ['LSU', 'SSU']:
+        data = pd.read_parquet(CONTRACTS / f"metagoflow_analyses.{table}.parquet")
+        for label, params in workloads(data):
+            predicates = [
+                *filters.equality(params, 'ref_code'),
+                *filters.abundance(params),
+                *[p for rank in RANKS for p in filters.equality(params, rank)],
+            ]
+            assert chained(data, predicates).equals(compiled(data, predicates))
+            times = {
+                f.__name__: min(timeit.repeat(lambda: f(data, predicates), number=1, repeat=repeat)) * 1000
+                for f in (chained, compiled)
+            }
+            peaks = {f.__name__: peak_bytes(f, data, predicates) / 1024 for f in (chained, compiled)}
+            print(
+                f"{table:<6} {label:<16} {times['chained']:>11.2f} {times['compiled']:>9.2f}"
+                f" {peaks['chained']:>12.0f} {peaks['compiled']:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import pathlib
+import resource
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from mgo import synthetic  # noqa: E402
+from mgo.catalog import CONTRACTS_DIR  # noqa: E402
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--scales",
+        default="1,10",
+        help="comma separated multipliers of the number of samples in the contracts, e.g. 1,10,100",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        scales = [int(s) for s in metafunc.config.getoption("scales").split(",")]
+        metafunc.parametrize("scale", scales, ids=[f"x{s}" for s in scales], scope="session")
+
+
+@pytest.fixture(scope="session")
+def dataset(scale, tmp_path_factory) -> pathlib.Path:
+    """Directory of the contracts tables, or of a synthetic dataset with
+    `scale` times as many samples."""
+    if scale == 1:
+        return CONTRACTS_DIR
+    samples = pd.read_parquet(CONTRACTS_DIR / "metagoflow_analyses.SSU.parquet", columns=["ref_code"])
+    target = tmp_path_factory.mktemp(f"synthetic-x{scale}")
+    synthetic.generate(target, samples=scale * samples["ref_code"].nunique())
+    return target
+
+
+@pytest.fixture(scope="session")
+def keys(dataset) -> dict:
+    """Sample and observatory keys present in `dataset`, in table order."""
+    ssu = pd.read_parquet(dataset / "metagoflow_analyses.SSU.parquet", columns=["ref_code"])
+    logsheets = pd.read_parquet(dataset / "Batch1and2_combined_logsheets_2024-11-12.parquet", columns=[])
+    observatories = pd.read_parquet(dataset / "Observatory_combined_logsheets_validated.parquet", columns=["obs_id"])
+    return {
+        "ref_code": ssu["ref_code"].unique().tolist(),
+        "source_mat_id": logsheets.index.unique().tolist(),
+        "obs_id": observatories["obs_id"].unique().tolist(),
+    }
+
+
+class PeakRSS:
+    """Peak resident set size of the process while measuring, in bytes.
+
+    On Linux the high-water mark is reset before measuring, elsewhere the
+    peak since the process started is reported.
+    """
+
+    def __enter__(self):
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+        return self
+
+    def __exit__(self, *exc):
+        self.peak = PeakRSS.high_water_mark()
+
+    @staticmethod
+    def high_water_mark() -> int:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
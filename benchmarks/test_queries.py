@@ -0,0 +1,207 @@
+"""
+Benchmarks of every named query of LocalBroker and DuckDBBroker, run with
+pytest-benchmark:
+
+    python -m pytest benchmarks --benchmark-autosave
+    python -m pytest benchmarks --scales 1,10,100 --benchmark-compare
+
+Each workload is measured cold (new broker, with an empty table cache, for
+every round) and warm (broker which executed the query once), against the contracts tables and
+synthetic datasets with `--scales` times as many samples (`mgo.synthetic`).
+Besides the timings, the rows returned, rows per second and the peak RSS of
+one execution are stored in the `extra_info` of each benchmark.
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from mgo.brokers.local import LocalBroker, ResultCache, TableCache  # noqa: E402
+from mgo.namedqueries import QUERY_REGISTRY  # noqa: E402
+
+from conftest import PeakRSS  # noqa: E402
+
+
+def sample_workloads(extra: dict | None = None) -> dict:
+    return {
+        "full": lambda keys: {},
+        "ref_code": lambda keys: {"ref_code": keys["ref_code"][0]},
+        "ref_code_x100": lambda keys: {"ref_code": keys["ref_code"][:100]},
+        "abundance": lambda keys: {"abundance_lower": 10, "abundance_upper": 1000},
+        **(extra or {}),
+    }
+
+
+WORKLOADS = {
+    "urn:embrc.eu:emobon:abundance_by_rank": {
+        "phylum": lambda keys: {"table": "ssu", "rank": "phylum"},
+        "genus_ref_code_x100": lambda keys: {"table": "lsu", "rank": "genus", "ref_code": keys["ref_code"][:100]},
+    },
+    "urn:embrc.eu:emobon:abundance_matrix": {
+        "go": lambda keys: {"table": "go"},
+        "ssu_genus": lambda keys: {"table": "ssu", "feature": "genus"},
+    },
+    "urn:embrc.eu:emobon:all_by_ref_code": {
+        "ref_code": lambda keys: {"ref_code": keys["ref_code"][0]},
+        "ref_code_x100": lambda keys: {"ref_code": keys["ref_code"][:100]},
+    },
+    "urn:embrc.eu:emobon:go": sample_workloads({
+        "aspect": lambda keys: {"aspect": "biological_process", "abundance_lower": 10},
+    }),
+    "urn:embrc.eu:emobon:go_slim": sample_workloads(),
+    "urn:embrc.eu:emobon:ips": sample_workloads(),
+    "urn:embrc.eu:emobon:join": {
+        "ko_water_column": lambda keys: {
+            "table": "ko", "observatories": {"env_package": "water_column"},
+            "logsheets": {"sea_surf_temp_lower": 15}, "abundance_lower": 3,
+        },
+        "ssu_obs_id": lambda keys: {"table": "ssu", "observatories": {"obs_id": keys["obs_id"][0]}},
+    },
+    "urn:embrc.eu:emobon:ko": sample_workloads(),
+    "urn:embrc.eu:emobon:logsheets": {
+        "full": lambda keys: {},
+        "source_mat_id": lambda keys: {"source_mat_id": keys["source_mat_id"][0]},
+        "source_mat_id_x100": lambda keys: {"source_mat_id": keys["source_mat_id"][:100]},
+        "tidal_stage": lambda keys: {"tidal_stage": "high_tide"},
+        "ranges": lambda keys: {
+            "collection_date_lower": "2021-06-01", "depth_upper": 10, "chlorophyll_method": "PRESENT",
+        },
+    },
+    "urn:embrc.eu:emobon:lsu": sample_workloads({
+        "phylum": lambda keys: {"phylum": "Proteobacteria", "abundance_lower": 2},
+    }),
+    "urn:embrc.eu:emobon:observatories": {
+        "full": lambda keys: {},
+        "obs_id": lambda keys: {"obs_id": keys["obs_id"][0]},
+        "env_package": lambda keys: {"env_package": "water_column"},
+    },
+    "urn:embrc.eu:emobon:pfam": sample_workloads(),
+    "urn:embrc.eu:emobon:ssu": sample_workloads({
+        "phylum": lambda keys: {"phylum": "Proteobacteria", "abundance_lower": 2},
+    }),
+    "urn:embrc.eu:emobon:top_terms": {
+        "go": lambda keys: {"table": "go", "n": 10},
+        "ko_obs_id": lambda keys: {"table": "ko", "n": 25, "obs_id": keys["obs_id"][0]},
+    },
+}
+
+# tables read by the queries, the benchmarks of missing tables are skipped
+TABLES = {
+    "urn:embrc.eu:emobon:go": "metagoflow_analyses.go.parquet",
+    "urn:embrc.eu:emobon:go_slim": "metagoflow_analyses.go_slim.parquet",
+    "urn:embrc.eu:emobon:ips": "metagoflow_analyses.ips.parquet",
+    "urn:embrc.eu:emobon:ko": "metagoflow_analyses.ko.parquet",
+    "urn:embrc.eu:emobon:logsheets": "Batch1and2_combined_logsheets_2024-11-12.parquet",
+    "urn:embrc.eu:emobon:lsu": "metagoflow_analyses.LSU.parquet",
+    "urn:embrc.eu:emobon:observatories": "Observatory_combined_logsheets_validated.parquet",
+    "urn:embrc.eu:emobon:pfam": "metagoflow_analyses.pfam.parquet",
+    "urn:embrc.eu:emobon:ssu": "metagoflow_analyses.SSU.parquet",
+}
+
+
+def test_workloads_cover_registry():
+    assert set(WORKLOADS) == set(QUERY_REGISTRY)
+
+
+def rows(data) -> int:
+    if isinstance(data, dict):
+        return sum(len(table) for table in data.values())
+    return len(data)
+
+
+def make_broker(engine: str, dataset):
+    if engine == "duckdb":
+        pytest.importorskip("duckdb")
+        from mgo.brokers.duckdb import DuckDBBroker
+        return DuckDBBroker(data_dir=dataset)
+    return LocalBroker(cache=TableCache(), data_dir=dataset)
+
+
+@pytest.mark.parametrize("engine", ["local", "duckdb"])
+@pytest.mark.parametrize("cache", ["cold", "warm"])
+@pytest.mark.parametrize(
+    "query_name, workload",
+    [(query_name, workload) for query_name, workloads in WORKLOADS.items() for workload in workloads],
+)
+def test_query(benchmark, dataset, keys, scale, query_name, workload, cache, engine):
+    if query_name in TABLES and not (dataset / TABLES[query_name]).exists():
+        pytest.skip(f"missing table {TABLES[query_name]}")
+    params = WORKLOADS[query_name][workload](keys)
+    benchmark.group = f"{query_name.rsplit(':', 1)[-1]}:{workload}"
+    benchmark.extra_info.update(scale=scale, cache=cache, engine=engine)
+
+    if cache == "warm":
+        broker = make_broker(engine, dataset)
+        broker.execute(query_name, params)
+        result = benchmark(broker.execute, query_name, params)
+    else:
+        result = benchmark.pedantic(
+            lambda broker: broker.execute(query_name, params),
+            setup=lambda: ((make_broker(engine, dataset),), {}),
+            rounds=3,
+        )
+
+    broker = make_broker(engine, dataset)
+    if cache == "warm":
+        broker.execute(query_name, params)
+    with PeakRSS() as rss:
+        broker.execute(query_name, params)
+
+    count = rows(result.data())
+    benchmark.extra_info.update(rows=count, peak_rss_mib=round(rss.peak / 2**20, 1))
+    if benchmark.stats is not None and benchmark.stats.stats.mean > 0:
+        benchmark.extra_info["rows_per_sec"] = round(count / benchmark.stats.stats.mean)
+
+
+@pytest.mark.parametrize("cache", ["cached", "uncached"])
+@pytest.mark.parametrize("mode", ["loop", "many"])
+def test_execute_many(benchmark, dataset, keys, scale, mode, cache):
+    """
+    A pipeline of GO, KO and PFAM queries of 100 samples, each table queried
+    per batch of 10 samples, executed one by one or with execute_many.
+    """
+    batches = [keys["ref_code"][i:i + 10] for i in range(0, 100, 10)]
+    requests = [(f"urn:embrc.eu:emobon:{table}", {"ref_code": batch})
+                for table in ("go", "ko", "pfam") for batch in batches
+                if (dataset / TABLES[f"urn:embrc.eu:emobon:{table}"]).exists()]
+    benchmark.group = "execute_many"
+    benchmark.extra_info.update(scale=scale, cache=cache, mode=mode, queries=len(requests))
+
+    def run(broker):
+        if mode == "many":
+            return broker.execute_many(requests)
+        return [broker.execute(name, params) for name, params in requests]
+
+    results = benchmark.pedantic(
+        run,
+        setup=lambda: ((LocalBroker(cache=TableCache() if cache == "cached" else None, data_dir=dataset),), {}),
+        rounds=3,
+    )
+    benchmark.extra_info["rows"] = sum(rows(result.data()) for result in results)
+
+
+@pytest.mark.parametrize("result_cache", ["off", "hit"])
+@pytest.mark.parametrize(
+    "query_name, workload",
+    [
+        ("urn:embrc.eu:emobon:ssu", "phylum"),
+        ("urn:embrc.eu:emobon:top_terms", "ko_obs_id"),
+        ("urn:embrc.eu:emobon:join", "ko_water_column"),
+    ],
+)
+def test_result_cache(benchmark, tmp_path, dataset, keys, scale, query_name, workload, result_cache):
+    """
+    A query rerun by a new process (new broker with an empty table cache),
+    computed from the tables or served from the on-disk result cache.
+    """
+    params = WORKLOADS[query_name][workload](keys)
+    benchmark.group = f"result_cache:{query_name.rsplit(':', 1)[-1]}:{workload}"
+    benchmark.extra_info.update(scale=scale, result_cache=result_cache)
+
+    def make():
+        results = ResultCache(tmp_path) if result_cache == "hit" else None
+        return LocalBroker(cache=TableCache(), data_dir=dataset, result_cache=results)
+
+    make().execute(query_name, params)
+    result = benchmark.pedantic(lambda broker: broker.execute(query_name, params), setup=lambda: ((make(),), {}), rounds=3)
+    benchmark.extra_info["rows"] = rows(result.data())
@@ -15,7 +15,13 @@ import os
 import pandas as pd
 import logging
 
-from contracts.utils_contracts import check_diffs, rewrite_file, reconfig_logger
+from contracts.utils_contracts import (
+    check_diffs,
+    rewrite_file,
+    reconfig_logger,
+    write_typed_copy,
+    OBSERVATORIES_DTYPES,
+)
 
 # set root path to the parent directory
 ROOT = os.path.dirname(os.path.dirname(__file__))
@@ -41,3 +47,5 @@ if __name__ == "__main__":
     data = pull_observatories()
     if check_diffs(data, path=CSV_LOCAL_PATH, logger=logger):
         rewrite_file(data, path=CSV_LOCAL_PATH)
+    typed_path = write_typed_copy(CSV_LOCAL_PATH, OBSERVATORIES_DTYPES)
+    logger.info(f"Typed copy written to {typed_path}")
@@ -1,12 +1,64 @@
 import os
-import pandas as pd
 import logging
+import typing
+
+# imported by the functions, mgo.namedqueries only reads the schemas below
+if typing.TYPE_CHECKING:
+    import pandas as pd
 
 
 FORMAT = "%(levelname)s | %(name)s | %(message)s"  # for logger
 
+LOGSHEETS_MEASUREMENTS = [
+    "depth", "samp_size_vol", "size_frac_low", "size_frac_up", "membr_cut",
+    "samp_store_temp", "store_temp_hq", "chlorophyll", "sea_surf_temp",
+    "sea_subsurf_temp", "sea_surf_salinity", "sea_subsurf_salinity", "alkalinity",
+    "ammonium", "bac_prod", "biomass", "conduc", "density", "diss_carb_dioxide",
+    "diss_inorg_carb", "diss_org_carb", "diss_org_nitro", "down_par", "diss_oxygen",
+    "n_alkanes", "nitrate", "nitrite", "ph", "part_org_carb", "part_org_nitro",
+    "petroleum_hydrocarb", "phaeopigments", "phosphate", "pressure", "primary_prod",
+    "silicate", "sulfate", "sulfide", "turbidity", "water_current",
+]
+
+# measurements with a <measurement>_method column, whether they were taken
+LOGSHEETS_METHODS = [
+    "chlorophyll", "sea_surf_temp", "sea_subsurf_temp", "sea_surf_salinity",
+    "sea_subsurf_salinity", "alkalinity", "ammonium", "bac_prod", "biomass",
+    "conduc", "density", "diss_carb_dioxide", "diss_inorg_carb", "diss_org_carb",
+    "diss_org_nitro", "down_par", "diss_oxygen", "n_alkanes", "nitrate", "nitrite",
+    "organism_count", "ph", "part_org_carb", "part_org_nitro", "petroleum_hydrocarb",
+    "phaeopigments", "phosphate", "pigments", "pressure", "primary_prod", "silicate",
+    "sulfate", "sulfide", "turbidity", "water_current",
+]
+
+# explicit dtypes of the typed copies read by LocalBroker
+LOGSHEETS_DTYPES = {
+    "scientific_name": "category",
+    "investigation_type": "category",
+    "env_material": "category",
+    "collection_date": "datetime64[ns]",
+    "tidal_stage": "category",
+    "size_frac": "category",
+    "tax_id": "int64",
+    "env_package": "category",
+    **{column: "float64" for column in LOGSHEETS_MEASUREMENTS},
+}
+
+OBSERVATORIES_DTYPES = {
+    "latitude": "float64",
+    "longitude": "float64",
+    "loc_broad_ocean": "category",
+    "loc_broad_ocean_mrgid": "int64",
+    "loc_regional_mrgid": "int64",
+    "loc_loc_mrgid": "int64",
+    "env_broad_biome": "category",
+    "env_package": "category",
+    "tot_depth_water_col": "float64",
+    "organization_country": "category",
+}
 
-def check_diffs(data: pd.DataFrame, path: str, logger) -> bool:
+
+def check_diffs(data: "pd.DataFrame", path: str, logger) -> bool:
     """Check differences between the current and the previous version of the file."""
 
     # if the file does not exist, there is no need to show the differences
@@ -15,6 +67,8 @@ def check_diffs(data: pd.DataFrame, path: str, logger) -> bool:
         data.to_csv(path)
         return False
 
+    import pandas as pd
+
     previous = pd.read_csv(path, index_col=[0])
 
     diffs = data.compare(previous, result_names=("current", "previous"))
@@ -29,7 +83,7 @@ def check_diffs(data: pd.DataFrame, path: str, logger) -> bool:
     return True
 
 
-def rewrite_file(data: pd.DataFrame, path: str) -> None:
+def rewrite_file(data: "pd.DataFrame", path: str) -> None:
     """Ask for confirmation and rewrite the file."""
 
     if (
@@ -45,3 +99,35 @@ def reconfig_logger(format=FORMAT, level=logging.INFO):
     """(Re-)configure logging"""
     logging.basicConfig(format=format, level=level, force=True)
     logging.debug("Logging.basicConfig completed successfully")
+
+
+def apply_dtypes(data: "pd.DataFrame", dtypes: dict) -> "pd.DataFrame":
+    """Cast the columns of `data` to `dtypes`, invalid values become missing."""
+    import pandas as pd
+
+    data = data.copy()
+    for column, dtype in dtypes.items():
+        if column not in data.columns:
+            continue
+        if dtype.startswith("datetime64"):
+            data[column] = pd.to_datetime(data[column], errors="coerce")
+        elif dtype in ("float64", "int64"):
+            values = pd.to_numeric(data[column], errors="coerce")
+            data[column] = values.astype("Int64" if values.isna().any() and dtype == "int64" else dtype)
+        else:
+            data[column] = data[column].astype(dtype)
+    return data
+
+
+def write_typed_copy(path: str, dtypes: dict) -> str:
+    """Write a typed parquet copy of the CSV at `path` next to it.
+
+    LocalBroker reads the parquet copy instead of the CSV when it exists, so
+    it has to be rewritten whenever the CSV changes.
+    """
+    import pandas as pd
+
+    data = pd.read_csv(path, index_col=[0])
+    typed_path = os.path.splitext(path)[0] + ".parquet"
+    apply_dtypes(data, dtypes).to_parquet(typed_path)
+    return typed_path
@@ -0,0 +1,124 @@
+"""
+Aggregations of the metaGOflow tables computed by the brokers, so that clients
+receive per-sample summaries instead of every row they are computed from.
+
+The brokers first sum the abundance of the filtered rows per ref_code and
+feature (`rollup`); the functions below shape the sums into the result of each
+query.
+"""
+
+from typing import List
+
+import pandas as pd
+
+from .namedqueries import QueryName
+from .queries import RANKS
+
+
+AGGREGATE_TABLES: dict[QueryName, List[str]] = {
+    "urn:embrc.eu:emobon:abundance_by_rank": ['lsu', 'ssu'],
+    "urn:embrc.eu:emobon:abundance_matrix": ['go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu'],
+    "urn:embrc.eu:emobon:top_terms": ['go', 'go_slim', 'ips', 'ko', 'pfam'],
+}
+"""Tables each aggregation query can be computed on."""
+
+
+TERMS: dict[str, List[str]] = {
+    'go': ['id', 'name'],
+    'go_slim': ['id', 'name'],
+    'ips': ['accession', 'description'],
+    'ko': ['entry', 'name'],
+    'pfam': ['entry', 'name'],
+}
+"""Columns describing the terms of the functional tables, identifier first."""
+
+
+DEFAULT_TOP = 10
+"""Number of terms per sample returned by top_terms by default."""
+
+
+def table(name: QueryName, params: dict) -> str:
+    """Table the aggregation query `name` is computed on."""
+    value = params.get('table')
+    if value is None:
+        raise ValueError(f'query "{name}" requires a table')
+    if value not in AGGREGATE_TABLES[name]:
+        raise ValueError(f'invalid table "{value}"')
+    return value
+
+
+def keys(name: QueryName, table: str, params: dict) -> List[str]:
+    """Columns, besides ref_code, the abundance is summed by."""
+    if name == "urn:embrc.eu:emobon:abundance_by_rank":
+        rank = params.get('rank')
+        if rank not in RANKS:
+            raise ValueError(f'invalid rank "{rank}"')
+        return [rank]
+    if name == "urn:embrc.eu:emobon:top_terms":
+        return TERMS[table]
+    feature = params.get('feature', TERMS[table][0] if table in TERMS else 'ncbi_tax_id')
+    valid = TERMS[table][:1] if table in TERMS else ['ncbi_tax_id', *RANKS]
+    if feature not in valid:
+        raise ValueError(f'invalid feature "{feature}"')
+    return [feature]
+
+
+def top(params: dict) -> int:
+    """Number of terms per sample requested from top_terms."""
+    n = params.get('n', DEFAULT_TOP)
+    if not isinstance(n, int) or n < 1:
+        raise ValueError('n should be a positive integer')
+    return n
+
+
+def normalize(sums: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Sums with plain key columns, sorted by ref_code, decreasing abundance
+    then keys. Missing keys (unassigned ranks) are None."""
+    for column in ['ref_code', *keys]:
+        values = sums[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+            values = values.astype(object)
+            sums[column] = values.where(values.notna(), None)
+    order = ['ref_code', 'abundance', *keys]
+    ascending = [True, False, *[True] * len(keys)]
+    return sums.sort_values(order, ascending=ascending, na_position='last', kind='stable').reset_index(drop=True)
+
+
+def rollup(data: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Abundance of the rows of `data` summed per ref_code and `keys`, with
+    rows of missing keys summed together."""
+    sums = data.groupby(['ref_code', *keys], observed=True, dropna=False, sort=False)['abundance'].sum()
+    return normalize(sums.reset_index(), keys)
+
+
+def top_terms(sums: pd.DataFrame, n: int) -> pd.DataFrame:
+    """The `n` most abundant terms of each sample."""
+    return sums.groupby('ref_code', sort=False).head(n).reset_index(drop=True)
+
+
+def matrix(sums: pd.DataFrame, feature: str) -> pd.DataFrame:
+    """Wide sample × feature frame of the sums, with sparse columns filled
+    with 0. Rows of missing features are left out.
+
+    The frame is built at once from a COO matrix of the sample and feature
+    codes, so no dense matrix of all samples and features is held.
+    """
+    try:
+        from scipy import sparse
+    except ImportError:
+        raise Exception('the abundance matrix requires scipy')
+    sums = sums.loc[sums[feature].notna()]
+    rows, samples = pd.factorize(sums['ref_code'], sort=True)
+    columns, features = pd.factorize(sums[feature], sort=True)
+    coo = sparse.coo_matrix((sums['abundance'].to_numpy(), (rows, columns)), shape=(len(samples), len(features)))
+    return pd.DataFrame.sparse.from_spmatrix(
+        coo, index=pd.Index(samples, name='ref_code'), columns=pd.Index(features, name=feature))
+
+
+def finish(name: QueryName, sums: pd.DataFrame, keys: List[str], params: dict) -> pd.DataFrame:
+    """Result of the aggregation query `name` from the normalized sums."""
+    if name == "urn:embrc.eu:emobon:top_terms":
+        return top_terms(sums, top(params))
+    if name == "urn:embrc.eu:emobon:abundance_matrix":
+        return matrix(sums, keys[0])
+    return sums
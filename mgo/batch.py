@@ -0,0 +1,34 @@
+"""
+Helpers to answer several queries of the same table with a single read.
+
+The table is read once for the union of the samples the queries select, and
+each query then filters only those rows (see `LocalBroker.execute_many`).
+"""
+
+from typing import List
+
+from . import filters
+from .filters import Predicate
+
+
+def union(predicates: List[List[Predicate]]) -> List[Predicate]:
+    """Predicate selecting the samples of all the queries with these
+    predicates, empty (the whole table) if one of them selects no samples."""
+    samples = []
+    for query in predicates:
+        selection = next((p for p in query if p.column == 'ref_code' and p.op in ('==', 'in')), None)
+        if selection is None:
+            return []
+        samples.extend([selection.value] if selection.op == '==' else selection.value)
+    return [Predicate('ref_code', 'in', list(dict.fromkeys(samples)))]
+
+
+def columns(requests: List[tuple[List[Predicate], dict]], available) -> List[str] | None:
+    """Columns to read to answer all the requests, None for all of them."""
+    needed = []
+    for predicates, params in requests:
+        requested = filters.columns(params, available)
+        if requested is None:
+            return None
+        needed += requested + [p.column for p in predicates if p.column in available]
+    return list(dict.fromkeys(needed))
@@ -1,9 +1,38 @@
+import asyncio
+import os
+import threading
+import time
+import typing
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
 from udal.specification import NamedQueryInfo
 
+from . import instrument
 from .namedqueries import QueryName
-from .result import Result
+
+if typing.TYPE_CHECKING:
+    from .result import Result
+
+
+ASYNC_WORKERS = int(os.environ.get('MGO_ASYNC_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
+"""Number of threads running the queries awaited with `aexecute`,
+overridable with the MGO_ASYNC_WORKERS environment variable."""
+
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    """Thread pool shared by the awaited queries of all brokers. Queries
+    beyond its `ASYNC_WORKERS` threads wait for a free one."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='mgo-query')
+        return _executor
 
 
 class Broker(ABC):
@@ -16,5 +45,54 @@ class Broker(ABC):
         pass
 
     @abstractmethod
-    def execute(self, name: QueryName, params: dict | None = None) -> Result:
-        pass
\ No newline at end of file
+    def execute(self, name: QueryName, params: dict | None = None, stream: bool = False) -> 'Result':
+        pass
+
+    def execute_many(self, requests: List[tuple[QueryName, dict | None]]) -> List['Result']:
+        """Execute several named queries, returning their results in order.
+
+        Brokers which can share the reads of the queries override this, by
+        default they are executed one after the other.
+        """
+        return [self.execute(name, params) for name, params in requests]
+
+    async def aexecute(
+            self,
+            name: QueryName,
+            params: dict | None = None,
+            stream: bool = False,
+            timeout: float | None = None,
+            ) -> 'Result':
+        """Execute a named query without blocking the event loop.
+
+        The file I/O and decoding run in the shared thread pool (`executor`),
+        so many queries can be gathered concurrently. The tables of
+        `all_by_ref_code` are loaded as concurrent tasks. A `timeout` in
+        seconds raises `asyncio.TimeoutError`. Cancelling the task drops
+        queries not started yet; running ones complete in their thread and
+        are discarded.
+        """
+        return await asyncio.wait_for(self.__aexecute(name, params, stream), timeout)
+
+    async def __aexecute(self, name: QueryName, params: dict | None, stream: bool) -> 'Result':
+        loop = asyncio.get_running_loop()
+        params = params or {}
+        if name != "urn:embrc.eu:emobon:all_by_ref_code" or stream or params.get('lazy', False):
+            return await loop.run_in_executor(executor(), self.execute, name, params, stream)
+
+        # the loaders of the lazy result are run as one task per table
+        result = await loop.run_in_executor(executor(), self.execute, name, {**params, 'lazy': True})
+        # the tables as the broker produces them, Arrow tables on its arrow backend
+        tables = result.native()
+        profile = result.metadata.get('profile')
+
+        def load(table: str):
+            # the stages of the loads are added to the profile of the query
+            with instrument.resume(profile):
+                return tables[table]
+
+        loaded = await asyncio.gather(*(loop.run_in_executor(executor(), load, table) for table in tables))
+        if profile is not None:
+            profile['seconds'] = (time.time_ns() - profile['start_ns']) / 1e9
+        from .result import Result
+        return Result(result.query, dict(zip(tables, loaded)), result.metadata)
@@ -0,0 +1,32 @@
+"""
+Brokers answering the named queries: `local.LocalBroker` over the tables
+with pandas or Arrow, `duckdb.DuckDBBroker` with SQL and `remote.RemoteBroker`
+through an `mgo.server`.
+
+The brokers import pandas and pyarrow. This package only lists the queries
+of the local broker, so that `UDAL().queries` does not import it.
+"""
+
+from typing import List
+
+from ..namedqueries import QueryName
+
+
+localBrokerQueryNames: List[QueryName] = [
+    "urn:embrc.eu:emobon:abundance_by_rank",  # abundance of LSU or SSU summed per sample and rank
+    "urn:embrc.eu:emobon:abundance_matrix",   # sample x feature abundance, sparse
+    "urn:embrc.eu:emobon:all_by_ref_code",  # this should use ref codes from logsheets and query all the tables at once
+    "urn:embrc.eu:emobon:go",               # columns 'ref_code', 'id', 'name', 'aspect', 'abundance'
+    "urn:embrc.eu:emobon:go_slim",          # columns 'ref_code', 'id', 'name', 'aspect', 'abundance'
+    "urn:embrc.eu:emobon:ips",              # 'ref_code', 'accession', 'description', 'abundance'
+    "urn:embrc.eu:emobon:join",             # rows of a table for the samples matching logsheets and observatories filters
+    "urn:embrc.eu:emobon:ko",               # 'ref_code', 'entry', 'name', 'abundance'
+    "urn:embrc.eu:emobon:logsheets",
+    # LSU: 'ref_code', 'ncbi_tax_id', 'abundance', 'superkingdom', 'kingdom','phylum', 'class', 'order', 'family', 'genus', 'species'
+    "urn:embrc.eu:emobon:lsu",              
+    "urn:embrc.eu:emobon:observatories",
+    "urn:embrc.eu:emobon:pfam",             # 'ref_code', 'entry', 'name', 'abundance'
+    # SSU: 'ref_code', 'ncbi_tax_id', 'abundance', 'superkingdom', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'
+    "urn:embrc.eu:emobon:ssu",              # SSU tables
+    "urn:embrc.eu:emobon:top_terms",        # most abundant terms of each sample
+]
@@ -0,0 +1,315 @@
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Mapping
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .. import aggregate, filters, joins, partition, queries
+from ..broker import Broker
+from ..catalog import Catalog, Location
+from ..namedqueries import NamedQueryInfo, QueryName, QUERY_NAMES
+from ..result import Batches, LazyTables, Result
+from .local import localBrokerQueries, localBrokerQueryNames
+
+
+logger = logging.getLogger(__name__)
+
+
+def _reader(result: duckdb.DuckDBPyConnection, batch_size: int) -> pa.RecordBatchReader:
+    # fetch_record_batch was renamed in DuckDB 1.5
+    if hasattr(result, 'to_arrow_reader'):
+        return result.to_arrow_reader(batch_size)
+    return result.fetch_record_batch(batch_size)
+
+
+class _Relation:
+    """Table of the catalog as the source of SQL queries.
+
+    `sql` is the FROM clause reading the table, either a DuckDB table function
+    over a local parquet file or a view registered under the table name for
+    Arrow data (remote and partitioned tables, CSV tables decoded by pandas).
+    """
+
+    def __init__(self, sql: str, schema: pa.Schema, register=None, hidden: List[str] = (), csv: bool = False):
+        self.sql = sql
+        self.schema = schema
+        self.register = register
+        self.hidden = hidden
+        self.csv = csv
+
+    def columns(self, params: dict) -> List[str]:
+        """Requested columns, with those pandas restores as the index."""
+        requested = filters.columns(params, self.schema.names)
+        if requested is None:
+            return [c for c in self.schema.names if c not in self.hidden]
+        index_columns = [
+            c for c in (self.schema.pandas_metadata or {}).get('index_columns', [])
+            if isinstance(c, str) and c not in requested
+        ]
+        return index_columns + requested
+
+
+class DuckDBBroker(Broker):
+    """Broker answering the named queries with SQL on DuckDB.
+
+    Serves the tables of the same catalog as LocalBroker and returns the same
+    frames, but scans them with DuckDB: local parquet files are read by its
+    own multithreaded reader with the predicates and columns pushed down, so
+    tables are never decoded in full, and nothing is kept between queries
+    except the decoded CSV tables.
+    """
+
+    _query_names: List[QueryName] = localBrokerQueryNames
+
+    _queries: dict[QueryName, NamedQueryInfo] = localBrokerQueries
+
+    def __init__(
+            self,
+            categorical: bool = True,
+            batch_size: int = 65_536,
+            data_dir: str | os.PathLike | None = None,
+            catalog: Catalog | Mapping | str | os.PathLike | None = None,
+            threads: int | None = None,
+            ):
+        """Broker over the tables of a `catalog` or `data_dir`, as for
+        LocalBroker. With `categorical` the string columns of the metaGOflow
+        tables are returned as pandas categoricals. Streamed queries are read
+        in batches of at most `batch_size` rows.
+
+        DuckDB uses `threads` threads per query, one per core by default.
+        """
+        if data_dir is not None and catalog is not None:
+            raise Exception('pass either data_dir or catalog')
+        self._catalog = Catalog(data_dir) if data_dir is not None else Catalog.from_config(catalog)
+        self._categorical = categorical
+        self._batch_size = batch_size
+        self._connection = duckdb.connect(config={'threads': threads} if threads else {})
+        self._csv: dict[str, tuple[tuple[int, int], pa.Table]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def queryNames(self) -> List[str]:
+        return list(DuckDBBroker._query_names)
+
+    @property
+    def queries(self):
+        return { k: v for k, v in DuckDBBroker._queries.items() }
+
+    @property
+    def catalog(self) -> Catalog:
+        """Catalog of the tables served by this broker."""
+        return self._catalog
+
+    def __categorical(self, name: str) -> bool:
+        # typed copies carry their own dtypes, metaGOflow tables follow the option
+        return self._categorical and self._catalog[name].format == 'parquet'
+
+    def __decode_csv(self, name: str, location: Location) -> pa.Table:
+        """CSV table as decoded by pandas, kept until its file changes."""
+        fingerprint = location.fingerprint()
+        with self._lock:
+            cached = self._csv.get(name)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        schema = self._catalog[name].schema or {}
+        with location.open() as f:
+            data = pd.read_csv(f, index_col=[0])
+        table = pa.Table.from_pandas(data.astype({c: t for c, t in schema.items() if c in data.columns}))
+        with self._lock:
+            self._csv[name] = (fingerprint, table)
+        return table
+
+    def __relation(self, name: str) -> _Relation:
+        entry = self._catalog[name]
+        view = filters.quote(name)
+        if entry.partitioning:
+            location = self._catalog.location(name)
+            dataset = ds.dataset(
+                location.path,
+                format='parquet',
+                filesystem=location.filesystem,
+                partitioning=partition.partitioning(entry.partitioning),
+                exclude_invalid_files=True,
+            )
+            return _Relation(view, dataset.schema, dataset, hidden=entry.partitioning)
+        location, format = self._catalog.source(name)
+        if format == 'csv':
+            table = self.__decode_csv(name, location)
+            return _Relation(view, table.schema, table, csv=True)
+        schema = pq.read_schema(location.path, filesystem=location.filesystem)
+        if location.local is None:
+            # DuckDB cannot open fsspec URLs, Arrow scans them with the filters pushed down
+            dataset = ds.dataset(location.path, format='parquet', filesystem=location.filesystem)
+            return _Relation(view, schema, dataset)
+        path = str(location.local).replace("'", "''")
+        return _Relation(f"read_parquet('{path}')", schema)
+
+    def __cursor(self, relations: List[tuple[str, _Relation]]) -> duckdb.DuckDBPyConnection:
+        # each query has its own cursor, registered views are private to it
+        with self._lock:
+            cursor = self._connection.cursor()
+        for name, relation in relations:
+            if relation.register is not None:
+                cursor.register(name, relation.register)
+        return cursor
+
+    def __observatories(self, name: str, params: dict) -> List[filters.Predicate]:
+        """Predicates selecting the rows of the observatories in `params`,
+        through the samples of the logsheets unless the table is partitioned
+        by observatory."""
+        predicates = filters.equality(params, 'obs_id')
+        if not predicates or 'obs_id' in (self._catalog[name].partitioning or []):
+            return predicates
+        # a list of values keeps the scan order, which a semi-join would not
+        logsheets = self.__relation('logsheets')
+        condition, values = filters.to_sql(predicates, logsheets.schema)
+        samples = self.__cursor([('logsheets', logsheets)]).execute(
+            f'SELECT DISTINCT CAST(ref_code AS VARCHAR) FROM {logsheets.sql} WHERE ref_code IS NOT NULL AND {condition}',
+            values,
+        ).fetchall()
+        return [filters.Predicate('ref_code', 'in', [sample for sample, in samples])]
+
+    def __typed(self, table: pa.Table | pa.RecordBatch, relation: _Relation, categorical: bool):
+        """Arrow data of a query with the types and pandas metadata of the
+        source table, as pandas would have read it."""
+        fields = []
+        for field in table.schema:
+            if field.name in relation.schema.names:
+                field = relation.schema.field(field.name)
+            if categorical and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)) \
+                    and field.name not in relation.hidden:
+                field = field.with_type(pa.dictionary(pa.int32(), field.type))
+            fields.append(field)
+        return table.cast(pa.schema(fields, metadata=relation.schema.metadata))
+
+    def __query(
+            self,
+            name: str,
+            predicates: List[filters.Predicate],
+            params: dict,
+            stream: bool = False,
+            ) -> pd.DataFrame | Batches:
+        relation = self.__relation(name)
+        columns = relation.columns(params)
+        if name in queries.METAGOFLOW_TABLES:
+            predicates = predicates + self.__observatories(name, params)
+        condition, values = filters.to_sql(predicates, relation.schema)
+        relations = [(name, relation)]
+        sql = f'SELECT {", ".join(map(filters.quote, columns))} FROM {relation.sql} WHERE {condition}'
+        categorical = self.__categorical(name)
+
+        if stream:
+            def batches():
+                reader = _reader(self.__cursor(relations).execute(sql, values), self._batch_size)
+                for batch in reader:
+                    yield self.__typed(batch, relation, categorical)
+            schema = self.__typed(pa.schema([relation.schema.field(c) for c in columns]).empty_table(),
+                                  relation, categorical).schema
+            return Batches(batches, schema)
+
+        table = _reader(self.__cursor(relations).execute(sql, values), self._batch_size).read_all()
+        data = self.__typed(table, relation, categorical).to_pandas()
+        if relation.csv:
+            # pandas reads missing strings of CSV files as NaN, Arrow gives None
+            strings = data.select_dtypes(object).columns
+            data[strings] = data[strings].where(data[strings].notna(), np.nan)
+        return data
+
+    def __execute_all_by_ref_code(self, params: dict) -> Mapping[str, pd.DataFrame]:
+        """The tables of the samples, as for LocalBroker. Tables missing from
+        the catalog are left out of the result."""
+        names = ['go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu', 'logsheets']
+        predicates = filters.equality(params, 'ref_code')
+
+        loaders = {}
+        for name in names:
+            entry = self._catalog[name]
+            location = self._catalog.location(name) if entry.partitioning else self._catalog.source(name)[0]
+            if location.exists():
+                loaders[name] = functools.partial(self.__query, name, predicates, {})
+            else:
+                logger.warning(f'table {name} not found at {location}')
+
+        if params.get('lazy', False):
+            return LazyTables(loaders)
+        with ThreadPoolExecutor(max_workers=len(loaders) or 1) as executor:
+            futures = { name: executor.submit(loader) for name, loader in loaders.items() }
+            return { name: future.result() for name, future in futures.items() }
+
+    def __samples(self, params: dict) -> List[str]:
+        """Samples of the join query, from the logsheets semi-joined to the
+        matching observatories in a single SQL query."""
+        logsheets = self.__relation('logsheets')
+        condition, values = filters.to_sql(
+            queries.predicates('logsheets', joins.nested(params, 'logsheets') or {}), logsheets.schema)
+        relations = [('logsheets', logsheets)]
+        sql = f'SELECT DISTINCT CAST(ref_code AS VARCHAR) FROM {logsheets.sql} AS samples ' \
+              f'WHERE ref_code IS NOT NULL AND {condition}'
+        observatories = joins.nested(params, 'observatories')
+        if observatories is not None:
+            sites = self.__relation('observatories')
+            site_condition, site_values = filters.to_sql(queries.predicates('observatories', observatories), sites.schema)
+            on = ' AND '.join(f'sites.{c} = samples.{c}' for c in map(filters.quote, joins.SITE))
+            sql += f' AND EXISTS (SELECT 1 FROM {sites.sql} AS sites WHERE {on} AND {site_condition})'
+            values += site_values
+            relations.append(('observatories', sites))
+        return [sample for sample, in self.__cursor(relations).execute(sql, values).fetchall()]
+
+    def __join(self, params: dict, stream: bool = False) -> pd.DataFrame | Batches:
+        """Rows of the table of the join query for the samples matching the
+        metadata filters, see `LocalBroker`."""
+        table = joins.table(params)
+        predicates = [filters.Predicate('ref_code', 'in', self.__samples(params)), *queries.predicates(table, params)]
+        return self.__query(table, predicates, params, stream)
+
+    def __aggregate(self, name: QueryName, params: dict) -> pd.DataFrame:
+        """Result of an aggregation query, summed with GROUP BY. Only the
+        sums, or the top terms of each sample, leave DuckDB."""
+        table = aggregate.table(name, params)
+        keys = aggregate.keys(name, table, params)
+        relation = self.__relation(table)
+        predicates = queries.predicates(table, params) + self.__observatories(table, params)
+        condition, values = filters.to_sql(predicates, relation.schema)
+        groups = ', '.join(map(filters.quote, ['ref_code', *keys]))
+        # SUM widens integers to HUGEINT
+        total = 'BIGINT' if pa.types.is_integer(relation.schema.field('abundance').type) else 'DOUBLE'
+        sql = f'SELECT {groups}, CAST(SUM(abundance) AS {total}) AS abundance ' \
+              f'FROM {relation.sql} WHERE {condition} GROUP BY {groups}'
+        if name == "urn:embrc.eu:emobon:top_terms":
+            order = ', '.join(f'{filters.quote(key)} ASC NULLS LAST' for key in keys)
+            sql += f' QUALIFY row_number() OVER (PARTITION BY ref_code ORDER BY SUM(abundance) DESC, {order})' \
+                   f' <= {aggregate.top(params)}'
+        sums = _reader(self.__cursor([(table, relation)]).execute(sql, values), self._batch_size).read_all()
+        return aggregate.finish(name, aggregate.normalize(sums.to_pandas(), keys), keys, params)
+
+    def execute(self, name: QueryName, params: dict | None = None, stream: bool = False) -> Result:
+        """Execute a named query as an SQL query, see `LocalBroker.execute`."""
+        query = DuckDBBroker._queries.get(name)
+        queryParams = params or {}
+        if name == "urn:embrc.eu:emobon:all_by_ref_code":
+            if stream:
+                raise ValueError(f'query "{name}" cannot be streamed')
+            data = self.__execute_all_by_ref_code(queryParams)
+        elif name in queries.QUERY_TABLES:
+            table = queries.QUERY_TABLES[name]
+            data = self.__query(table, queries.predicates(table, queryParams), queryParams, stream)
+        elif name in aggregate.AGGREGATE_TABLES:
+            if stream:
+                raise ValueError(f'query "{name}" cannot be streamed')
+            data = self.__aggregate(name, queryParams)
+        elif name == "urn:embrc.eu:emobon:join":
+            data = self.__join(queryParams, stream)
+        else:
+            if name in QUERY_NAMES:
+                raise KeyError(f'unsupported query name "{name}"')
+            else:
+                raise KeyError(f'unknown query name "{name}"')
+        return Result(query, data)
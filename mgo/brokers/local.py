@@ -1,41 +1,419 @@
-import pandas as pd
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
 import pathlib
-from typing import List
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import typing
+from typing import Callable, List, Literal, Mapping, NamedTuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.ipc
+import pyarrow.parquet as pq
 
+from .. import aggregate, batch, filters, instrument, joins, partition, queries
 from ..broker import Broker
+from . import localBrokerQueryNames
+from ..catalog import Catalog, Location
+from ..index import ColumnIndex
 from ..namedqueries import NamedQueryInfo, QueryName, QUERY_NAMES, QUERY_REGISTRY
-from ..result import Result
+from ..result import Batches, LazyTables, Result, frame_table, table_frame
 
 
-
-localBrokerQueryNames: List[QueryName] = [
-    "urn:embrc.eu:emobon:all_by_ref_code",  # this should use ref codes from logsheets and query all the tables at once
-    "urn:embrc.eu:emobon:go",               # columns 'ref_code', 'id', 'name', 'aspect', 'abundance'
-    "urn:embrc.eu:emobon:go_slim",          # columns 'ref_code', 'id', 'name', 'aspect', 'abundance'
-    "urn:embrc.eu:emobon:ips",              # 'ref_code', 'accession', 'description', 'abundance'
-    "urn:embrc.eu:emobon:ko",               # 'ref_code', 'entry', 'name', 'abundance'
-    "urn:embrc.eu:emobon:logsheets",
-    # LSU: 'ref_code', 'ncbi_tax_id', 'abundance', 'superkingdom', 'kingdom','phylum', 'class', 'order', 'family', 'genus', 'species'
-    "urn:embrc.eu:emobon:lsu",              
-    "urn:embrc.eu:emobon:observatories",
-    "urn:embrc.eu:emobon:pfam",             # 'ref_code', 'entry', 'name', 'abundance'
-    # SSU: 'ref_code', 'ncbi_tax_id', 'abundance', 'superkingdom', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'
-    "urn:embrc.eu:emobon:ssu",              # SSU tables
-]
+logger = logging.getLogger(__name__)
 
 
 localBrokerQueries: dict[QueryName, NamedQueryInfo] = \
     { k: v for k, v in QUERY_REGISTRY.items() if k in localBrokerQueryNames }
 
 
+Backend = Literal['pandas', 'arrow']
+"""Storage backends of LocalBroker."""
+
+
+DEFAULT_CACHE_BYTES = int(os.environ.get('MGO_CACHE_BYTES', 1024 ** 3))
+"""Default memory budget of the shared table cache, overridable with the
+MGO_CACHE_BYTES environment variable."""
+
+
+DEFAULT_RESULT_CACHE_BYTES = int(os.environ.get('MGO_RESULT_CACHE_BYTES', 4 * 1024 ** 3))
+"""Default disk budget of result caches, overridable with the
+MGO_RESULT_CACHE_BYTES environment variable."""
+
+
+Table = pd.DataFrame | pa.Table
+"""Decoded table, a DataFrame or a (memory-mapped) Arrow table."""
+
+
+class _CacheEntry(NamedTuple):
+    fingerprint: tuple[int, int]
+    data: Table
+    nbytes: int
+    indexes: dict[str, ColumnIndex]
+
+
+class TableCache:
+    """In-process LRU cache of decoded tables keyed by file path.
+
+    An entry is reloaded when the modification time or size of its file
+    changes, and least recently used entries are evicted once the decoded
+    frames exceed `max_bytes`. Frames larger than the budget are never kept.
+    Arrow tables count the size of the buffers they reference, even when
+    those are memory-mapped.
+
+    The `index_columns` present in a table are indexed when it is loaded,
+    reusing the index persisted next to the file when it is up to date.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES, index_columns: tuple[str, ...] = ('ref_code',)):
+        self.max_bytes = max_bytes
+        self.index_columns = index_columns
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        # lock of each table being loaded and the number of requests using it
+        self._loading: dict[str, list] = {}
+        # decoded sizes of the tables refused for exceeding the budget
+        self._refused: dict[str, tuple[tuple[int, int], int]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._evicted_bytes = 0
+
+
+    @staticmethod
+    def _nbytes(data: Table) -> int:
+        if isinstance(data, pa.Table):
+            return data.get_total_buffer_size()
+        return int(data.memory_usage(index=True, deep=True).sum())
+
+    @staticmethod
+    def _column(data: Table, column: str):
+        if isinstance(data, pa.Table):
+            return data.column(column).to_pandas() if column in data.column_names else None
+        return data[column] if column in data.columns else None
+
+    def get(
+            self,
+            path: pathlib.Path | Location,
+            loader: Callable[[pathlib.Path], Table],
+            variant: str = '',
+            indexed: bool = True,
+            ) -> Table:
+        """Return the table stored at `path`, decoding it with `loader` on a
+        miss or when the file changed since it was cached.
+
+        Different decodings of the same file are cached apart by `variant`.
+        Data derived from the file with other rows, such as aggregates, is
+        cached with `indexed` off, as the indexes of the file do not apply.
+        """
+        data, _ = self.table(path, loader, variant, indexed)
+        return data
+
+    def table(
+            self,
+            path: pathlib.Path | Location,
+            loader: Callable[[pathlib.Path], Table],
+            variant: str = '',
+            indexed: bool = True,
+            ) -> tuple[Table, dict[str, ColumnIndex]]:
+        """Like `get`, also returning the indexes of the table by column."""
+        location, key = TableCache._key(path, variant)
+        fingerprint = location.fingerprint()
+        with self._lock:
+            entry = self._lookup(key, fingerprint)
+            if entry is not None:
+                return entry.data, entry.indexes
+            loading = self._loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+
+        # decode outside the cache lock so different tables load concurrently,
+        # while concurrent requests for the same table wait for a single load
+        try:
+            with loading[0]:
+                with self._lock:
+                    entry = self._lookup(key, fingerprint, count=False)
+                    if entry is not None:
+                        return entry.data, entry.indexes
+                data = loader(path)
+                nbytes = TableCache._nbytes(data)
+                indexes = {}
+                for column in self.index_columns if indexed else ():
+                    values = TableCache._column(data, column)
+                    if values is None:
+                        continue
+                    if location.local is not None:
+                        indexes[column] = ColumnIndex.open(location.local, column, fingerprint, values)
+                    else:
+                        # remote tables have nowhere to persist their indexes
+                        indexes[column] = ColumnIndex.build(values)
+                with self._lock:
+                    self._drop(key)
+                    if nbytes <= self.max_bytes:
+                        self._entries[key] = _CacheEntry(fingerprint, data, nbytes, indexes)
+                        self._nbytes += nbytes
+                        self._refused.pop(key, None)
+                        self._evict()
+                    else:
+                        self._refused[key] = (fingerprint, nbytes)
+        finally:
+            with self._lock:
+                # forget the lock once no request waits on it
+                loading[1] -= 1
+                if loading[1] == 0:
+                    del self._loading[key]
+        return data, indexes
+
+    @staticmethod
+    def _key(path: pathlib.Path | Location, variant: str) -> tuple[Location, str]:
+        location = path if isinstance(path, Location) else Location(path)
+        return location, f'{location}#{variant}' if variant else str(location)
+
+    def fits(self, path: pathlib.Path | Location, variant: str = '') -> bool | None:
+        """Whether the table at `path` is cached (True), known to decode to
+        more than the budget (False), or was not loaded since it last
+        changed (None)."""
+        location, key = TableCache._key(path, variant)
+        fingerprint = location.fingerprint()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.fingerprint == fingerprint:
+                return True
+            refused = self._refused.get(key)
+            if refused is not None and refused[0] == fingerprint:
+                return refused[1] <= self.max_bytes
+        return None
+
+    def refuse(self, path: pathlib.Path | Location, nbytes: int, variant: str = '') -> None:
+        """Remember that the table at `path` decodes to at least `nbytes`,
+        more than the budget, without loading it."""
+        location, key = TableCache._key(path, variant)
+        fingerprint = location.fingerprint()
+        with self._lock:
+            self._refused[key] = (fingerprint, nbytes)
+
+    def _lookup(self, key: str, fingerprint: tuple[int, int], count: bool = True) -> _CacheEntry | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry.fingerprint == fingerprint:
+            self._entries.move_to_end(key)
+            if count:
+                self._hits += 1
+            return entry
+        if count:
+            self._misses += 1
+        return None
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry.nbytes
+
+    def _evict(self) -> None:
+        while self._nbytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._nbytes -= entry.nbytes
+            self._evictions += 1
+            self._evicted_bytes += entry.nbytes
+
+    def holds(self, data: Table) -> bool:
+        """Whether `data` is a frame owned by the cache."""
+        with self._lock:
+            return any(entry.data is data for entry in self._entries.values())
+
+    def invalidate(self, path: pathlib.Path | Location | None = None) -> None:
+        """Drop the entries for `path`, or every entry if no path is given."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._refused.clear()
+                self._nbytes = 0
+            else:
+                for key in [k for k in self._entries if k == str(path) or k.startswith(f'{path}#')]:
+                    self._drop(key)
+                for key in [k for k in self._refused if k == str(path) or k.startswith(f'{path}#')]:
+                    del self._refused[key]
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters of the cache."""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'evicted_bytes': self._evicted_bytes,
+                'entries': len(self._entries),
+                'nbytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+TABLE_CACHE = TableCache()
+"""Table cache shared by all LocalBroker instances of the process."""
+
+
+class ResultCache:
+    """On-disk cache of query results, shared by the processes using the
+    same `directory` (`py-udal-mgo/results` in the temporary directory by
+    default).
+
+    Results are stored as Arrow IPC files named by the hash of the query,
+    its parameters and the fingerprints (modification time and size) of
+    the files it reads, so changed tables are never answered from stale
+    results. The least recently used results are deleted once the files
+    exceed `max_bytes`.
+    """
+
+    SUFFIX = '.arrow'
+
+    FRAME = b'mgo.frame'
+    """Schema metadata of the results stored from a DataFrame, returned as
+    one when read back."""
+
+    VERSION = 2
+    """Version of the stored results, part of the keys of the queries."""
+
+    def __init__(self, directory: str | os.PathLike | None = None, max_bytes: int = DEFAULT_RESULT_CACHE_BYTES):
+        if directory is None:
+            directory = pathlib.Path(tempfile.gettempdir(), 'py-udal-mgo', 'results')
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hash of the JSON of `parts`, with the keys of dicts sorted."""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def __path(self, key: str) -> pathlib.Path:
+        return self.directory / f'{key}{ResultCache.SUFFIX}'
+
+    def get(self, key: str) -> pa.Table | None:
+        """The memory-mapped table stored under `key`, None on a miss."""
+        path = self.__path(key)
+        try:
+            table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+            # the modification time orders the entries for eviction
+            os.utime(path)
+        except (OSError, pa.ArrowInvalid):
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            self._hits += 1
+        return table
+
+    def put(self, key: str, table: pa.Table) -> None:
+        """Store `table` under `key`, evicting the least recently used
+        results beyond the budget. Tables larger than the budget are not
+        stored."""
+        if table.get_total_buffer_size() > self.max_bytes:
+            return
+        path = self.__path(key)
+        partial = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with pa.OSFile(str(partial), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(partial, path)
+        except OSError as e:
+            logger.warning(f'could not store the result {key}: {e}')
+            partial.unlink(missing_ok=True)
+            return
+        self.__evict()
+
+    def __entries(self) -> List[tuple[float, int, pathlib.Path]]:
+        entries = []
+        for path in self.directory.glob(f'*{ResultCache.SUFFIX}'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def __evict(self) -> None:
+        entries = sorted(self.__entries())
+        nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if nbytes <= self.max_bytes:
+                break
+            # other processes may evict the same entries
+            path.unlink(missing_ok=True)
+            nbytes -= size
+
+    def clear(self) -> None:
+        """Delete all the stored results."""
+        for _, _, path in self.__entries():
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        """Hit and miss counters of this process, and the stored results."""
+        entries = self.__entries()
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'entries': len(entries),
+                'nbytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+            }
+
+
 class LocalBroker(Broker):
 
     _query_names: List[QueryName] = localBrokerQueryNames
 
     _queries: dict[QueryName, NamedQueryInfo] = localBrokerQueries
 
-    def __init__(self):
-        pass
+    def __init__(
+            self,
+            cache: TableCache | None = TABLE_CACHE,
+            categorical: bool = True,
+            backend: Backend = 'pandas',
+            batch_size: int = 65_536,
+            data_dir: str | os.PathLike | None = None,
+            catalog: Catalog | Mapping | str | os.PathLike | None = None,
+            result_cache: ResultCache | None = None,
+            ):
+        """Broker over the tables of a `catalog`, the `contracts` directory by
+        default (see `Catalog.from_config` for the accepted forms). Passing a
+        `data_dir` (path or URL) serves the default tables from that root
+        instead, such as synthetic datasets written by `mgo.synthetic`.
+
+        Decoded tables are kept in `cache` (None disables caching). With
+        `categorical` the string columns of the metaGOflow tables are decoded
+        as pandas categoricals, also in the returned frames.
+
+        The 'arrow' `backend` keeps each table as a memory-mapped Arrow IPC
+        file, converted once next to the source, and answers queries with
+        Arrow tables which are zero-copy views where possible. Processes
+        serving the same tables then share the OS page cache.
+
+        Streamed queries are read in batches of at most `batch_size` rows.
+
+        Results are also kept on disk in `result_cache`, when given, and
+        served from it while the tables they are read from are unchanged.
+        """
+        if backend not in typing.get_args(Backend):
+            raise Exception(f'unknown backend "{backend}"')
+        self._cache = cache
+        self._categorical = categorical
+        self._backend = backend
+        self._batch_size = batch_size
+        if data_dir is not None and catalog is not None:
+            raise Exception('pass either data_dir or catalog')
+        self._catalog = Catalog(data_dir) if data_dir is not None else Catalog.from_config(catalog)
+        self._result_cache = result_cache
 
     @property
     def queryNames(self) -> List[str]:
@@ -45,264 +423,662 @@ class LocalBroker(Broker):
     def queries(self):
         return { k: v for k, v in LocalBroker._queries.items() }
 
+    @property
+    def cache(self) -> TableCache | None:
+        """The table cache used by this broker, None if caching is off."""
+        return self._cache
+
+    @property
+    def result_cache(self) -> ResultCache | None:
+        """The on-disk result cache used by this broker, None if off."""
+        return self._result_cache
+
+    @property
+    def catalog(self) -> Catalog:
+        """Catalog of the tables served by this broker."""
+        return self._catalog
+
+    def __source(self, name: str) -> tuple[Location, Literal['parquet', 'csv']]:
+        """Location and format of the file to read the table `name` from."""
+        return self._catalog.source(name)
+
+    def __categorical(self, name: str) -> bool:
+        # typed copies carry their own dtypes, metaGOflow tables follow the option
+        return self._categorical and self._catalog[name].format == 'parquet'
+
+    def __load(
+            self,
+            location: Location,
+            loader: Callable[[Location], Table],
+            variant: str = '',
+            ) -> tuple[Table, dict[str, ColumnIndex]]:
+        with instrument.stage('load', table=location.name) as record:
+            if self._cache is None:
+                data, indexes = loader(location), {}
+                record['cache'] = 'off'
+            else:
+                loaded = []
+
+                def load(location):
+                    loaded.append(location)
+                    return loader(location)
+                data, indexes = self._cache.table(location, load, variant)
+                record['cache'] = 'miss' if loaded else 'hit'
+            record['bytes_read'] = location.fingerprint()[1] if record['cache'] != 'hit' else 0
+            record['rows'] = len(data)
+        return data, indexes
+
     @staticmethod
-    def _datasetPath(filename: str):
-        base = pathlib.Path(__file__).parent.parent.parent
-        return base.joinpath('contracts', filename)
-    
-    def __execute_all_by_ref_code(self, params: dict) -> dict:
-        "This is the only query which return dictionary of DFs"
-        paths = [
-            ('metagoflow_analyses.go.parquet', 'go'),
-            ('metagoflow_analyses.go_slim.parquet', 'go_slim'),
-            ('metagoflow_analyses.ips.parquet', 'ips'),
-            ('metagoflow_analyses.ko.parquet', 'ko'),
-            ('metagoflow_analyses.LSU.parquet', 'lsu'),
-            ('metagoflow_analyses.pfam.parquet', 'pfam'),
-            ('metagoflow_analyses.SSU.parquet', 'ssu'),
-            ('Batch1and2_combined_logsheets_2024-11-12.csv', 'logsheets'),
-            ]
-
-        data = {}
-        for path, name in paths:
-            try:
-                df = pd.read_parquet(LocalBroker._datasetPath(path))
-            except:
-                pd.read_csv(LocalBroker._datasetPath('Batch1and2_combined_logsheets_2024-11-12.csv'), index_col=[0])
-            df = self.__filter_data(df, params, 'ref_code')
-            data[name] = df
-        return data
-    
-    def __execute_go(self, params: dict):
-        data = pd.read_parquet(LocalBroker._datasetPath('metagoflow_analyses.go.parquet'))
-        data = self.__filter_data(data, params, 'ref_code')
-        data = self.__filter_data(data, params, 'id')
-        data = self.__filter_data(data, params, 'name')
-        data = self.__filter_data(data, params, 'aspect')
-        data = self.__filter_abundance(data, params)
-        return data
+    def __dictionary_columns(location: Location) -> List[str]:
+        # dictionary-encoded strings become categoricals in pandas
+        return [
+            field.name for field in pq.read_schema(location.path, filesystem=location.filesystem)
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+        ]
 
-    def __execute_go_slim(self, params: dict):
-        data = pd.read_parquet(LocalBroker._datasetPath('metagoflow_analyses.go_slim.parquet'))
-        data = self.__filter_data(data, params, 'ref_code')
-        data = self.__filter_data(data, params, 'id')
-        data = self.__filter_data(data, params, 'name')
-        data = self.__filter_data(data, params, 'aspect')
-        data = self.__filter_abundance(data, params)
-        return data
-    
-    def __execute_ips(self, params: dict):
-        data = pd.read_parquet(LocalBroker._datasetPath('metagoflow_analyses.ips.parquet'))
-        data = self.__filter_data(data, params, 'ref_code')
-        data = self.__filter_data(data, params, 'accession')
-        data = self.__filter_data(data, params, 'description')
-        data = self.__filter_abundance(data, params)
-        return data
+    @staticmethod
+    def __decode_parquet(location: Location, categorical: bool, columns=None, filters=None) -> pd.DataFrame:
+        return pd.read_parquet(
+            location.path,
+            filesystem=location.filesystem,
+            columns=columns,
+            filters=filters,
+            read_dictionary=LocalBroker.__dictionary_columns(location) if categorical else None,
+        )
 
-    def __execute_ko(self, params: dict):
-        data = pd.read_parquet(LocalBroker._datasetPath('metagoflow_analyses.ko.parquet'))
-        data = self.__filter_data(data, params, 'ref_code')
-        data = self.__filter_data(data, params, 'entry')
-        data = self.__filter_data(data, params, 'name')
-        data = self.__filter_abundance(data, params)
+    def __read_pushdown(self, name: str, location: Location, columns, predicates: List[filters.Predicate], schema) -> pd.DataFrame:
+        """Rows of a parquet table satisfying the predicates, decoding only the
+        matching row groups and the `columns`."""
+        with instrument.stage('read', table=location.name, pushdown=True) as record:
+            data = LocalBroker.__decode_parquet(
+                location, self.__categorical(name), columns=columns, filters=filters.to_arrow(predicates, schema))
+            record['rows_out'] = len(data)
+            record['nbytes'] = int(data.memory_usage(index=True, deep=True).sum())
         return data
 
-    def __execute_logsheets(self, params: dict):
-        data = pd.read_csv(LocalBroker._datasetPath('Batch1and2_combined_logsheets_2024-11-12.csv'), index_col=[0])
-        if 'source_mat_id' in params.keys():
-            source_mat_id = params['source_mat_id']
-            if isinstance(source_mat_id, str):
-                data = data.loc[data['source_mat_id'] == source_mat_id]
-            elif isinstance(source_mat_id, list):
-                data = data.loc[data['source_mat_id'].isin(source_mat_id)]
-
-        if 'tax_id' in params.keys():
-            tax_id = params['tax_id']
-            if isinstance(tax_id, int):
-                data = data.loc[data['tax_id'] == tax_id]
-            elif isinstance(tax_id, list):
-                data = data.loc[data['tax_id'].isin(tax_id)]
-
-        if 'scientific_name' in params.keys():
-            scientific_name = params['scientific_name']
-            if scientific_name not in ['marine plankton metagenome', 'marine sediment metagenome', 'metagenome']:
-                raise Exception(f'invalid scientific_name "{scientific_name}"')
-            
-            if isinstance(scientific_name, str):
-                data = data.loc[data['scientific_name'] == scientific_name]
-            elif isinstance(scientific_name, list):
-                data = data.loc[data['scientific_name'].isin(scientific_name)]
-
-        if 'investigation_type' in params.keys():
-            investigation_type = params['investigation_type']
-            if isinstance(investigation_type, str):
-                data = data.loc[data['investigation_type'] == investigation_type]
-            elif isinstance(investigation_type, list):
-                data = data.loc[data['investigation_type'].isin(investigation_type)]
-
-        if 'collection_date' in params.keys():
-            collection_date = params['collection_date']
-            if isinstance(collection_date, str):
-                data = data.loc[data['collection_date'] == collection_date]
-            elif isinstance(collection_date, list):
-                data = data.loc[data['collection_date'].isin(collection_date)]
-
-        if 'tidal_stage' in params.keys():
-            tidal_stage = params['tidal_stage']
-            if tidal_stage not in ['no_tide', 'low_tide', 'high_tide', 'flood_tide', 'ebb_tide']:
-                raise Exception(f'invalid tidal_stage "{tidal_stage}"')
-            
-            if isinstance(tidal_stage, str):
-                data = data.loc[data['tidal_stage'] == tidal_stage]
-            elif isinstance(tidal_stage, list):
-                data = data.loc[data['tidal_stage'].isin(tidal_stage)]
+    @staticmethod
+    def __decode_csv(location: Location, schema: dict[str, str] | None, chunksize: int | None = None, dtype=None):
+        def typed(data: pd.DataFrame) -> pd.DataFrame:
+            return data.astype({c: t for c, t in (schema or {}).items() if c in data.columns})
 
-        return data
+        if chunksize is None:
+            with location.open() as f:
+                return typed(pd.read_csv(f, index_col=[0]))
 
-    def __execute_lsu(self, params: dict):
-        data = pd.read_parquet(LocalBroker._datasetPath('metagoflow_analyses.LSU.parquet'))
-        data = self.__filter_data(data, params, 'ref_code')
-        # no this is int
-        # data = self.__filter_data(data, params, 'ncbi_tax_id')
-        if 'ncbi_tax_id' in params.keys():
-            ncbi_tax_id = params['ncbi_tax_id']
-            if isinstance(ncbi_tax_id, int):
-                data = data.loc[data['ncbi_tax_id'] == ncbi_tax_id]
-            elif isinstance(ncbi_tax_id, list):
-                data = data.loc[data['ncbi_tax_id'].isin(ncbi_tax_id)]
-
-        # abundance TODO: this has to be fixed in the parquet file, where there are floats.
-        data = self.__filter_abundance(data, params)
-        data = self.__filter_data(data, params, 'superkingdom')
-        data = self.__filter_data(data, params, 'kingdom')
-        data = self.__filter_data(data, params, 'phylum')
-        data = self.__filter_data(data, params, 'class')
-        data = self.__filter_data(data, params, 'order')
-        data = self.__filter_data(data, params, 'family')
-        data = self.__filter_data(data, params, 'genus')
-        data = self.__filter_data(data, params, 'species')
-        return data
-    
-    def __execute_observatories(self, params: dict):
-        data = pd.read_csv(LocalBroker._datasetPath('Observatory_combined_logsheets_validated.csv'), index_col=[0])
-        data = self.__filter_data(data, params, 'obs_id')
-        data = self.__filter_data(data, params, 'country')
-        data = self.__filter_data(
-            data,
-            params,
-            'env_package',
-            valid_values=['soft_sediment', 'hard_sediment', 'water_column'],
+        def chunks():
+            with location.open() as f:
+                for chunk in pd.read_csv(f, index_col=[0], chunksize=chunksize, dtype=dtype):
+                    yield typed(chunk)
+        return chunks()
+
+    def __read(self, name: str) -> tuple[pd.DataFrame, dict[str, ColumnIndex]]:
+        location, format = self.__source(name)
+        if format == 'csv':
+            loader = functools.partial(LocalBroker.__decode_csv, schema=self._catalog[name].schema)
+            return self.__load(location, loader)
+        loader = functools.partial(LocalBroker.__decode_parquet, categorical=self.__categorical(name))
+        return self.__load(location, loader, self.__variant(name))
+
+    def __variant(self, name: str) -> str:
+        # cache variant of the frames of the parquet table `name`
+        return 'categorical' if self.__categorical(name) else ''
+
+    def __map_arrow(self, location: Location, categorical: bool, schema: dict[str, str] | None) -> pa.Table:
+        """Memory-map the Arrow IPC copy of the table at `location`, writing
+        it first if it is missing or older than the table. Copies of remote
+        tables are kept in the temporary directory."""
+        name = f'{location.name}.dict.arrow' if categorical else f'{location.name}.arrow'
+        source = '{}:{}'.format(*location.fingerprint())
+        if schema:
+            # a copy of a CSV holds the dtypes it was read with
+            source += ':' + hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:12]
+        source = source.encode()
+        directories = [pathlib.Path(tempfile.gettempdir(), 'py-udal-mgo')]
+        if location.local is not None:
+            directories.insert(0, location.local.parent)
+        else:
+            name = f'{hashlib.sha1(location.url.encode()).hexdigest()[:12]}-{name}'
+        for directory in directories:
+            ipc = directory / name
+            try:
+                if ipc.exists():
+                    with pa.memory_map(str(ipc)) as f:
+                        metadata = pa.ipc.open_file(f).schema.metadata or {}
+                    if metadata.get(b'mgo.source') == source:
+                        break
+                directory.mkdir(parents=True, exist_ok=True)
+                self.__write_arrow(location, ipc, categorical, schema, source)
+                break
+            except OSError as e:
+                logger.debug(f'could not write {ipc}: {e}')
+        else:
+            raise Exception(f'no writable location for the Arrow copy of {location}')
+        # the table references the mapped pages, nothing is read eagerly
+        return pa.ipc.open_file(pa.memory_map(str(ipc))).read_all()
+
+    def __write_arrow(
+            self,
+            location: Location,
+            ipc: pathlib.Path,
+            categorical: bool,
+            schema: dict[str, str] | None,
+            source: bytes,
+            ) -> None:
+        if location.suffix == '.csv':
+            table = pa.Table.from_pandas(LocalBroker.__decode_csv(location, schema))
+        else:
+            table = pq.read_table(
+                location.path,
+                filesystem=location.filesystem,
+                read_dictionary=LocalBroker.__dictionary_columns(location) if categorical else None,
             )
-        # TODO: filter integers too
-        # data = self.__filter_data(data, params, 'loc_regional_mgrid')
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'mgo.source': source})
+        partial = ipc.with_name(f'{ipc.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with pa.OSFile(str(partial), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(partial, ipc)
 
-        if 'loc_regional_mgrid' in params.keys():
-            loc_regional_mgrid = params['loc_regional_mgrid']
-            if isinstance(loc_regional_mgrid, int):
-                data = data.loc[data['loc_regional_mgrid'] == loc_regional_mgrid]
-            elif isinstance(loc_regional_mgrid, list):
-                data = data.loc[data['loc_regional_mgrid'].isin(loc_regional_mgrid)]
+    def __read_arrow(self, name: str) -> tuple[pa.Table, dict[str, ColumnIndex]]:
+        location, _ = self.__source(name)
+        categorical = self.__categorical(name)
+        loader = functools.partial(self.__map_arrow, categorical=categorical, schema=self._catalog[name].schema)
+        return self.__load(location, loader, 'arrow-categorical' if categorical else 'arrow')
 
+    def __query(
+            self,
+            name: str,
+            predicates: List[filters.Predicate],
+            params: dict,
+            stream: bool = False,
+            ) -> Table | Batches:
+        if self._catalog[name].partitioning:
+            return self.__query_partitioned(name, predicates, params, stream)
+        if stream:
+            return self.__stream(name, predicates, params)
+        if self._backend == 'arrow':
+            return self.__query_arrow(name, predicates, params)
+        location, format = self.__source(name)
+        if format == 'parquet':
+            return self.__query_parquet(name, location, predicates, params)
+        data, indexes = self.__read(name)
+        return self.__project(filters.FilterPlan(predicates).apply(data, indexes), params)
+
+    def __query_arrow(self, name: str, predicates: List[filters.Predicate], params: dict) -> pa.Table:
+        table, indexes = self.__read_arrow(name)
+        columns = filters.columns(params, table.column_names)
+        table = filters.FilterPlan(predicates).apply_table(table, indexes)
+        return table if columns is None else table.select(LocalBroker.__with_index(table.schema, columns))
+
+    @staticmethod
+    def __with_index(schema: pa.Schema, columns: List[str]) -> List[str]:
+        # keep the columns pandas restores as the index
+        index_columns = [
+            c for c in (schema.pandas_metadata or {}).get('index_columns', [])
+            if isinstance(c, str) and c not in columns
+        ]
+        return index_columns + columns
+
+    def __stream(self, name: str, predicates: List[filters.Predicate], params: dict) -> Batches:
+        """Batches of the rows satisfying the predicates, read and filtered
+        one batch at a time from the source file."""
+        location, format = self.__source(name)
+        if format == 'csv':
+            plan = filters.FilterPlan(predicates)
+            schema = self._catalog[name].schema
+            # the types are inferred for each chunk: read the chunks once to
+            # unify them, and again with the unified types, so that all the
+            # batches have the types of the table read at once
+            dtypes = LocalBroker.__unify_dtypes([
+                chunk.dtypes for chunk in LocalBroker.__decode_csv(location, schema, chunksize=self._batch_size)])
+            read = {c: t for c, t in dtypes.items() if not isinstance(t, pd.CategoricalDtype)}
+            chunks = lambda: LocalBroker.__decode_csv(location, schema, chunksize=self._batch_size, dtype=read)
+            target = self.__csv_schema(next(iter(chunks()), None), dtypes, params)
+            def csv_batches():
+                for chunk in chunks():
+                    chunk = self.__project(plan.apply(chunk.astype(dtypes)), params)
+                    # the pandas metadata of categorical columns differs between chunks
+                    yield pa.RecordBatch.from_pandas(chunk, schema=target).replace_schema_metadata(target.metadata)
+            return Batches(csv_batches, target)
+
+        dictionary_columns = LocalBroker.__dictionary_columns(location) if self.__categorical(name) else []
+        format = ds.ParquetFileFormat(read_options={'dictionary_columns': dictionary_columns})
+        dataset = ds.dataset(location.path, filesystem=location.filesystem, format=format)
+        columns = filters.columns(params, dataset.schema.names)
+        if columns is not None:
+            columns = LocalBroker.__with_index(dataset.schema, columns)
+        expression = filters.to_arrow(predicates, dataset.schema)
+        schema = dataset.schema if columns is None else pa.schema(
+            [dataset.schema.field(c) for c in columns], metadata=dataset.schema.metadata)
+        # row groups whose statistics exclude the predicates are not read
+        return Batches(
+            lambda: dataset.to_batches(columns=columns, filter=expression, batch_size=self._batch_size),
+            schema,
+        )
+
+    @staticmethod
+    def __unify_dtypes(chunks: List[pd.Series]) -> dict:
+        """dtype of each column over the dtypes of the chunks of a CSV table,
+        as if read at once: numbers become floats, other mixes objects."""
+        dtypes = {}
+        for column in chunks[0].index if chunks else []:
+            found = {chunk[column] for chunk in chunks}
+            if len(found) == 1:
+                dtypes[column] = found.pop()
+            elif all(isinstance(dtype, pd.CategoricalDtype) for dtype in found):
+                dtypes[column] = pd.CategoricalDtype()
+            elif all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) for dtype in found):
+                dtypes[column] = pd.api.types.pandas_dtype('float64')
+            else:
+                dtypes[column] = pd.api.types.pandas_dtype('object')
+        return dtypes
+
+    def __csv_schema(self, chunk: pd.DataFrame | None, dtypes: dict, params: dict) -> pa.Schema | None:
+        """Arrow schema of the batches of a CSV table with the unified `dtypes`:
+        strings for the object columns, even where a chunk holds only NaN."""
+        if chunk is None:
+            return None
+        schema = pa.Schema.from_pandas(self.__project(chunk.astype(dtypes), params))
+        for i, field in enumerate(schema):
+            dtype = dtypes.get(field.name)
+            if pd.api.types.is_object_dtype(dtype):
+                schema = schema.set(i, field.with_type(pa.string()))
+            elif isinstance(dtype, pd.CategoricalDtype):
+                schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), pa.string())))
+        return schema
+
+    def __prune(self, location: Location, predicates: List[filters.Predicate]) -> List[str] | None:
+        """Files of a partitioned table holding the ref_codes selected by the
+        predicates, from its manifest. None if the files cannot be pruned."""
+        values = next((
+            [p.value] if p.op == '==' else p.value
+            for p in predicates if p.column == 'ref_code' and p.op in ('==', 'in')
+        ), None)
+        manifest_location = location.joinpath(partition.MANIFEST)
+        if values is None or not manifest_location.exists():
+            return None
+        manifest, indexes = self.__load(
+            manifest_location, lambda loc: pd.read_parquet(loc.path, filesystem=loc.filesystem))
+        files = sorted(filters.FilterPlan([filters.Predicate('ref_code', 'in', values)])
+                       .apply(manifest, indexes)['path'].unique())
+        if not files and len(manifest):
+            # a single file gives the schema of the empty result
+            files = [manifest['path'].iloc[0]]
+        return [f'{location.path.rstrip("/")}/{path}' for path in files] or None
+
+    def __partitioned_dataset(self, name: str, predicates: List[filters.Predicate]) -> ds.Dataset:
+        """Dataset over the files of a partitioned table which may hold rows
+        satisfying the predicates. Other partitions are not opened."""
+        location = self._catalog.location(name)
+        columns = self._catalog[name].partitioning
+        options = {'filesystem': location.filesystem, 'partitioning': partition.partitioning(columns)}
+        files = self.__prune(location, predicates)
+        if files is None:
+            dataset = ds.dataset(location.path, format='parquet', **options)
+        else:
+            dataset = ds.dataset(files, format='parquet', partition_base_dir=location.path, **options)
+        if not self.__categorical(name):
+            return dataset
+        dictionary_columns = [
+            field.name for field in dataset.schema
+            if field.name not in columns and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type))
+        ]
+        format = ds.ParquetFileFormat(read_options={'dictionary_columns': dictionary_columns})
+        return ds.dataset(dataset.files, format=format, partition_base_dir=location.path, **options)
+
+    def __query_partitioned(
+            self,
+            name: str,
+            predicates: List[filters.Predicate],
+            params: dict,
+            stream: bool,
+            ) -> Table | Batches:
+        """Rows of a partitioned table satisfying the predicates, read from
+        the partitions which may hold them. Partition columns are left out
+        unless requested."""
+        dataset = self.__partitioned_dataset(name, predicates)
+        columns = filters.columns(params, dataset.schema.names) or [
+            c for c in dataset.schema.names if c not in self._catalog[name].partitioning
+        ]
+        expression = filters.to_arrow(predicates, dataset.schema)
+        if stream:
+            schema = pa.schema([dataset.schema.field(c) for c in columns], metadata=dataset.schema.metadata)
+            return Batches(
+                lambda: dataset.to_batches(columns=columns, filter=expression, batch_size=self._batch_size),
+                schema,
+            )
+        with instrument.stage('read', table=name, partitioned=True) as record:
+            table = dataset.to_table(columns=columns, filter=expression)
+            record['rows_out'] = table.num_rows
+            record['nbytes'] = table.nbytes
+        return table if self._backend == 'arrow' else table.to_pandas()
+
+    def __observatories(self, name: str, params: dict) -> List[filters.Predicate]:
+        """Predicates selecting the rows of the observatories in `params`,
+        through the samples of the logsheets unless the table is partitioned
+        by observatory."""
+        predicates = filters.equality(params, 'obs_id')
+        if not predicates or 'obs_id' in (self._catalog[name].partitioning or []):
+            return predicates
+        logsheets, indexes = self.__read('logsheets')
+        samples = filters.FilterPlan(predicates).apply(logsheets, indexes)['ref_code'].dropna().astype(str)
+        return [filters.Predicate('ref_code', 'in', list(dict.fromkeys(samples)))]
+
+    def __fits_cache(self, name: str, location: Location) -> bool:
+        """Whether the parquet table `name` is read through the cache. Tables
+        which decoded to more than its budget are remembered by the cache
+        until they change, and read with the filters pushed down."""
+        variant = self.__variant(name)
+        known = self._cache.fits(location, variant)
+        if known is not None:
+            return known
+        # the uncompressed size in the footer is a lower bound of the decoded
+        # frame, often by far: tables within it are loaded once to learn theirs
+        with location.open() as f:
+            metadata = pq.ParquetFile(f).metadata
+        size = sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+        if size > self._cache.max_bytes:
+            self._cache.refuse(location, size, variant)
+            return False
+        return True
+
+    def __query_parquet(
+            self,
+            name: str,
+            location: Location,
+            predicates: List[filters.Predicate],
+            params: dict,
+            ) -> pd.DataFrame:
+        """Rows of a parquet table satisfying the predicates.
+
+        Tables that fit in the cache are decoded once and filtered in memory.
+        Otherwise the predicates and the requested columns are pushed down to
+        the parquet reader, so only matching row groups and rows are decoded.
+        """
+        if self._cache is not None and self.__fits_cache(name, location):
+            data, indexes = self.__read(name)
+            columns = filters.columns(params, data.columns)
+            # numbered from 0 as when read with pushdown, whatever the cache holds
+            renumber = isinstance(data.index, pd.RangeIndex)
+            data = filters.FilterPlan(predicates).apply(data, indexes)
+            data = data.reset_index(drop=True) if renumber else data
+            return data if columns is None else data[columns]
+
+        schema = pq.read_schema(location.path, filesystem=location.filesystem)
+        return self.__read_pushdown(name, location, filters.columns(params, schema.names), predicates, schema)
+
+    def __query_many(self, name: str, requests: List[tuple[List[filters.Predicate], dict]]) -> List[Table]:
+        """Rows of the table `name` for each (predicates, params) request,
+        from a single read of the union of the samples they select.
+
+        The union is read as a query on its own would be: from the cached
+        table through its index, or pushed down to the parquet reader. Each
+        request then filters only the rows read.
+        """
+        if len(requests) == 1 or self._catalog[name].partitioning:
+            return [self.__query(name, predicates, params) for predicates, params in requests]
+        scope = batch.union([predicates for predicates, _ in requests])
+
+        if self._backend == 'arrow':
+            table, indexes = self.__read_arrow(name)
+            table = filters.FilterPlan(scope).apply_table(table, indexes)
+            results = []
+            for predicates, params in requests:
+                columns = filters.columns(params, table.column_names)
+                selected = filters.FilterPlan(predicates).apply_table(table)
+                results.append(selected if columns is None
+                               else selected.select(LocalBroker.__with_index(selected.schema, columns)))
+            return results
+
+        location, format = self.__source(name)
+        if format == 'parquet' and not (self._cache is not None and self.__fits_cache(name, location)):
+            schema = pq.read_schema(location.path, filesystem=location.filesystem)
+            data = self.__read_pushdown(name, location, batch.columns(requests, schema.names), scope, schema)
+            renumber = isinstance(data.index, pd.RangeIndex)
+        else:
+            data, indexes = self.__read(name)
+            renumber = format == 'parquet' and isinstance(data.index, pd.RangeIndex)
+            data = filters.FilterPlan(scope).apply(data, indexes)
+        results = []
+        for predicates, params in requests:
+            # parquet tables without row labels are numbered from 0, as in __query_parquet
+            selected = self.__project(filters.FilterPlan(predicates).apply(data), params)
+            results.append(selected.reset_index(drop=True) if renumber else selected)
+        return results
+
+    def __project(self, data: pd.DataFrame, params: dict) -> pd.DataFrame:
+        columns = filters.columns(params, data.columns)
+        return data if columns is None else data[columns]
+
+    def __detach(self, data):
+        # unfiltered queries would hand out the cached frame itself, Arrow
+        # tables are immutable and can be shared
+        if isinstance(data, dict):
+            return { k: self.__detach(v) for k, v in data.items() }
+        if isinstance(data, pd.DataFrame) and self._cache is not None and self._cache.holds(data):
+            with instrument.stage('copy', rows=len(data)):
+                return data.copy()
         return data
     
-    def __execute_pfam(self, params: dict):
-        data = pd.read_parquet(LocalBroker._datasetPath('metagoflow_analyses.pfam.parquet'))
-        data = self.__filter_data(data, params, 'ref_code')
-        data = self.__filter_data(data, params, 'entry')
-        data = self.__filter_data(data, params, 'name')
-        data = self.__filter_abundance(data, params)
-        return data
-    
-    def __execute_ssu(self, params: dict):
-        data = pd.read_parquet(LocalBroker._datasetPath('metagoflow_analyses.SSU.parquet'))
-        data = self.__filter_data(data, params, 'ref_code')
-        # no this is int
-        # data = self.__filter_data(data, params, 'ncbi_tax_id')
-        if 'ncbi_tax_id' in params.keys():
-            ncbi_tax_id = params['ncbi_tax_id']
-            if isinstance(ncbi_tax_id, int):
-                data = data.loc[data['ncbi_tax_id'] == ncbi_tax_id]
-            elif isinstance(ncbi_tax_id, list):
-                data = data.loc[data['ncbi_tax_id'].isin(ncbi_tax_id)]
-
-        # abundance TODO: this has to be fixed in the parquet file, where there are floats.
-        data = self.__filter_abundance(data, params)
-        data = self.__filter_data(data, params, 'superkingdom')
-        data = self.__filter_data(data, params, 'kingdom')
-        data = self.__filter_data(data, params, 'phylum')
-        data = self.__filter_data(data, params, 'class')
-        data = self.__filter_data(data, params, 'order')
-        data = self.__filter_data(data, params, 'family')
-        data = self.__filter_data(data, params, 'genus')
-        data = self.__filter_data(data, params, 'species')
-        return data
+    def __execute_all_by_ref_code(self, params: dict) -> Mapping[str, Table]:
+        """This is the only query which return dictionary of DFs.
 
+        The tables are loaded and filtered concurrently, or only when accessed
+        if the `lazy` parameter is set. Tables missing from the contracts are
+        left out of the result.
+        """
+        names = ['go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu', 'logsheets']
+        predicates = filters.equality(params, 'ref_code')
 
-    def execute(self, name: QueryName, params: dict | None = None) -> Result:
-        query = LocalBroker._queries[name]
-        queryParams = params or {}
-        if name == "urn:embrc.eu:emobon:all_by_ref_code":
-            return Result(query, self.__execute_all_by_ref_code(queryParams))
-        elif name == "urn:embrc.eu:emobon:go":
-            return Result(query, self.__execute_go(queryParams))
-        elif name == "urn:embrc.eu:emobon:go_slim":
-            return Result(query, self.__execute_go_slim(queryParams))
-        elif name == "urn:embrc.eu:emobon:ips":
-            return Result(query, self.__execute_ips(queryParams))
-        elif name == "urn:embrc.eu:emobon:ko":
-            return Result(query, self.__execute_ko(queryParams))
-        elif name == "urn:embrc.eu:emobon:logsheets":
-            return Result(query, self.__execute_logsheets(queryParams))
-        elif name == "urn:embrc.eu:emobon:lsu":
-            return Result(query, self.__execute_lsu(queryParams))
-        elif name == "urn:embrc.eu:emobon:observatories":
-            return Result(query, self.__execute_observatories(queryParams))
-        elif name == "urn:embrc.eu:emobon:pfam":
-            return Result(query, self.__execute_pfam(queryParams))
-        elif name == "urn:embrc.eu:emobon:ssu":
-            return Result(query, self.__execute_ssu(queryParams))
-        else:
-            if name in QUERY_NAMES:
-                raise Exception(f'unsupported query name "{name}"')
+        def load(name: str) -> Table:
+            return self.__detach(self.__query(name, predicates, {}))
+
+        loaders = {}
+        for name in names:
+            location, _ = self.__source(name)
+            if location.exists():
+                loaders[name] = functools.partial(load, name)
             else:
-                raise Exception(f'unknown query name "{name}"')
-            
-
-    ## Filtering utils ##
-    def __filter_data(self, data, params, column_name, valid_values=None):
-        if column_name in params.keys():
-            value = params[column_name]
-            if valid_values and value not in valid_values:
-                raise Exception(f'invalid {column_name} "{value}"')
-            
-            if isinstance(value, str):
-                data = data.loc[data[column_name] == value]
-            elif isinstance(value, list):
-                data = data.loc[data[column_name].isin(value)]
-        return data
+                logger.warning(f'table {name} not found at {location}')
+
+        if params.get('lazy', False):
+            return LazyTables(loaders)
+        # parquet decoding and the filter kernels release the GIL
+        with ThreadPoolExecutor(max_workers=len(loaders) or 1) as executor:
+            # each table in a copy of the context, recorded in the profile of the query
+            futures = { name: executor.submit(contextvars.copy_context().run, loader) for name, loader in loaders.items() }
+            return { name: future.result() for name, future in futures.items() }
     
-    def __filter_abundance(self, data, params):
-        # create a 2-list with abundance_lower and abundance_upper
-        # if both are None, then raise error
-        abundance = []
-        if 'abundance_lower' in params.keys():
-            abundance.append(params['abundance_lower'])
-        else:
-            abundance.append(None)
-        if 'abundance_upper' in params.keys():
-            abundance.append(params['abundance_upper'])
-        else:
-            abundance.append(None)
-        
-        if abundance[0] is None and abundance[1] is None:
+    def __predicates(self, name: str, params: dict) -> List[filters.Predicate]:
+        predicates = queries.predicates(name, params)
+        if name in queries.METAGOFLOW_TABLES:
+            predicates += self.__observatories(name, params)
+        return predicates
+
+    def __samples(self, params: dict) -> List[str]:
+        """Samples of the logsheets matching the nested `logsheets` parameters,
+        taken at the observatories matching the `observatories` parameters."""
+        logsheets = queries.predicates('logsheets', joins.nested(params, 'logsheets') or {})
+        observatories = joins.nested(params, 'observatories')
+        sites = None
+        if observatories is not None:
+            sites = self.__query('observatories', queries.predicates('observatories', observatories),
+                                 {'columns': joins.SITE})
+            if isinstance(sites, pa.Table):
+                sites = sites.to_pandas()
+            logsheets.append(filters.Predicate('obs_id', 'in', list(dict.fromkeys(sites['obs_id'].astype(str)))))
+        data = self.__query('logsheets', logsheets, {'columns': ['ref_code', *joins.SITE]})
+        if isinstance(data, pa.Table):
+            data = data.to_pandas()
+        return joins.samples(data, sites)
+
+    def __join(self, params: dict, stream: bool = False) -> Table | Batches:
+        """Rows of the table of the join query for the samples matching the
+        metadata filters, selected by ref_code first so the index of the
+        table answers the join."""
+        table = joins.table(params)
+        predicates = [filters.Predicate('ref_code', 'in', self.__samples(params)), *self.__predicates(table, params)]
+        return self.__query(table, predicates, params, stream)
+
+    def __aggregate(self, name: QueryName, params: dict) -> pd.DataFrame:
+        """Result of an aggregation query, from the abundance summed per
+        sample and feature over the filtered rows of its table.
+
+        Results are cached with the table they are computed from, keyed by
+        the query and its predicates, and recomputed when the table changes.
+        """
+        table = aggregate.table(name, params)
+        keys = aggregate.keys(name, table, params)
+        predicates = self.__predicates(table, params)
+
+        def compute(_) -> pd.DataFrame:
+            data = self.__query(table, predicates, {'columns': ['ref_code', *keys, 'abundance']})
+            if isinstance(data, pa.Table):
+                data = data.to_pandas()
+            with instrument.stage('aggregate', table=table, keys=keys, rows_in=len(data)) as record:
+                data = aggregate.finish(name, aggregate.rollup(data, keys), keys, params)
+                record['rows_out'] = len(data)
             return data
 
-        if isinstance(abundance[0], int) and isinstance(abundance[1], int):
-            data = data.loc[(data['abundance'] >= abundance[0]) & (data['abundance'] <= abundance[1])]
-        elif isinstance(abundance[0], int) and abundance[1] is None:
-            data = data.loc[data['abundance'] >= abundance[0]]
-        elif abundance[0] is None and isinstance(abundance[1], int):
-            data = data.loc[data['abundance'] <= abundance[1]]
+        if self._cache is None:
+            return compute(None)
+        location = self._catalog.location(table)
+        if self._catalog[table].partitioning:
+            # rewritten whenever a batch is added
+            location = location.joinpath(partition.MANIFEST)
+        key = json.dumps([name, keys, params.get('n'), predicates], default=str)
+        return self._cache.get(location, compute, f'aggregate-{hashlib.sha1(key.encode()).hexdigest()}', indexed=False)
+
+    def execute_many(self, requests: List[tuple[QueryName, dict | None]]) -> List[Result]:
+        """Execute several named queries, returning their results in order.
+
+        Queries of the same table (single table and join queries) are grouped
+        and the table is read once for all of them, see `__query_many`. The
+        other queries are executed one by one.
+        """
+        results: List[Result | None] = [None] * len(requests)
+        groups: dict[str, list[tuple[int, List[filters.Predicate], dict]]] = {}
+        for i, (name, params) in enumerate(requests):
+            queryParams = params or {}
+            if name in queries.QUERY_TABLES:
+                table = queries.QUERY_TABLES[name]
+                predicates = self.__predicates(table, queryParams)
+            elif name == "urn:embrc.eu:emobon:join":
+                table = joins.table(queryParams)
+                samples = filters.Predicate('ref_code', 'in', self.__samples(queryParams))
+                predicates = [samples, *self.__predicates(table, queryParams)]
+            else:
+                results[i] = self.execute(name, queryParams)
+                continue
+            groups.setdefault(table, []).append((i, predicates, queryParams))
+
+        for table, members in groups.items():
+            # one profile for the queries answered together
+            with instrument.query(f'execute_many:{table}') as profile:
+                data = self.__query_many(table, [(predicates, params) for _, predicates, params in members])
+                data = [self.__detach(rows) for rows in data]
+            for (i, _, _), rows in zip(members, data):
+                results[i] = Result(LocalBroker._queries[requests[i][0]], rows, {'profile': profile})
+        return results
+
+    def __sources(self, name: QueryName, params: dict) -> List[str]:
+        """Tables the result of a query is computed from."""
+        if name == "urn:embrc.eu:emobon:all_by_ref_code":
+            return ['go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu', 'logsheets']
+        if name in queries.QUERY_TABLES:
+            table = queries.QUERY_TABLES[name]
+        elif name in aggregate.AGGREGATE_TABLES:
+            table = aggregate.table(name, params)
         else:
-            raise Exception(f'abundance should be a list with at least one integer.')
-        return data
+            table = joins.table(params)
+        # observatories are selected through the logsheets
+        return [table, 'logsheets', 'observatories']
+
+    def __fingerprints(self, tables: List[str]) -> List[tuple[str, tuple[int, int] | None]]:
+        fingerprints = []
+        for table in tables:
+            if self._catalog[table].partitioning:
+                location = self._catalog.location(table).joinpath(partition.MANIFEST)
+            else:
+                location, _ = self.__source(table)
+            try:
+                fingerprints.append((str(location), location.fingerprint()))
+            except OSError:
+                fingerprints.append((str(location), None))
+        return fingerprints
+
+    @staticmethod
+    def __storable(data) -> bool:
+        # dictionaries of tables and sparse frames are recomputed
+        if isinstance(data, pa.Table):
+            return True
+        return isinstance(data, pd.DataFrame) \
+            and not any(isinstance(dtype, pd.SparseDtype) for dtype in data.dtypes)
+
+    def __execute(self, name: QueryName, params: dict, stream: bool) -> Table | Batches | Mapping[str, Table]:
+        if name == "urn:embrc.eu:emobon:all_by_ref_code":
+            if stream:
+                raise ValueError(f'query "{name}" cannot be streamed')
+            return self.__execute_all_by_ref_code(params)
+        if name in queries.QUERY_TABLES:
+            table = queries.QUERY_TABLES[name]
+            return self.__query(table, self.__predicates(table, params), params, stream)
+        if name in aggregate.AGGREGATE_TABLES:
+            if stream:
+                raise ValueError(f'query "{name}" cannot be streamed')
+            return self.__aggregate(name, params)
+        if name == "urn:embrc.eu:emobon:join":
+            return self.__join(params, stream)
+        if name in QUERY_NAMES:
+            raise KeyError(f'unsupported query name "{name}"')
+        raise KeyError(f'unknown query name "{name}"')
+
+    def __execute_cached(self, name: QueryName, params: dict, stream: bool) -> tuple[Table | Batches | Mapping, dict]:
+        """Data and metadata of a query, from the result cache when possible."""
+        if self._result_cache is None:
+            return self.__detach(self.__execute(name, params, stream)), {}
+        if stream or params.get('lazy', False) or name == "urn:embrc.eu:emobon:all_by_ref_code":
+            return self.__detach(self.__execute(name, params, stream)), {'result_cache': 'bypass'}
+
+        key = ResultCache.key(
+            ResultCache.VERSION, name, params, self._backend, self._categorical,
+            self.__fingerprints(self.__sources(name, params)),
+        )
+        with instrument.stage('result_cache') as record:
+            table = self._result_cache.get(key)
+            record['cache'] = 'miss' if table is None else 'hit'
+        if table is not None:
+            # the type the query returned, aggregates are frames on both backends
+            frame = ResultCache.FRAME in (table.schema.metadata or {})
+            return table_frame(table) if frame else table, {'result_cache': 'hit'}
+        data = self.__detach(self.__execute(name, params, stream))
+        if not LocalBroker.__storable(data):
+            return data, {'result_cache': 'bypass'}
+        with instrument.stage('store', rows=len(data)):
+            if isinstance(data, pa.Table):
+                table = data
+            else:
+                table = frame_table(data)
+                table = table.replace_schema_metadata({**table.schema.metadata, ResultCache.FRAME: b'1'})
+            self._result_cache.put(key, table)
+        return data, {'result_cache': 'miss'}
+
+    def execute(self, name: QueryName, params: dict | None = None, stream: bool = False) -> Result:
+        """Execute a named query.
+
+        With `stream`, the rows are not read until the result is iterated
+        with `Result.batches()`, one batch at a time, which keeps exports and
+        aggregations over whole tables in bounded memory.
+
+        With a result cache, the `result_cache` entry of the metadata of the
+        result tells whether it was read from the cache ('hit'), computed and
+        stored ('miss'), or could not be cached ('bypass': streamed and lazy
+        results, dictionaries of tables and sparse frames).
+
+        The time spent in each stage of the query is recorded in the
+        `profile` entry of the metadata, see `mgo.instrument`.
+        """
+        query = LocalBroker._queries[name]
+        with instrument.query(name) as profile:
+            data, metadata = self.__execute_cached(name, params or {}, stream)
+        return Result(query, data, {**metadata, 'profile': profile})
@@ -0,0 +1,129 @@
+import io
+import json
+import urllib.error
+import urllib.request
+from typing import List, Literal
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .. import aggregate
+from ..broker import Broker
+from ..namedqueries import NamedQueryInfo, QueryName, QUERY_REGISTRY
+from ..result import NAN_METADATA, Batches, LazyTables, Result, table_frame
+from ..server import ARROW, AVAILABLE_HEADER, MATRIX_HEADER, TABLES_HEADER
+
+
+class RemoteBroker(Broker):
+    """Broker forwarding the named queries to an `mgo.server` at `url`.
+
+    Results are received as Arrow IPC streams (or parquet files with `format`)
+    and converted like those of the broker of the server, so the same frames
+    are returned. Streamed results are read from the response batch by batch.
+    """
+
+    def __init__(self, url: str, format: Literal['arrow', 'parquet'] = 'arrow', timeout: float | None = None):
+        if format not in ('arrow', 'parquet'):
+            raise Exception(f'unknown format "{format}"')
+        self._url = url.rstrip('/')
+        self._format = format
+        self._timeout = timeout
+        self._names: List[QueryName] | None = None
+
+    @property
+    def url(self) -> str:
+        """URL of the server."""
+        return self._url
+
+    @property
+    def queryNames(self) -> List[str]:
+        if self._names is None:
+            with self.__open(urllib.request.Request(f'{self._url}/queries')) as response:
+                self._names = json.loads(response.read())
+        return list(self._names)
+
+    @property
+    def queries(self) -> dict[QueryName, NamedQueryInfo]:
+        return { name: QUERY_REGISTRY[name] for name in self.queryNames if name in QUERY_REGISTRY }
+
+    def __open(self, request: urllib.request.Request):
+        try:
+            return urllib.request.urlopen(request, timeout=self._timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read())['error']
+            except Exception:
+                message = f'{e.code} {e.reason}'
+            raise Exception(message) from None
+
+    def __request(self, name: QueryName, params: dict, stream: bool = False, format: str | None = None, **extra):
+        body = json.dumps(
+            {'name': name, 'params': params, 'format': format or self._format, 'stream': stream, **extra},
+        ).encode()
+        request = urllib.request.Request(
+            f'{self._url}/query', data=body, headers={'Content-Type': 'application/json'}, method='POST')
+        return self.__open(request)
+
+    @staticmethod
+    def __frame(table: pa.Table) -> pd.DataFrame | pa.Table:
+        # frames sent with their row labels are rebuilt, so the labels are not
+        # a column of the table; Arrow has no NaN strings, restore those of
+        # frames read from CSV
+        labels = [c for c in (table.schema.pandas_metadata or {}).get('index_columns', []) if isinstance(c, str)]
+        if NAN_METADATA not in (table.schema.metadata or {}) and not labels:
+            return table
+        return table_frame(table)
+
+    @staticmethod
+    def __decode(response) -> pd.DataFrame | pa.Table | dict[str, pa.Table]:
+        tables = response.headers.get(TABLES_HEADER)
+        if tables is not None:
+            # consecutive streams, one per table
+            names = [name for name in tables.split(',') if name]
+            return { name: RemoteBroker.__frame(pa.ipc.open_stream(response).read_all()) for name in names }
+        if response.headers.get('Content-Type') == ARROW:
+            table = pa.ipc.open_stream(response).read_all()
+        else:
+            table = pq.read_table(io.BytesIO(response.read()))
+        feature = response.headers.get(MATRIX_HEADER)
+        if feature is not None:
+            return aggregate.matrix(table.to_pandas(), feature)
+        return RemoteBroker.__frame(table)
+
+    def __fetch(self, name: QueryName, params: dict, **extra):
+        with self.__request(name, params, **extra) as response:
+            return RemoteBroker.__decode(response)
+
+    def __stream(self, name: QueryName, params: dict) -> Batches:
+        def batches():
+            with self.__request(name, params, stream=True, format='arrow') as response:
+                yield from pa.ipc.open_stream(response)
+        return Batches(batches)
+
+    def __execute_all_by_ref_code(self, name: QueryName, params: dict):
+        if not params.get('lazy', False):
+            return self.__fetch(name, params, format='arrow')
+        # each table is requested when accessed, from the lazy result of the server
+        with self.__request(name, params, format='arrow', tables=[]) as response:
+            names = [table for table in response.headers.get(AVAILABLE_HEADER, '').split(',') if table]
+        return LazyTables({
+            table: (lambda table=table: self.__fetch(name, params, format='arrow', tables=[table])[table])
+            for table in names
+        })
+
+    def execute(self, name: QueryName, params: dict | None = None, stream: bool = False) -> Result:
+        """Execute a named query on the server, see `LocalBroker.execute`."""
+        query = QUERY_REGISTRY.get(name)
+        if query is None:
+            raise Exception(f'unknown query name "{name}"')
+        queryParams = params or {}
+        if name == "urn:embrc.eu:emobon:all_by_ref_code":
+            if stream:
+                raise Exception(f'query "{name}" cannot be streamed')
+            data = self.__execute_all_by_ref_code(name, queryParams)
+        elif stream:
+            data = self.__stream(name, queryParams)
+        else:
+            data = self.__fetch(name, queryParams)
+        return Result(query, data)
@@ -0,0 +1,221 @@
+import functools
+import json
+import logging
+import os
+import pathlib
+import urllib.parse
+from collections.abc import Mapping
+import typing
+from typing import Literal, NamedTuple
+
+if typing.TYPE_CHECKING:
+    import pyarrow.fs as pafs
+
+
+logger = logging.getLogger(__name__)
+
+
+_stale: set[tuple[str, tuple[int, int]]] = set()
+"""Typed copies reported as older than their CSV, with its fingerprint."""
+
+
+CONTRACTS_DIR = pathlib.Path(__file__).parent.parent / 'contracts'
+"""Directory of the tables bundled with the package."""
+
+
+DATA_ROOT = os.environ.get('MGO_DATA_ROOT', str(CONTRACTS_DIR))
+"""Default root of the catalog tables, overridable with the MGO_DATA_ROOT
+environment variable."""
+
+
+class Location:
+    """File on the local filesystem or on an fsspec filesystem.
+
+    Local paths (or `file://` URLs) are read directly; other URLs such as
+    `s3://bucket/go.parquet`, `https://host/go.parquet` or `memory://go.parquet`
+    go through fsspec, which must be installed with the implementation of the
+    protocol.
+    """
+
+    def __init__(self, url: str | os.PathLike):
+        self.url = os.fspath(url)
+        scheme = urllib.parse.urlsplit(self.url).scheme
+        # single letters are Windows drives
+        if len(scheme) <= 1 or scheme == 'file':
+            self.local: pathlib.Path | None = pathlib.Path(self.url.removeprefix('file://'))
+            self.path = str(self.local)
+            self._fs = None
+        else:
+            try:
+                import fsspec
+            except ImportError:
+                raise Exception(f'reading {self.url} requires fsspec')
+            self._fs, self.path = fsspec.core.url_to_fs(self.url)
+            self.local = None
+
+    @functools.cached_property
+    def filesystem(self) -> 'pafs.FileSystem':
+        """Arrow filesystem of the file, created (and pyarrow imported) when
+        the file is first accessed."""
+        import pyarrow.fs as pafs
+        if self._fs is None:
+            return pafs.LocalFileSystem()
+        return pafs.PyFileSystem(pafs.FSSpecHandler(self._fs))
+
+    def __str__(self) -> str:
+        return str(self.local) if self.local is not None else self.url
+
+    def __repr__(self) -> str:
+        return f'Location({str(self)!r})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Location) and str(self) == str(other)
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+    @property
+    def name(self) -> str:
+        return self.path.rstrip('/').rsplit('/', 1)[-1]
+
+    @property
+    def suffix(self) -> str:
+        return pathlib.PurePosixPath(self.name).suffix
+
+    def joinpath(self, location: str | os.PathLike) -> 'Location':
+        """Location of `location` relative to this one, unless absolute."""
+        location = os.fspath(location)
+        if len(urllib.parse.urlsplit(location).scheme) > 1 or os.path.isabs(location):
+            return Location(location)
+        if self.local is not None:
+            return Location(self.local.joinpath(location))
+        return Location(f'{self.url.rstrip("/")}/{location}')
+
+    def with_name(self, name: str) -> 'Location':
+        if self.local is not None:
+            return Location(self.local.with_name(name))
+        return Location(f'{self.url.rstrip("/").rsplit("/", 1)[0]}/{name}')
+
+    def exists(self) -> bool:
+        import pyarrow.fs as pafs
+        return self.filesystem.get_file_info(self.path).type != pafs.FileType.NotFound
+
+    def fingerprint(self) -> tuple[int, int]:
+        """Modification time and size, to tell when the file changed.
+        Filesystems which do not report modification times give 0."""
+        if self.local is not None:
+            stat = os.stat(self.local)
+            return (stat.st_mtime_ns, stat.st_size)
+        import pyarrow.fs as pafs
+        info = self.filesystem.get_file_info(self.path)
+        if info.type == pafs.FileType.NotFound:
+            raise FileNotFoundError(self.url)
+        return (info.mtime_ns or 0, info.size or 0)
+
+    def open(self):
+        """Open the file for random access reads."""
+        return self.filesystem.open_input_file(self.path)
+
+
+class TableEntry(NamedTuple):
+    """Catalog entry of a table.
+
+    `location` is a path or URL, relative to the catalog root unless absolute.
+    `schema` maps columns of CSV tables to the pandas dtypes they are read as,
+    parquet tables carry their own. `partitioning` lists the columns of a
+    table stored as a hive partitioned directory.
+    """
+
+    location: str
+    format: Literal['parquet', 'csv'] = 'parquet'
+    schema: dict[str, str] | None = None
+    partitioning: list[str] | None = None
+
+
+DEFAULT_TABLES: dict[str, TableEntry] = {
+    'go': TableEntry('metagoflow_analyses.go.parquet'),
+    'go_slim': TableEntry('metagoflow_analyses.go_slim.parquet'),
+    'ips': TableEntry('metagoflow_analyses.ips.parquet'),
+    'ko': TableEntry('metagoflow_analyses.ko.parquet'),
+    'logsheets': TableEntry('Batch1and2_combined_logsheets_2024-11-12.csv', 'csv'),
+    'lsu': TableEntry('metagoflow_analyses.LSU.parquet'),
+    'observatories': TableEntry('Observatory_combined_logsheets_validated.csv', 'csv'),
+    'pfam': TableEntry('metagoflow_analyses.pfam.parquet'),
+    'ssu': TableEntry('metagoflow_analyses.SSU.parquet'),
+}
+"""Tables of the contracts directory."""
+
+
+class Catalog:
+    """Tables served by a broker: where each is stored, in which format and
+    how it is typed and partitioned.
+
+    Tables not listed in `tables` keep their default entry, relative to `root`.
+    Entries can be given as TableEntry, as a dict of its fields or as a
+    location alone.
+    """
+
+    def __init__(
+            self,
+            root: str | os.PathLike = DATA_ROOT,
+            tables: Mapping[str, TableEntry | dict | str] | None = None,
+            ):
+        self.root = Location(root)
+        self.tables = dict(DEFAULT_TABLES)
+        for name, entry in (tables or {}).items():
+            if isinstance(entry, str):
+                entry = TableEntry(entry, 'csv' if entry.endswith('.csv') else 'parquet')
+            elif isinstance(entry, Mapping):
+                entry = TableEntry(**entry)
+            self.tables[name] = entry
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tables
+
+    def __getitem__(self, name: str) -> TableEntry:
+        if name not in self.tables:
+            raise Exception(f'unknown table "{name}"')
+        return self.tables[name]
+
+    def location(self, name: str) -> Location:
+        """Location of the table `name`."""
+        return self.root.joinpath(self[name].location)
+
+    def source(self, name: str) -> tuple[Location, Literal['parquet', 'csv']]:
+        """Location and format of the file to read the table `name` from."""
+        entry = self[name]
+        location = self.location(name)
+        if entry.format == 'csv':
+            # prefer the typed copy of a CSV written by the contracts pull scripts
+            typed = location.with_name(pathlib.PurePosixPath(location.name).with_suffix('.parquet').name)
+            try:
+                copied = typed.fingerprint()
+            except OSError:
+                return location, entry.format
+            try:
+                updated = location.fingerprint()
+            except OSError:
+                return typed, 'parquet'
+            if copied[0] >= updated[0]:
+                return typed, 'parquet'
+            # the CSV changed since the copy was written
+            if (str(typed), updated) not in _stale:
+                _stale.add((str(typed), updated))
+                logger.warning(f'{typed} is older than {location}, reading the CSV')
+        return location, entry.format
+
+    @classmethod
+    def from_config(cls, config: 'Catalog | Mapping | str | os.PathLike | None') -> 'Catalog':
+        """Catalog from a dict with the optional `root` and `tables` keys, or
+        from a JSON file holding one."""
+        if config is None:
+            return cls()
+        if isinstance(config, Catalog):
+            return config
+        if not isinstance(config, Mapping):
+            with open(config) as f:
+                config = json.load(f)
+        unknown = set(config) - {'root', 'tables'}
+        if unknown:
+            raise Exception(f'unknown catalog keys {sorted(unknown)}')
+        return cls(config.get('root', DATA_ROOT), config.get('tables'))
@@ -0,0 +1,30 @@
+import os
+import typing
+from collections.abc import Mapping
+
+import udal.specification as udal
+
+from .catalog import Catalog
+
+if typing.TYPE_CHECKING:
+    from .brokers.local import ResultCache
+
+
+class Config(udal.Config):
+    """Configuration of the MGO UDAL.
+
+    `catalog` tells where the tables are stored, as a Catalog, a dict with the
+    `root` and `tables` keys or the path of a JSON file holding one.
+
+    `result_cache`, a directory or a `mgo.brokers.local.ResultCache`, keeps
+    the results of the local broker on disk across processes.
+    """
+
+    def __init__(
+            self,
+            catalog: Catalog | Mapping | str | os.PathLike | None = None,
+            result_cache: 'ResultCache | str | os.PathLike | None' = None,
+            ):
+        super().__init__()
+        self.catalog = Catalog.from_config(catalog)
+        self.result_cache = result_cache
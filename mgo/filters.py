@@ -0,0 +1,331 @@
+from typing import Any, List, Literal, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from . import instrument
+from .index import ColumnIndex
+
+
+Op = Literal['==', 'in', '>=', '<=', 'isna', 'notna']
+
+
+class Predicate(NamedTuple):
+    """Condition on a single column derived from a query parameter."""
+
+    column: str
+    op: Op
+    value: Any
+
+
+def equality(params: dict, column: str, scalar: type = str, valid_values=None) -> List[Predicate]:
+    """Predicate matching `column` against a scalar or a list of values.
+
+    Values of any other type are ignored, as the query parameters only accept
+    a `scalar` or a list of them.
+    """
+    if column not in params.keys():
+        return []
+    value = params[column]
+    if valid_values and value not in valid_values:
+        raise ValueError(f'invalid {column} "{value}"')
+
+    if isinstance(value, scalar):
+        return [Predicate(column, '==', value)]
+    elif isinstance(value, list):
+        return [Predicate(column, 'in', value)]
+    return []
+
+
+def abundance(params: dict) -> List[Predicate]:
+    """Predicates for the `abundance_lower` and `abundance_upper` bounds."""
+    lower = params.get('abundance_lower')
+    upper = params.get('abundance_upper')
+    if lower is None and upper is None:
+        return []
+
+    if isinstance(lower, int) and isinstance(upper, int):
+        return [Predicate('abundance', '>=', lower), Predicate('abundance', '<=', upper)]
+    elif isinstance(lower, int) and upper is None:
+        return [Predicate('abundance', '>=', lower)]
+    elif lower is None and isinstance(upper, int):
+        return [Predicate('abundance', '<=', upper)]
+    else:
+        raise ValueError(f'abundance should be a list with at least one integer.')
+
+
+def bounds(params: dict, column: str, scalar: type | tuple = (int, float)) -> List[Predicate]:
+    """Predicates for the `<column>_lower` and `<column>_upper` bounds, which
+    are included in the range."""
+    predicates = []
+    for bound, op in (('lower', '>='), ('upper', '<=')):
+        value = params.get(f'{column}_{bound}')
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, scalar):
+            raise ValueError(f'invalid {column}_{bound} "{value}"')
+        predicates.append(Predicate(column, op, value))
+    return predicates
+
+
+def date_bounds(params: dict, column: str) -> List[Predicate]:
+    """Predicates for the `<column>_lower` and `<column>_upper` dates, given
+    as strings and normalised to `YYYY-MM-DD`, as the dates of the CSV
+    tables are strings compared in lexicographic order."""
+    predicates = []
+    for predicate in bounds(params, column, scalar=str):
+        try:
+            date = pd.Timestamp(predicate.value)
+        except ValueError:
+            raise ValueError(f'invalid {predicate.column} date "{predicate.value}"')
+        predicates.append(predicate._replace(value=date.strftime('%Y-%m-%d')))
+    return predicates
+
+
+def presence(params: dict, column: str) -> List[Predicate]:
+    """Predicate on whether `column` has a value: 'PRESENT' or 'MISSING'."""
+    if column not in params.keys():
+        return []
+    value = params[column]
+    if value == 'PRESENT':
+        return [Predicate(column, 'notna', None)]
+    elif value == 'MISSING':
+        return [Predicate(column, 'isna', None)]
+    raise ValueError(f'invalid {column} "{value}", should be PRESENT or MISSING')
+
+
+def columns(params: dict, available) -> List[str] | None:
+    """Columns requested with the `columns` parameter, None for all."""
+    requested = params.get('columns')
+    if requested is None:
+        return None
+    if isinstance(requested, str):
+        requested = [requested]
+    unknown = [c for c in requested if c not in available]
+    if unknown:
+        raise ValueError(f'unknown columns {unknown}')
+    return list(requested)
+
+
+def _values(data: pd.DataFrame, column: str) -> pd.Series | pd.Index:
+    # the first CSV column is read as the index, but can be filtered like any other
+    if column not in data.columns and column == data.index.name:
+        return data.index
+    return data[column]
+
+
+def _coerce(column: pd.Series | pd.Index, value):
+    # dates are given as strings, compare them as timestamps on typed columns
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        if isinstance(value, list):
+            return list(pd.to_datetime(value, errors='coerce'))
+        return pd.to_datetime(value, errors='coerce')
+    return value
+
+
+def mask(data: pd.DataFrame, predicate: Predicate) -> np.ndarray:
+    """Boolean mask of the rows of `data` satisfying `predicate`."""
+    column = _values(data, predicate.column)
+    value = _coerce(column, predicate.value)
+    if predicate.op == '==':
+        result = column == value
+    elif predicate.op == 'in':
+        result = column.isin(value)
+    elif predicate.op == '>=':
+        result = column >= value
+    elif predicate.op == '<=':
+        result = column <= value
+    elif predicate.op == 'isna':
+        result = column.isna()
+    elif predicate.op == 'notna':
+        result = column.notna()
+    else:
+        raise Exception(f'unsupported operator "{predicate.op}"')
+    if isinstance(result, np.ndarray):
+        return result
+    return result.to_numpy(dtype=bool, na_value=False)
+
+
+class FilterPlan:
+    """Conjunction of predicates evaluated as a single boolean mask.
+
+    Chaining `.loc` selections copies the frame once per predicate. A plan
+    instead combines the per-predicate masks in place and selects the
+    surviving rows once.
+    """
+
+    def __init__(self, predicates: List[Predicate]):
+        self.predicates = list(predicates)
+
+    def __bool__(self) -> bool:
+        return bool(self.predicates)
+
+    def mask(self, data: pd.DataFrame) -> np.ndarray | None:
+        """Combined mask of the plan, None if there is nothing to filter."""
+        combined = None
+        rows = len(data)
+        for predicate in self.predicates:
+            with instrument.stage('filter', column=predicate.column, op=predicate.op, rows_in=rows) as record:
+                current = mask(data, predicate)
+                if combined is None:
+                    combined = current if current.flags.writeable else current.copy()
+                else:
+                    np.logical_and(combined, current, out=combined)
+                rows = record['rows_out'] = int(np.count_nonzero(combined))
+            if not rows:
+                break
+        return combined
+
+    def _indexed(self, indexes: dict[str, ColumnIndex] | None):
+        # first predicate which can be answered from an index, and the others
+        for i, predicate in enumerate(self.predicates):
+            index = (indexes or {}).get(predicate.column)
+            if index is None or predicate.op not in ('==', 'in'):
+                continue
+            values = [predicate.value] if predicate.op == '==' else predicate.value
+            if not all(isinstance(value, str) for value in values):
+                continue
+            return index, predicate.column, values, FilterPlan(self.predicates[:i] + self.predicates[i + 1:])
+        return None
+
+    def apply(self, data: pd.DataFrame, indexes: dict[str, ColumnIndex] | None = None) -> pd.DataFrame:
+        """Rows of `data` satisfying all the predicates.
+
+        A predicate matching values of an indexed column is answered from the
+        index, and only the rows it returns are checked against the others.
+        """
+        indexed = self._indexed(indexes)
+        if indexed is not None:
+            index, column, values, rest = indexed
+            with instrument.stage('index', column=column, rows_in=len(data)) as record:
+                data = data.take(index.positions(values))
+                record['rows_out'] = len(data)
+            return rest.apply(data)
+
+        combined = self.mask(data)
+        if combined is None:
+            return data
+        return data.loc[combined]
+
+    def apply_table(self, table, indexes: dict[str, ColumnIndex] | None = None):
+        """Rows of a pyarrow Table satisfying all the predicates.
+
+        Rows selected through an index are zero-copy slices of `table`, as
+        is `table` itself when there is nothing to filter.
+        """
+        import pyarrow as pa
+
+        indexed = self._indexed(indexes)
+        if indexed is not None:
+            index, column, values, rest = indexed
+            with instrument.stage('index', column=column, rows_in=table.num_rows) as record:
+                ranges = index.ranges(values)
+                slices = [table.slice(start, stop - start) for start, stop in ranges] or [table.slice(0, 0)]
+                table = slices[0] if len(slices) == 1 else pa.concat_tables(slices)
+                record['rows_out'] = table.num_rows
+            return rest.apply_table(table)
+
+        expression = to_arrow(self.predicates, table.schema)
+        if expression is None:
+            return table
+        # the conjunction is evaluated at once by Arrow
+        columns = [predicate.column for predicate in self.predicates]
+        with instrument.stage('filter', column=columns, rows_in=table.num_rows) as record:
+            table = table.filter(expression)
+            record['rows_out'] = table.num_rows
+        return table
+
+
+def apply(data: pd.DataFrame, predicates: List[Predicate]) -> pd.DataFrame:
+    """Rows of `data` satisfying all the predicates."""
+    return FilterPlan(predicates).apply(data)
+
+
+def to_arrow(predicates: List[Predicate], schema=None):
+    """Conjunction of the predicates as a pyarrow dataset expression, usable
+    as the `filters` argument of the parquet reader. None if empty.
+
+    Given the `schema` of the table, dates given as strings are compared as
+    timestamps on timestamp columns.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    expression = None
+    for predicate in predicates:
+        field = pc.field(predicate.column)
+        value = predicate.value
+        if schema is not None and predicate.column in schema.names and value is not None \
+                and pa.types.is_timestamp(schema.field(predicate.column).type):
+            # strings which are not dates match nothing
+            if isinstance(value, list):
+                value = [v for v in pd.to_datetime(value, errors='coerce') if not pd.isna(v)]
+            else:
+                value = pd.to_datetime(value, errors='coerce')
+                value = None if pd.isna(value) else value
+        if predicate.op == '==':
+            condition = field == value
+        elif predicate.op == 'in':
+            # an empty value set has no type to bind against
+            condition = field.isin(value) if value else pc.scalar(False)
+        elif predicate.op == '>=':
+            condition = field >= value
+        elif predicate.op == '<=':
+            condition = field <= value
+        elif predicate.op == 'isna':
+            # NaN stands for a missing value in the float columns of pandas
+            condition = field.is_null(nan_is_null=True)
+        elif predicate.op == 'notna':
+            condition = ~field.is_null(nan_is_null=True)
+        else:
+            raise Exception(f'unsupported operator "{predicate.op}"')
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def quote(identifier: str) -> str:
+    """SQL identifier, quoted as columns such as `order` are keywords."""
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def to_sql(predicates: List[Predicate], schema=None) -> tuple[str, list]:
+    """Conjunction of the predicates as an SQL condition with `?`
+    placeholders, and the values to bind to them. 'TRUE' if empty.
+
+    Given the Arrow `schema` of the table, dates given as strings are compared
+    as timestamps on timestamp columns.
+    """
+    import pyarrow as pa
+
+    conditions, values = [], []
+    for predicate in predicates:
+        column = quote(predicate.column)
+        value = predicate.value
+        floating = schema is not None and predicate.column in schema.names \
+            and pa.types.is_floating(schema.field(predicate.column).type)
+        if schema is not None and predicate.column in schema.names and value is not None \
+                and pa.types.is_timestamp(schema.field(predicate.column).type):
+            def timestamp(v):
+                v = pd.to_datetime(v, errors='coerce')
+                return None if pd.isna(v) else v.to_pydatetime()
+            value = [timestamp(v) for v in value] if isinstance(value, list) else timestamp(value)
+        if predicate.op == '==':
+            conditions.append(f'{column} = ?')
+            values.append(value)
+        elif predicate.op == 'in':
+            if value:
+                # long IN lists are planned as joins, which lose the row order
+                conditions.append(f'list_contains(?, {column})')
+                values.append(value)
+            else:
+                conditions.append('FALSE')
+        elif predicate.op in ('>=', '<='):
+            conditions.append(f'{column} {predicate.op} ?')
+            values.append(value)
+        elif predicate.op == 'isna':
+            conditions.append(f'({column} IS NULL OR isnan({column}))' if floating else f'{column} IS NULL')
+        elif predicate.op == 'notna':
+            conditions.append(f'NOT isnan({column})' if floating else f'{column} IS NOT NULL')
+        else:
+            raise Exception(f'unsupported operator "{predicate.op}"')
+    return ' AND '.join(conditions) or 'TRUE', values
@@ -0,0 +1,105 @@
+import logging
+import os
+import pathlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnIndex:
+    """Map from the values of a column to the row ranges holding them.
+
+    Rows are described as runs of consecutive rows sharing the same value, so
+    tables written sample by sample (as the metaGOflow tables are) need a
+    single run per value. Looking up values costs a dictionary access per
+    value plus the size of the output.
+    """
+
+    def __init__(self, keys: np.ndarray, starts: np.ndarray, stops: np.ndarray):
+        self.keys = keys
+        self.starts = starts
+        self.stops = stops
+        self._runs: dict[str, list[int]] = {}
+        for run, key in enumerate(keys.tolist()):
+            self._runs.setdefault(key, []).append(run)
+
+    @classmethod
+    def build(cls, values: pd.Series | pd.Index) -> 'ColumnIndex':
+        """Index the runs of equal values, skipping missing values."""
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate([[0], boundaries]).astype(np.int64) if len(codes) else np.empty(0, np.int64)
+        stops = np.concatenate([boundaries, [len(codes)]]).astype(np.int64) if len(codes) else np.empty(0, np.int64)
+        run_codes = codes[starts]
+        present = run_codes >= 0
+        keys = np.asarray(uniques, dtype=object)[run_codes[present]].astype(str)
+        return cls(keys, starts[present], stops[present])
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def __contains__(self, key) -> bool:
+        return key in self._runs
+
+    def ranges(self, values) -> list[tuple[int, int]]:
+        """Sorted `(start, stop)` row ranges holding any of `values`."""
+        if isinstance(values, str):
+            values = [values]
+        runs = sorted({run for value in values for run in self._runs.get(value, ())})
+        return [(int(self.starts[run]), int(self.stops[run])) for run in runs]
+
+    def positions(self, values) -> np.ndarray:
+        """Sorted positions of the rows holding any of `values`."""
+        ranges = self.ranges(values)
+        if not ranges:
+            return np.empty(0, np.int64)
+        if len(ranges) == 1:
+            return np.arange(*ranges[0])
+        return np.concatenate([np.arange(start, stop) for start, stop in ranges])
+
+    @staticmethod
+    def sidecar(path: pathlib.Path, column: str) -> pathlib.Path:
+        """Location of the persisted index of `column` for the table at `path`."""
+        return path.with_name(f'{path.name}.{column}.idx.npz')
+
+    def save(self, path: pathlib.Path, fingerprint: tuple[int, int]) -> None:
+        # write aside and rename, so concurrent readers never see a partial file
+        partial = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(partial, 'wb') as f:
+            np.savez(
+                f,
+                keys=self.keys,
+                starts=self.starts,
+                stops=self.stops,
+                fingerprint=np.asarray(fingerprint, dtype=np.int64),
+            )
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path, fingerprint: tuple[int, int]) -> 'ColumnIndex | None':
+        """Read an index written by `save`, None if it is missing or stale."""
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                if tuple(stored['fingerprint'].tolist()) != tuple(fingerprint):
+                    return None
+                return cls(stored['keys'], stored['starts'], stored['stops'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    @classmethod
+    def open(cls, path: pathlib.Path, column: str, fingerprint: tuple[int, int], values) -> 'ColumnIndex':
+        """Load the sidecar index of a table, building and persisting it if
+        it is missing or older than the table."""
+        sidecar = ColumnIndex.sidecar(path, column)
+        index = ColumnIndex.load(sidecar, fingerprint)
+        if index is None:
+            index = ColumnIndex.build(values)
+            try:
+                index.save(sidecar, fingerprint)
+            except OSError as e:
+                logger.debug(f'could not persist index {sidecar}: {e}')
+        return index
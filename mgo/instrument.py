@@ -0,0 +1,129 @@
+"""
+Timing of the stages of the queries: loading the tables, each filter, reads
+pushed down to parquet, aggregations and conversions.
+
+`LocalBroker.execute` profiles every query and attaches the profile to the
+`profile` entry of `Result.metadata`:
+
+    {'query': 'urn:embrc.eu:emobon:go', 'seconds': 0.012, 'peak_rss_delta': 0,
+     'stages': [{'stage': 'load', 'table': 'go.parquet', 'cache': 'hit', ...},
+                {'stage': 'index', 'column': 'ref_code', 'rows_in': 9190, 'rows_out': 1838, ...},
+                {'stage': 'filter', 'column': 'aspect', 'op': '==', 'rows_in': 1838, 'rows_out': 604, ...}]}
+
+Each stage records its wall time (`seconds`) and start (`start_ns`, as
+`time.time_ns`). Stages of streamed results run while the batches are read,
+after the query returned, and are not recorded. The tables of
+`all_by_ref_code` awaited with `aexecute` are loaded after the query
+returned, and their stages are added to its profile with `resume`.
+
+`set_hook` registers a callback receiving each stage as it ends and each
+profile, so they can be exported to a metrics system, for instance as
+OpenTelemetry spans with the recorded start and duration.
+"""
+
+import contextlib
+import contextvars
+import logging
+import sys
+import time
+from typing import Callable, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+
+Hook = Callable[[str, dict], None]
+"""Callback receiving the name and record of each stage as it ends, and
+'query' with the profile of each query."""
+
+
+_hook: Hook | None = None
+
+
+_stages: contextvars.ContextVar[list | None] = contextvars.ContextVar('mgo_stages', default=None)
+
+
+def set_hook(hook: Hook | None) -> None:
+    """Call `hook` with the stages and profiles of all the queries, None
+    (the default) to stop."""
+    global _hook
+    _hook = hook
+
+
+def _emit(name: str, record: dict) -> None:
+    hook = _hook
+    if hook is None:
+        return
+    try:
+        hook(name, record)
+    except Exception as e:
+        # exporting metrics must not fail the queries
+        logger.warning(f'instrumentation hook failed: {e}')
+
+
+def peak_rss() -> int | None:
+    """Peak resident set size of the process in bytes, None where unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextlib.contextmanager
+def stage(name: str, profile: dict | None = None, **info) -> Iterator[dict]:
+    """Time a stage of the current query, or of `profile`, recording `info`
+    and the entries the block adds to the yielded record. Outside of a
+    query nothing is recorded."""
+    stages = profile['stages'] if profile is not None else _stages.get()
+    record = {'stage': name, **info}
+    if stages is None:
+        yield record
+        return
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['start_ns'] = start_ns
+        stages.append(record)
+        _emit(name, record)
+
+
+@contextlib.contextmanager
+def resume(profile: dict | None) -> Iterator[None]:
+    """Record the stages run by the block into `profile`, of a query which
+    already returned, such as the loads of the tables of a lazy result.
+    Without a profile nothing is recorded."""
+    if profile is None:
+        yield
+        return
+    token = _stages.set(profile['stages'])
+    try:
+        yield
+    finally:
+        _stages.reset(token)
+
+
+@contextlib.contextmanager
+def query(name: str) -> Iterator[dict]:
+    """Profile the stages run by the block into the yielded profile, in the
+    order they end. Tasks of other threads are recorded when run in a copy
+    of the context of the block (`contextvars.copy_context`)."""
+    profile = {'query': name, 'stages': []}
+    token = _stages.set(profile['stages'])
+    peak = peak_rss()
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        _stages.reset(token)
+        profile['seconds'] = time.perf_counter() - start
+        profile['start_ns'] = start_ns
+        # growth of the peak of the process, 0 when an earlier peak was higher
+        profile['peak_rss_delta'] = peak_rss() - peak if peak is not None else None
+        _emit('query', profile)
+
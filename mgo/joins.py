@@ -0,0 +1,54 @@
+"""
+Query of a metaGOflow table restricted to the samples matching filters on
+their environmental metadata, joined by the brokers.
+
+The samples are the ref_codes of the logsheets matching the `logsheets`
+parameters, taken at the observatories matching the `observatories`
+parameters. Observatories have a row per environment package, so logsheets
+are joined to them on both obs_id and env_package. The rows of the target
+table are then selected by ref_code, through its index where there is one,
+so only the final rows are returned to the client.
+"""
+
+from typing import List
+
+import pandas as pd
+
+from . import queries
+
+
+JOIN_TABLES = queries.METAGOFLOW_TABLES
+"""Tables the join query can return rows of."""
+
+
+SITE = ['obs_id', 'env_package']
+"""Columns joining the logsheets to the observatories."""
+
+
+def table(params: dict) -> str:
+    """Table the join query returns rows of."""
+    value = params.get('table')
+    if value is None:
+        raise ValueError('query "urn:embrc.eu:emobon:join" requires a table')
+    if value not in JOIN_TABLES:
+        raise ValueError(f'invalid table "{value}"')
+    return value
+
+
+def nested(params: dict, key: str) -> dict | None:
+    """Parameters of the `key` query given to the join query, None if not given."""
+    value = params.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError(f'{key} should be a dictionary of query parameters')
+    return value
+
+
+def samples(logsheets: pd.DataFrame, sites: pd.DataFrame | None = None) -> List[str]:
+    """Distinct ref_codes of the `logsheets` rows, in table order, taken at
+    the `sites` (obs_id and env_package of observatories) if given."""
+    if sites is not None:
+        taken = pd.MultiIndex.from_arrays([logsheets[c].astype(object) for c in SITE])
+        logsheets = logsheets.loc[taken.isin(pd.MultiIndex.from_arrays([sites[c].astype(object) for c in SITE]))]
+    return list(dict.fromkeys(logsheets['ref_code'].dropna().astype(str)))
@@ -4,12 +4,17 @@ from typing import List, Literal
 from udal.specification import NamedQueryInfo
 import udal.specification as udal
 
+from contracts.utils_contracts import LOGSHEETS_MEASUREMENTS, LOGSHEETS_METHODS
+
 
 QueryName = Literal[
+    "urn:embrc.eu:emobon:abundance_by_rank",  # abundance of a taxonomy table summed per sample and rank
+    "urn:embrc.eu:emobon:abundance_matrix",   # sample x feature abundance, sparse
     "urn:embrc.eu:emobon:all_by_ref_code",  # this should use ref codes from logsheets and query all the tables at once
     "urn:embrc.eu:emobon:go",               # columns 'ref_code', 'id', 'name', 'aspect', 'abundance'
     "urn:embrc.eu:emobon:go_slim",          # columns 'ref_code', 'id', 'name', 'aspect', 'abundance'
     "urn:embrc.eu:emobon:ips",              # 'ref_code', 'accession', 'description', 'abundance'
+    "urn:embrc.eu:emobon:join",             # rows of a table for the samples matching logsheets and observatories filters
     "urn:embrc.eu:emobon:ko",               # 'ref_code', 'entry', 'name', 'abundance'
     "urn:embrc.eu:emobon:logsheets",
     # LSU: 'ref_code', 'ncbi_tax_id', 'abundance', 'superkingdom', 'kingdom','phylum', 'class', 'order', 'family', 'genus', 'species'
@@ -18,6 +23,7 @@ QueryName = Literal[
     "urn:embrc.eu:emobon:pfam",             # 'ref_code', 'entry', 'name', 'abundance'
     # SSU: 'ref_code', 'ncbi_tax_id', 'abundance', 'superkingdom', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'
     "urn:embrc.eu:emobon:ssu",              # SSU tables
+    "urn:embrc.eu:emobon:top_terms",        # most abundant terms of each sample
 
 ]
 """Type to help development restricting query names to existing ones."""
@@ -27,18 +33,54 @@ QUERY_NAMES: typing.Tuple[QueryName, ...] = typing.get_args(QueryName)
 """List of the supported query names."""
 
 
+TAXONOMIC_RANKS = ['superkingdom', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+"""Taxonomic ranks of the LSU and SSU tables."""
+
+
 # Ordered alphabetically
 QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
+    "urn:embrc.eu:emobon:abundance_by_rank": NamedQueryInfo(
+        "urn:embrc.eu:emobon:abundance_by_rank",
+        {
+            'table': [udal.tliteral('lsu'), udal.tliteral('ssu')],
+            'rank': [udal.tliteral(rank) for rank in TAXONOMIC_RANKS],
+            'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
+            'ncbi_tax_id': ['int', udal.tlist('int')],
+            'abundance_lower': ['int', udal.tliteral('int')],   # bounds of the summed rows
+            'abundance_upper': ['int', udal.tliteral('int')],
+            **{rank: ['str', udal.tlist('str')] for rank in TAXONOMIC_RANKS},
+        },
+    ),
+    "urn:embrc.eu:emobon:abundance_matrix": NamedQueryInfo(
+        "urn:embrc.eu:emobon:abundance_matrix",
+        {
+            'table': [udal.tliteral(table) for table in ('go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu')],
+            'feature': ['str'],     # columns of the matrix, term identifiers or ncbi_tax_id by default, or a rank
+            'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
+            'aspect': [
+                udal.tliteral('biological_process'),
+                udal.tliteral('cellular_component'),
+                udal.tliteral('molecular_function'),
+            ],
+            'abundance_lower': ['int', udal.tliteral('int')],   # bounds of the summed rows
+            'abundance_upper': ['int', udal.tliteral('int')],
+            **{rank: ['str', udal.tlist('str')] for rank in TAXONOMIC_RANKS},
+        },
+    ),
     "urn:embrc.eu:emobon:all_by_ref_code": NamedQueryInfo(
         "urn:embrc.eu:emobon:all_by_ref_code",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'lazy': ['bool'],                           # load each table only when accessed
         },
     ),
     "urn:embrc.eu:emobon:go": NamedQueryInfo(
         "urn:embrc.eu:emobon:go",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
             'id': ['str', udal.tlist('str')],
             'name': ['str', udal.tlist('str')],
             'aspect': [
@@ -48,12 +90,14 @@ QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
             ],
             'abundance_lower': ['int', udal.tliteral('int')],
             'abundance_upper': ['int', udal.tliteral('int')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:go_slim": NamedQueryInfo(
         "urn:embrc.eu:emobon:go_slim",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
             'id': ['str', udal.tlist('str')],
             'name': ['str', udal.tlist('str')],
             'aspect': [
@@ -63,26 +107,57 @@ QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
             ],
             'abundance_lower': ['int', udal.tliteral('int')],
             'abundance_upper': ['int', udal.tliteral('int')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:ips": NamedQueryInfo(
         "urn:embrc.eu:emobon:ips",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
             'accession': ['str', udal.tlist('str')],
             'description': ['str', udal.tlist('str')],
             'abundance_lower': ['int', udal.tliteral('int')],
             'abundance_upper': ['int', udal.tliteral('int')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
+        },
+    ),
+    "urn:embrc.eu:emobon:join": NamedQueryInfo(
+        "urn:embrc.eu:emobon:join",
+        {
+            'table': [udal.tliteral(table) for table in ('go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu')],
+            'logsheets': ['dict'],      # parameters of the logsheets query selecting the samples
+            'observatories': ['dict'],  # parameters of the observatories query selecting their sites
+            # parameters of the query of the table
+            'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],
+            'id': ['str', udal.tlist('str')],
+            'name': ['str', udal.tlist('str')],
+            'aspect': [
+                udal.tliteral('biological_process'),
+                udal.tliteral('cellular_component'),
+                udal.tliteral('molecular_function'),
+            ],
+            'accession': ['str', udal.tlist('str')],
+            'description': ['str', udal.tlist('str')],
+            'entry': ['str', udal.tlist('str')],
+            'ncbi_tax_id': ['int', udal.tlist('int')],
+            **{rank: ['str', udal.tlist('str')] for rank in TAXONOMIC_RANKS},
+            'abundance_lower': ['int', udal.tliteral('int')],
+            'abundance_upper': ['int', udal.tliteral('int')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:ko": NamedQueryInfo(
         "urn:embrc.eu:emobon:ko",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
             'entry': ['str', udal.tlist('str')],
             'name': ['str', udal.tlist('str')],
             'abundance_lower': ['int', udal.tliteral('int')],
             'abundance_upper': ['int', udal.tliteral('int')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:logsheets": NamedQueryInfo(
@@ -96,7 +171,9 @@ QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
                 udal.tliteral('metagenome'),
             ],
             'investigation_type': ['str', udal.tlist('str')],
-            'collection_date': ['str', udal.tlist('str')],          # this should do a range
+            'collection_date': ['str', udal.tlist('str')],
+            'collection_date_lower': ['str'],   # ISO dates, bounds included
+            'collection_date_upper': ['str'],
             'tidal_stage': [
                 udal.tliteral('no_tide'),
                 udal.tliteral('low_tide'),
@@ -104,75 +181,22 @@ QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
                 udal.tliteral('flood_tide'),
                 udal.tliteral('ebb_tide'),
             ],
-            'depth': ['float', udal.tlist('float')],
-            'samp_size_vol': ['float', udal.tlist('float')],
             'failure': [udal.tliteral('PRESENT'), udal.tliteral('MISSING')],
-            'chlorophyll': ['float', udal.tlist('float')],              # this should allow range
-            'chlorophyll_method': ['PRESENT', udal.tliteral('str')],     # if value measured or not
-            'sea_surf_temp': ['float', udal.tlist('float')],            # should be range
-            'sea_surf_salinity': ['float', udal.tlist('float')],        # should be range
-            'sea_subsurf_salinity': ['float', udal.tlist('float')],     # should be range
-            'alkalinity': ['float', udal.tlist('float')],               # should be range
-            'alkalinity_method': ['PRESENT', udal.tliteral('str')],      # if value measured or not
-            'ammonium': ['float', udal.tlist('float')],                 # should be range
-            'ammonium_method': ['PRESENT', udal.tliteral('str')],        # if value measured or not
-            'bac_prod': ['float', udal.tlist('float')],                 # should be range
-            'bac_prod_method': ['PRESENT', udal.tliteral('str')],        # if value measured or not
-            'biomass': ['float', udal.tlist('float')],                  # should be range
-            'biomass_method': ['PRESENT', udal.tliteral('str')],         # if value measured or not
-            'conduc': ['float', udal.tlist('float')],                   # should be range
-            'conduc_method': ['PRESENT', udal.tliteral('str')],          # if value measured or not
-            'diss_carb_dioxide': ['float', udal.tlist('float')],        # should be range
-            'diss_carb_dioxide_method': ['PRESENT', udal.tliteral('str')],  # if value measured or not
-            'diss_inorg_carb': ['float', udal.tlist('float')],          # should be range
-            'diss_inorg_carb_method': ['PRESENT', udal.tliteral('str')],  # if value measured or not
-            'diss_org_carb': ['float', udal.tlist('float')],            # should be range
-            'diss_org_carb_method': ['PRESENT', udal.tliteral('str')],   # if value measured or not
-            'diss_org_nitro': ['float', udal.tlist('float')],            # should be range
-            'diss_org_nitro_method': ['PRESENT', udal.tliteral('str')],   # if value measured or not
-            'down_par': ['float', udal.tlist('float')],                 # should be range
-            'down_par_method': ['PRESENT', udal.tliteral('str')],        # if value measured or not
-            'diss_oxygen': ['float', udal.tlist('float')],              # should be range
-            'diss_oxygen_method': ['PRESENT', udal.tliteral('str')],     # if value measured or not
-            'n_alkanes': ['float', udal.tlist('float')],                # should be range
-            'n_alkanes_method': ['PRESENT', udal.tliteral('str')],       # if value measured or not
-            'nitrate': ['float', udal.tlist('float')],                  # should be range
-            'nitrate_method': ['PRESENT', udal.tliteral('str')],         # if value measured or not
-            'nitrite': ['float', udal.tlist('float')],                  # should be range
-            'nitrite_method': ['PRESENT', udal.tliteral('str')],         # if value measured or not
-            'organism_count': ['int', udal.tlist('int')],               # should be range
-            'organism_count_method': ['PRESENT', udal.tliteral('str')],  # if value measured or not
-            'ph': ['float', udal.tlist('float')],                       # should be range
-            'ph_method': ['PRESENT', udal.tliteral('str')],              # if value measured or not
-            'phaeopigments': ['float', udal.tlist('float')],            # should be range
-            'phaeopigments_method': ['PRESENT', udal.tliteral('str')],   # if value measured or not
-            'phosphate': ['float', udal.tlist('float')],                # should be range
-            'phosphate_method': ['PRESENT', udal.tliteral('str')],       # if value measured or not
-            'pigments': ['float', udal.tlist('float')],                 # should be range
-            'pigments_method': ['PRESENT', udal.tliteral('str')],        # if value measured or not
-            'pressure': ['float', udal.tlist('float')],                 # should be range
-            'pressure_method': ['PRESENT', udal.tliteral('str')],        # if value measured or not
-            'primary_prod': ['float', udal.tlist('float')],             # should be range
-            'primary_prod_method': ['PRESENT', udal.tliteral('str')],    # if value measured or not
-            'silicate': ['float', udal.tlist('float')],                 # should be range
-            'silicate_method': ['PRESENT', udal.tliteral('str')],        # if value measured or not
-            'sulfate': ['float', udal.tlist('float')],                  # should be range
-            'sulfate_method': ['PRESENT', udal.tliteral('str')],         # if value measured or not
-            'sulfide': ['float', udal.tlist('float')],                  # should be range
-            'sulfide_method': ['PRESENT', udal.tliteral('str')],         # if value measured or not
-            'turbidity': ['float', udal.tlist('float')],                # should be range
-            'turbidity_method': ['PRESENT', udal.tliteral('str')],       # if value measured or not
-            'water_current': ['float', udal.tlist('float')],            # should be range
-            'water_current_method': ['PRESENT', udal.tliteral('str')],   # if value measured or not
+            # ranges of the measurements, bounds included
+            **{f'{column}_{bound}': ['float'] for column in LOGSHEETS_MEASUREMENTS for bound in ('lower', 'upper')},
+            # if value measured or not
+            **{f'{column}_method': [udal.tliteral('PRESENT'), udal.tliteral('MISSING')] for column in LOGSHEETS_METHODS},
             'env_package': [udal.tliteral('soft_sediment'),
                             udal.tliteral('hard_sediment'),
                             udal.tliteral('water_column')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:lsu": NamedQueryInfo(
         "urn:embrc.eu:emobon:lsu",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
             'ncbi_tax_id': ['int', udal.tlist('int')],
             'abundance_lower': ['int', udal.tliteral('int')],
             'abundance_upper': ['int', udal.tliteral('int')],
@@ -184,6 +208,7 @@ QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
             'family': ['str', udal.tlist('str')],
             'genus': ['str', udal.tlist('str')],
             'species': ['str', udal.tlist('str')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:observatories": NamedQueryInfo(
@@ -195,22 +220,26 @@ QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
                             udal.tliteral('hard_sediment'),
                             udal.tliteral('water_column')],
             'loc_regional_mgrid': ['int', udal.tlist('int')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:pfam": NamedQueryInfo(
         "urn:embrc.eu:emobon:pfam",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
             'entry': ['str', udal.tlist('str')],
             'name': ['str', udal.tlist('str')],
             'abundance_lower': ['int', udal.tliteral('int')],
             'abundance_upper': ['int', udal.tliteral('int')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
         },
     ),
     "urn:embrc.eu:emobon:ssu": NamedQueryInfo(
         "urn:embrc.eu:emobon:ssu",
         {
             'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
             'ncbi_tax_id': ['int', udal.tlist('int')],
             'abundance_lower': ['int', udal.tliteral('int')],
             'abundance_upper': ['int', udal.tliteral('int')],
@@ -222,6 +251,23 @@ QUERY_REGISTRY: dict[QueryName, NamedQueryInfo] = {
             'family': ['str', udal.tlist('str')],
             'genus': ['str', udal.tlist('str')],
             'species': ['str', udal.tlist('str')],
+            'columns': [udal.tlist('str')],   # projection, all columns if omitted
+        },
+    ),
+    "urn:embrc.eu:emobon:top_terms": NamedQueryInfo(
+        "urn:embrc.eu:emobon:top_terms",
+        {
+            'table': [udal.tliteral(table) for table in ('go', 'go_slim', 'ips', 'ko', 'pfam')],
+            'n': ['int'],           # terms per sample, 10 by default
+            'ref_code': ['str', udal.tlist('str')],
+            'obs_id': ['str', udal.tlist('str')],      # samples of these observatories
+            'aspect': [
+                udal.tliteral('biological_process'),
+                udal.tliteral('cellular_component'),
+                udal.tliteral('molecular_function'),
+            ],
+            'abundance_lower': ['int', udal.tliteral('int')],   # bounds of the summed rows
+            'abundance_upper': ['int', udal.tliteral('int')],
         },
     ),
 }
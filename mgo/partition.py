@@ -0,0 +1,159 @@
+"""
+Hive-partitioned layout of the metaGOflow tables.
+
+Each table becomes a directory of parquet files partitioned by sequencing
+batch and observatory,
+
+    ko/batch=1-2/obs_id=HCMR-1/part-0.parquet
+    ko/_manifest.parquet
+
+where the manifest lists the files holding each ref_code. LocalBroker reads
+only the files of the requested samples or observatories, and a new batch is
+added by writing its own partitions, leaving the others untouched.
+
+    python -m mgo.partition /data/emobon-partitioned --batch 1-2
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import shutil
+from typing import Mapping
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .catalog import CONTRACTS_DIR, DEFAULT_TABLES, Catalog, TableEntry
+
+
+PARTITIONING = ['batch', 'obs_id']
+"""Partition columns, outermost first."""
+
+MANIFEST = '_manifest.parquet'
+"""File of a partitioned table listing the files holding each ref_code."""
+
+TABLES = ['go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu']
+"""Tables which can be partitioned, those with a ref_code column."""
+
+
+def partitioning(columns: list[str] = PARTITIONING) -> ds.Partitioning:
+    """Hive partitioning on string `columns`."""
+    return ds.partitioning(pa.schema([(column, pa.string()) for column in columns]), flavor='hive')
+
+
+def observatories(logsheets: pd.DataFrame) -> pd.Series:
+    """Observatory of each ref_code of the logsheets."""
+    known = logsheets.dropna(subset=['ref_code']).drop_duplicates('ref_code')
+    return pd.Series(known['obs_id'].astype(str).to_numpy(), index=known['ref_code'].astype(str))
+
+
+def write_batch(
+        data: pd.DataFrame | pa.Table,
+        target: str | os.PathLike,
+        batch: str,
+        obs_ids: Mapping[str, str] | pd.Series,
+        ) -> pd.DataFrame:
+    """Write the rows of one batch of a table to the partitioned table at
+    `target`, replacing the partitions of the batch written before.
+
+    `obs_ids` gives the observatory of each ref_code; rows of samples missing
+    from it go to the default partition. Returns the manifest of the table.
+    """
+    target = pathlib.Path(target)
+    table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+    ref_codes = table.column('ref_code').to_pandas().astype(str)
+    obs_id = ref_codes.map(pd.Series(obs_ids))
+    table = table.append_column('batch', pa.array([batch] * table.num_rows, pa.string()))
+    table = table.append_column('obs_id', pa.array(obs_id, pa.string(), from_pandas=True))
+    # samples stay contiguous within each file, as in the monolithic tables
+    table = table.take(pa.array(obs_id.fillna('').argsort(kind='stable').to_numpy()))
+
+    # observatories may have left the batch since it was last written
+    shutil.rmtree(target / f'batch={batch}', ignore_errors=True)
+    written = []
+    ds.write_dataset(
+        table,
+        target,
+        format='parquet',
+        partitioning=partitioning(),
+        basename_template='part-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        file_visitor=lambda file: written.append(file.path),
+    )
+
+    rows = []
+    for path in written:
+        samples = pq.read_table(path, columns=['ref_code']).column('ref_code').unique().to_pylist()
+        relative = pathlib.Path(path).relative_to(target).as_posix()
+        rows += [(ref_code, relative) for ref_code in samples]
+    manifest = pd.DataFrame(rows, columns=['ref_code', 'path'])
+
+    path = target / MANIFEST
+    if path.exists():
+        # keep the files of the other batches
+        previous = pd.read_parquet(path)
+        kept = ~previous['path'].str.startswith(f'batch={batch}/')
+        manifest = pd.concat([previous.loc[kept], manifest], ignore_index=True)
+    partial = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    manifest.to_parquet(partial, index=False)
+    os.replace(partial, path)
+    return manifest
+
+
+def convert(
+        target: str | os.PathLike,
+        source: str | os.PathLike | Catalog = CONTRACTS_DIR,
+        batch: str = '1-2',
+        tables: list[str] | None = None,
+        ) -> dict:
+    """Write the metaGOflow tables of `source` (a directory or a catalog) as
+    one batch of partitioned tables under `target`.
+
+    Returns the catalog of the partitioned tables, also written to
+    `target/catalog.json` for `mgo.config.Config(catalog=...)`.
+    """
+    from .brokers.local import LocalBroker, TableCache
+
+    target = pathlib.Path(target).absolute()
+    catalog = source if isinstance(source, Catalog) else Catalog(source)
+    broker = LocalBroker(cache=TableCache(), catalog=catalog, categorical=False)
+    logsheets = broker.execute('urn:embrc.eu:emobon:logsheets', {'columns': ['ref_code', 'obs_id']}).data()
+    obs_ids = observatories(logsheets)
+
+    entries = {}
+    for name in tables or TABLES:
+        if name not in TABLES:
+            raise Exception(f'table "{name}" cannot be partitioned')
+        location = catalog.location(name)
+        if not location.exists():
+            continue
+        data = pq.read_table(location.path, filesystem=location.filesystem)
+        write_batch(data, target / name, batch, obs_ids)
+        entries[name] = TableEntry(name, 'parquet', None, PARTITIONING)._asdict()
+
+    # the other tables stay where they are
+    for name in DEFAULT_TABLES:
+        if name not in entries:
+            entries[name] = catalog[name]._replace(location=str(catalog.location(name)))._asdict()
+    config = {'root': str(target), 'tables': entries}
+    with open(target / 'catalog.json', 'w') as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the metaGOflow tables as hive partitioned tables.')
+    parser.add_argument('target', help='directory to write the tables to')
+    parser.add_argument('--source', default=str(CONTRACTS_DIR), help='directory of the monolithic tables')
+    parser.add_argument('--batch', default='1-2', help='label of the sequencing batch of the tables')
+    parser.add_argument('--tables', nargs='*', choices=TABLES, help='tables to convert, all by default')
+    args = parser.parse_args()
+    config = convert(args.target, args.source, args.batch, args.tables)
+    print(f'catalog written to {pathlib.Path(config["root"]) / "catalog.json"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+from typing import Callable, List
+
+from contracts.utils_contracts import LOGSHEETS_MEASUREMENTS, LOGSHEETS_METHODS
+
+from . import filters
+from .filters import Predicate
+from .namedqueries import TAXONOMIC_RANKS, QueryName
+
+
+QUERY_TABLES: dict[QueryName, str] = {
+    "urn:embrc.eu:emobon:go": 'go',
+    "urn:embrc.eu:emobon:go_slim": 'go_slim',
+    "urn:embrc.eu:emobon:ips": 'ips',
+    "urn:embrc.eu:emobon:ko": 'ko',
+    "urn:embrc.eu:emobon:logsheets": 'logsheets',
+    "urn:embrc.eu:emobon:lsu": 'lsu',
+    "urn:embrc.eu:emobon:observatories": 'observatories',
+    "urn:embrc.eu:emobon:pfam": 'pfam',
+    "urn:embrc.eu:emobon:ssu": 'ssu',
+}
+"""Table read by each single table query."""
+
+
+METAGOFLOW_TABLES = ['go', 'go_slim', 'ips', 'ko', 'lsu', 'pfam', 'ssu']
+"""Tables of the metaGOflow analyses, one row per sample and term or taxon."""
+
+
+RANKS = TAXONOMIC_RANKS
+"""Taxonomic ranks of the LSU and SSU tables."""
+
+
+def _go(params: dict) -> List[Predicate]:
+    return [
+        *filters.equality(params, 'ref_code'),
+        *filters.equality(params, 'id'),
+        *filters.equality(params, 'name'),
+        *filters.equality(params, 'aspect'),
+        *filters.abundance(params),
+    ]
+
+
+def _ips(params: dict) -> List[Predicate]:
+    return [
+        *filters.equality(params, 'ref_code'),
+        *filters.equality(params, 'accession'),
+        *filters.equality(params, 'description'),
+        *filters.abundance(params),
+    ]
+
+
+def _ko(params: dict) -> List[Predicate]:
+    return [
+        *filters.equality(params, 'ref_code'),
+        *filters.equality(params, 'entry'),
+        *filters.equality(params, 'name'),
+        *filters.abundance(params),
+    ]
+
+
+def _logsheets(params: dict) -> List[Predicate]:
+    return [
+        *filters.equality(params, 'source_mat_id'),
+        *filters.equality(params, 'tax_id', scalar=int),
+        *filters.equality(
+            params,
+            'scientific_name',
+            valid_values=['marine plankton metagenome', 'marine sediment metagenome', 'metagenome'],
+            ),
+        *filters.equality(params, 'investigation_type'),
+        *filters.equality(params, 'collection_date'),
+        *filters.equality(
+            params,
+            'tidal_stage',
+            valid_values=['no_tide', 'low_tide', 'high_tide', 'flood_tide', 'ebb_tide'],
+            ),
+        *filters.equality(
+            params,
+            'env_package',
+            valid_values=['soft_sediment', 'hard_sediment', 'water_column'],
+            ),
+        *filters.date_bounds(params, 'collection_date'),
+        *[predicate for column in LOGSHEETS_MEASUREMENTS for predicate in filters.bounds(params, column)],
+        *filters.presence(params, 'failure'),
+        *[predicate for column in LOGSHEETS_METHODS for predicate in filters.presence(params, f'{column}_method')],
+    ]
+
+
+def _taxonomy(params: dict) -> List[Predicate]:
+    return [
+        *filters.equality(params, 'ref_code'),
+        *filters.equality(params, 'ncbi_tax_id', scalar=int),
+        # abundance TODO: this has to be fixed in the parquet file, where there are floats.
+        *filters.abundance(params),
+        *[predicate for rank in RANKS for predicate in filters.equality(params, rank)],
+    ]
+
+
+def _observatories(params: dict) -> List[Predicate]:
+    return [
+        *filters.equality(params, 'obs_id'),
+        *filters.equality(params, 'country'),
+        *filters.equality(
+            params,
+            'env_package',
+            valid_values=['soft_sediment', 'hard_sediment', 'water_column'],
+            ),
+        *filters.equality(params, 'loc_regional_mgrid', scalar=int),
+    ]
+
+
+_PREDICATES: dict[str, Callable[[dict], List[Predicate]]] = {
+    'go': _go,
+    'go_slim': _go,
+    'ips': _ips,
+    'ko': _ko,
+    'logsheets': _logsheets,
+    'lsu': _taxonomy,
+    'observatories': _observatories,
+    'pfam': _ko,
+    'ssu': _taxonomy,
+}
+
+
+def predicates(table: str, params: dict) -> List[Predicate]:
+    """Predicates on `table` of the parameters of its query.
+
+    The `obs_id` parameter of the metaGOflow tables is left to the brokers,
+    which resolve it to the samples of the observatories.
+    """
+    return _PREDICATES[table](params)
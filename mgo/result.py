@@ -1,8 +1,15 @@
+import numpy as np
 import pandas as pd
-from typing import Any
+import pyarrow as pa
+import itertools
+import json
+import threading
+from collections.abc import Mapping
+from typing import Any, Callable, Iterator, NamedTuple
 
 import udal.specification as udal
 
+from . import instrument
 from .namedqueries import NamedQueryInfo
 
 
@@ -10,12 +17,13 @@ from .namedqueries import NamedQueryInfo
 class Result(udal.Result):
     """Result from executing an UDAL query."""
 
-    Type = pd.DataFrame
+    Type = pd.DataFrame | pa.Table
 
-    def __init__(self, query: NamedQueryInfo, data: Any, metadata: dict = {}):
+    def __init__(self, query: NamedQueryInfo, data: Any, metadata: dict | None = None):
         self._query = query
         self._data = data
-        self._metadata = metadata
+        self._metadata = metadata if metadata is not None else {}
+        self._converted: dict[type | str, Any] = {}
 
     @property
     def query(self):
@@ -29,9 +37,332 @@ class Result(udal.Result):
         return self._metadata
 
     def data(self, type: type[Type] | None = None) -> Type:
-        """The data of the result."""
-        if type is None or type is pd.DataFrame:
-            return self._data
-        raise Exception(f'type "{type}" not supported')
+        """The data of the result, as a `pd.DataFrame` by default or as a
+        `pa.Table`. Conversions are done once and kept with the result.
 
+        The columns can also be requested as a `dict` of NumPy arrays, and
+        the data as a `polars.DataFrame` when polars is installed. polars
+        frames are always converted from the Arrow table. The arrays of a
+        result held as an Arrow table come from its columns, without copying
+        numeric columns of a single chunk without nulls; those of a result
+        held as a DataFrame come from `Series.to_numpy`, with named row
+        labels as columns, without copying numeric columns.
 
+        Abundance tables can also be requested as a scipy.sparse CSR matrix
+        or array (`scipy.sparse.csr_matrix`, `scipy.sparse.csr_array`) of
+        samples × features, returned as a `SparseMatrix` with the labels of
+        its rows and columns; see `matrix`. Arrow has no sparse columns:
+        the frames of sparse columns of `abundance_matrix` are converted to
+        the table of their (ref_code, feature, abundance) triplets, also
+        written by `to_ipc` and `to_parquet`.
+
+        Streamed results are read in full on the first call.
+        """
+        if type is None:
+            type = pd.DataFrame
+        if type not in (pd.DataFrame, pa.Table, dict) and type not in _sparse_types() + _polars_types():
+            raise Exception(f'type "{type}" not supported')
+        if type not in self._converted:
+            with instrument.stage('convert', self._metadata.get('profile'), type=type.__name__):
+                data = self._data
+                if isinstance(data, Batches):
+                    data = self._converted.setdefault(pa.Table, data.read_all())
+                elif type in _polars_types() and isinstance(data, pd.DataFrame):
+                    # polars reads the Arrow buffers, convert once for both
+                    data = self.data(pa.Table)
+                self._converted[type] = _convert(data, type)
+        return self._converted[type]
+
+    def to_ipc(self, sink=None) -> pa.Buffer | None:
+        """Write the data as an Arrow IPC stream to `sink`, a path or a
+        writable file object, or return the stream as a `pa.Buffer` (a
+        bytes-like object) without `sink`; the buffer is kept with the
+        result. Streamed results are written batch by batch."""
+        if sink is None:
+            if 'ipc' not in self._converted:
+                stream = pa.BufferOutputStream()
+                self.to_ipc(stream)
+                self._converted['ipc'] = stream.getvalue()
+            return self._converted['ipc']
+        schema, batches = self.__arrow_batches()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+
+    def to_parquet(self, where, **kwargs) -> None:
+        """Write the data as parquet to `where`, a path or a writable file
+        object; `kwargs` are passed to `pyarrow.parquet.ParquetWriter`.
+        Streamed results are written batch by batch."""
+        import pyarrow.parquet as pq
+        schema, batches = self.__arrow_batches()
+        with pq.ParquetWriter(where, schema, **kwargs) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+
+    def __arrow_batches(self) -> tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+        if isinstance(self._data, Mapping) or isinstance(self._converted.get(pa.Table), Mapping):
+            raise Exception('dictionaries of tables cannot be written as a single table')
+        if isinstance(self._data, Batches) and pa.Table not in self._converted:
+            batches = iter(self._data)
+            first = next(batches, None)
+            if first is None:
+                return self.data(pa.Table).schema, iter(())
+            return first.schema, itertools.chain([first], batches)
+        table = self.data(pa.Table)
+        return table.schema, iter(table.to_batches())
+
+    def native(self) -> Any:
+        """The data as the broker produced it, without conversion: a
+        DataFrame, an Arrow table or a mapping of them. Streamed results are
+        read in full as an Arrow table."""
+        if isinstance(self._data, Batches):
+            return self.data(pa.Table)
+        return self._data
+
+    def matrix(self, feature: str | None = None, values: str = 'abundance', type: type | None = None) -> 'SparseMatrix':
+        """The data as a sparse samples × `feature` matrix of the summed
+        `values`, a scipy.sparse CSR matrix by default.
+
+        The matrix is built from the integer codes of ref_code and of the
+        feature, without a dense pivot. The feature defaults to the term or
+        taxon identifier of the table (`id`, `entry`, `accession`,
+        `ncbi_tax_id`), or to its only other column, such as the rank of
+        `abundance_by_rank`. Results of `abundance_matrix` are converted as
+        they are.
+        """
+        data = self.data(pa.Table) if isinstance(self._data, Batches) else self._data
+        return sparse_matrix(data, feature, values, type)
+
+    @property
+    def streamed(self) -> bool:
+        """Whether the data is produced in batches rather than held in full."""
+        return isinstance(self._data, Batches)
+
+    def batches(self, type: type[pd.DataFrame] | type[pa.RecordBatch] = pd.DataFrame) -> Iterator:
+        """Iterate over the data in chunks, as DataFrames or Arrow record
+        batches. Streamed results are read chunk by chunk, so iterating
+        over them holds a single chunk in memory; other results are
+        returned as one chunk."""
+        if type not in (pd.DataFrame, pa.RecordBatch):
+            raise Exception(f'type "{type}" not supported')
+        if isinstance(self._data, Batches):
+            for batch in self._data:
+                yield batch.to_pandas() if type is pd.DataFrame else batch
+        elif type is pd.DataFrame:
+            yield self.data(pd.DataFrame)
+        else:
+            yield from self.data(pa.Table).to_batches()
+
+
+class Batches:
+    """Re-iterable source of the record batches of a streamed result."""
+
+    def __init__(self, batches: Callable[[], Iterator[pa.RecordBatch]], schema: pa.Schema | None = None):
+        self._batches = batches
+        self.schema = schema
+
+    def __iter__(self) -> Iterator[pa.RecordBatch]:
+        return iter(self._batches())
+
+    def read_all(self) -> pa.Table:
+        batches = list(self)
+        if not batches and self.schema is None:
+            return pa.table({})
+        return pa.Table.from_batches(batches, schema=self.schema if not batches else None)
+
+
+class SparseMatrix(NamedTuple):
+    """Sparse samples × features matrix with the labels of its rows and columns."""
+
+    matrix: Any
+    rows: np.ndarray
+    columns: np.ndarray
+
+
+NAN_METADATA = b'mgo.nan'
+"""Schema metadata listing the string columns whose missing values are NaN
+rather than None in pandas, as in frames read from CSV files."""
+
+
+def frame_table(data: pd.DataFrame) -> pa.Table:
+    """Arrow table of a frame, with its row labels, from which
+    `table_frame` restores the same frame. Arrow has no NaN strings, the
+    string columns holding NaN are listed in the `NAN_METADATA` of the
+    schema."""
+    nan = [c for c in data.select_dtypes(object).columns
+           if data[c].map(lambda v: isinstance(v, float) and v != v).any()]
+    table = pa.Table.from_pandas(data)
+    if nan:
+        table = table.replace_schema_metadata({**table.schema.metadata, NAN_METADATA: json.dumps(nan)})
+    return table
+
+
+def table_frame(table: pa.Table) -> pd.DataFrame:
+    """Frame of a table written by `frame_table`."""
+    nan = json.loads((table.schema.metadata or {}).get(NAN_METADATA, b'[]'))
+    data = table.to_pandas()
+    if nan:
+        data[nan] = data[nan].where(data[nan].notna(), np.nan)
+    return data
+
+
+def sparse_frame(data: Any) -> bool:
+    """Whether `data` is a frame of sparse columns, as `abundance_matrix`
+    returns."""
+    return isinstance(data, pd.DataFrame) and len(data.columns) > 0 \
+        and all(isinstance(dtype, pd.SparseDtype) for dtype in data.dtypes)
+
+
+def triplets(data: pd.DataFrame) -> pa.Table:
+    """Non-zero (ref_code, feature, abundance) triplets of a frame of sparse
+    columns, the form `aggregate.matrix` builds it from. Samples and features
+    whose values are all 0 are kept with an explicit 0."""
+    coo = data.sparse.to_coo()
+    rows, columns, values = coo.row, coo.col, coo.data
+    if data.shape[0] and data.shape[1]:
+        empty_columns = np.setdiff1d(np.arange(data.shape[1]), columns)
+        empty_rows = np.setdiff1d(np.arange(data.shape[0]), rows)
+        rows = np.concatenate([rows, np.zeros(len(empty_columns), rows.dtype), empty_rows])
+        columns = np.concatenate([columns, empty_columns, np.zeros(len(empty_rows), columns.dtype)])
+        values = np.concatenate([values, np.zeros(len(empty_columns) + len(empty_rows), values.dtype)])
+    return pa.table({
+        'ref_code': pa.array(data.index.to_numpy()[rows]),
+        data.columns.name: pa.array(data.columns.to_numpy()[columns]),
+        'abundance': pa.array(values),
+    })
+
+
+FEATURES = ['id', 'entry', 'accession', 'ncbi_tax_id']
+"""Columns identifying the terms or taxa of the metaGOflow tables."""
+
+
+def _sparse_types() -> tuple:
+    try:
+        from scipy import sparse
+    except ImportError:
+        return ()
+    return (sparse.csr_matrix, sparse.csr_array)
+
+
+def _polars_types() -> tuple:
+    try:
+        import polars
+    except ImportError:
+        return ()
+    return (polars.DataFrame,)
+
+
+def sparse_matrix(
+        data: pd.DataFrame | pa.Table,
+        feature: str | None = None,
+        values: str = 'abundance',
+        type: type | None = None,
+        ) -> SparseMatrix:
+    """Sparse samples × `feature` matrix of the `values` of a long table,
+    summed over repeated pairs, or of a frame of sparse columns."""
+    try:
+        from scipy import sparse
+    except ImportError:
+        raise Exception('sparse matrices require scipy')
+    if type is None:
+        type = sparse.csr_matrix
+
+    if sparse_frame(data):
+        return SparseMatrix(type(data.sparse.to_coo().tocsr()), data.index.to_numpy(), data.columns.to_numpy())
+
+    columns = list(data.column_names if isinstance(data, pa.Table) else data.columns)
+    if feature is None:
+        feature = next((c for c in FEATURES if c in columns), None)
+        others = [c for c in columns if c not in ('ref_code', values)]
+        if feature is None and len(others) == 1:
+            feature = others[0]
+    if feature is None:
+        raise Exception('give the feature of the matrix')
+    missing = [c for c in ('ref_code', feature, values) if c not in columns]
+    if missing:
+        raise Exception(f'unknown columns {missing}')
+    if isinstance(data, pa.Table):
+        data = data.select(['ref_code', feature, values]).to_pandas()
+
+    rows, samples = _codes(data['ref_code'])
+    cols, features = _codes(data[feature])
+    # rows of missing samples or features are left out
+    kept = (rows >= 0) & (cols >= 0)
+    matrix = type(
+        (data[values].to_numpy()[kept], (rows[kept], cols[kept])),
+        shape=(len(samples), len(features)),
+    )
+    matrix.sum_duplicates()
+    return SparseMatrix(matrix, samples, features)
+
+
+def _codes(values: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    # codes of the values in sorted order, -1 for missing ones; categoricals
+    # are recoded through their categories rather than their values
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories()
+        values = values.cat.reorder_categories(values.cat.categories.sort_values())
+        return values.cat.codes.to_numpy(), values.cat.categories.to_numpy()
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, np.asarray(uniques)
+
+
+def _named(index: pd.Index) -> bool:
+    return any(name is not None for name in index.names)
+
+
+def _convert(data: Any, type: type) -> Any:
+    if isinstance(data, LazyTables):
+        return LazyTables({ name: (lambda name=name: _convert(data[name], type)) for name in data })
+    if isinstance(data, Mapping):
+        return { name: _convert(table, type) for name, table in data.items() }
+    if isinstance(data, type):
+        return data
+    if type is pd.DataFrame and isinstance(data, pa.Table):
+        return data.to_pandas()
+    if type is pa.Table and sparse_frame(data):
+        # Arrow has no sparse columns, the frame is built from these triplets
+        return triplets(data)
+    if type is pa.Table and isinstance(data, pd.DataFrame):
+        # unnamed row labels, such as those of filtered rows, are left out
+        return pa.Table.from_pandas(data, preserve_index=None if _named(data.index) else False)
+    if type is dict and isinstance(data, pa.Table):
+        # zero-copy for numeric chunks without nulls
+        return { name: column.to_numpy() for name, column in zip(data.column_names, data.columns) }
+    if type is dict and isinstance(data, pd.DataFrame):
+        if _named(data.index):
+            data = data.reset_index()
+        return { str(name): data[name].to_numpy() for name in data.columns }
+    if type in _polars_types() and isinstance(data, pa.Table):
+        import polars
+        return polars.from_arrow(data)
+    if type in _sparse_types() and isinstance(data, (pd.DataFrame, pa.Table)):
+        return sparse_matrix(data, type=type)
+    raise Exception(f'cannot convert {data.__class__.__name__} to "{type}"')
+
+
+class LazyTables(Mapping):
+    """Mapping of table names to DataFrames computed on first access."""
+
+    def __init__(self, loaders: dict[str, Callable[[], pd.DataFrame]]):
+        self._loaders = loaders
+        self._tables: dict[str, pd.DataFrame] = {}
+        self._locks = { name: threading.Lock() for name in loaders }
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        if name not in self._loaders:
+            raise KeyError(name)
+        with self._locks[name]:
+            if name not in self._tables:
+                self._tables[name] = self._loaders[name]()
+            return self._tables[name]
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self) -> int:
+        return len(self._loaders)
+
+    def loaded(self) -> list[str]:
+        """Names of the tables materialised so far."""
+        return [name for name in self._loaders if name in self._tables]
@@ -0,0 +1,216 @@
+"""
+HTTP service answering the named queries of a broker, so that many clients
+share its warm table cache instead of each loading the tables.
+
+    python -m mgo.server --port 8000
+
+`GET /queries` lists the query names as JSON. `POST /query` takes a JSON
+body `{"name": ..., "params": {...}, "format": "arrow" | "parquet",
+"stream": false}` and answers with the result as an Arrow IPC stream or a
+parquet file, never JSON. Queries run on the shared thread pool of the
+brokers (`mgo.broker.executor`). Errors are answered as JSON `{"error": ...}`,
+with status 400 for invalid parameters and 500 for failures of the broker.
+
+Dictionaries of tables (`all_by_ref_code`) are sent as consecutive Arrow IPC
+streams, named in the `X-Mgo-Tables` header; a `tables` list in the request
+selects the tables to send, so lazy clients load them one at a time. Sparse frames
+(`abundance_matrix`) as their non-zero (ref_code, feature, abundance)
+triplets, the feature named in the `X-Mgo-Matrix` header. Streamed queries
+are written batch by batch as they are read.
+"""
+
+import argparse
+import io
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Mapping
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .broker import Broker, executor
+from .namedqueries import QUERY_NAMES
+from .result import Result, frame_table, sparse_frame, triplets
+
+
+logger = logging.getLogger(__name__)
+
+
+ARROW = 'application/vnd.apache.arrow.stream'
+"""Content type of Arrow IPC stream responses."""
+
+
+PARQUET = 'application/vnd.apache.parquet'
+"""Content type of parquet responses."""
+
+
+TABLES_HEADER = 'X-Mgo-Tables'
+"""Header naming the tables of a dictionary result, in the order they are sent."""
+
+
+AVAILABLE_HEADER = 'X-Mgo-Available'
+"""Header naming all the tables of a dictionary result, of which only those
+listed in the `tables` of the request are sent."""
+
+
+MATRIX_HEADER = 'X-Mgo-Matrix'
+"""Header naming the feature of a sparse matrix sent as triplets."""
+
+
+def encode(data, format: str) -> tuple[dict[str, str], bytes]:
+    """Headers and body of the response of a result's data."""
+    if isinstance(data, Mapping):
+        if format != 'arrow':
+            raise Exception('dictionaries of tables are only sent as arrow')
+        sink = io.BytesIO()
+        for table in data.values():
+            sink.write(encode(table, format)[1])
+        return {'Content-Type': ARROW, TABLES_HEADER: ','.join(data)}, sink.getvalue()
+
+    headers = {}
+    if sparse_frame(data):
+        headers[MATRIX_HEADER] = data.columns.name
+        data = triplets(data)
+    table = frame_table(data) if isinstance(data, pd.DataFrame) else data
+    sink = io.BytesIO()
+    if format == 'parquet':
+        pq.write_table(table, sink)
+        return {**headers, 'Content-Type': PARQUET}, sink.getvalue()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return {**headers, 'Content-Type': ARROW}, sink.getvalue()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Handler of the requests of a `QueryServer`."""
+
+    server: 'QueryServer'
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/queries':
+            return self.__error(404, f'unknown path {self.path}')
+        self.__send(200, {'Content-Type': 'application/json'}, json.dumps(list(self.server.broker.queries)).encode())
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/query':
+            return self.__error(404, f'unknown path {self.path}')
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            name = request['name']
+            params = request.get('params') or {}
+            format = request.get('format', 'arrow')
+            stream = request.get('stream', False)
+            if format not in ('arrow', 'parquet'):
+                raise Exception(f'unknown format "{format}"')
+        except Exception as e:
+            return self.__error(400, f'invalid request: {e}')
+        if name not in QUERY_NAMES or name not in self.server.broker.queries:
+            return self.__error(404, f'unknown query name "{name}"')
+
+        try:
+            result = executor().submit(self.server.broker.execute, name, params, stream and format == 'arrow').result()
+            if result.streamed:
+                batches = iter(result.batches(pa.RecordBatch))
+                first = next(batches, None)
+            else:
+                data, available = self.__tables(result, request.get('tables'))
+                headers, body = encode(data, format)
+                if available is not None:
+                    headers[AVAILABLE_HEADER] = ','.join(available)
+        except (KeyError, ValueError, TypeError) as e:
+            # invalid parameters of the query
+            return self.__error(400, str(e.args[0]) if isinstance(e, KeyError) and e.args else str(e))
+        except Exception as e:
+            logger.exception(f'query {name} failed')
+            return self.__error(500, str(e))
+
+        if not result.streamed:
+            return self.__send(200, headers, body)
+        self.__stream(first, batches, result)
+
+    @staticmethod
+    def __tables(result: Result, tables: list[str] | None):
+        data = result.native()
+        if not isinstance(data, Mapping):
+            return data, None
+        if tables is None:
+            return data, list(data)
+        # the tables of a lazy dictionary requested one at a time
+        return {name: data[name] for name in tables if name in data}, list(data)
+
+    def __stream(self, first: pa.RecordBatch | None, batches: Iterator[pa.RecordBatch], result: Result):
+        # the length is unknown, the body ends when the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', ARROW)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        schema = first.schema if first is not None else result.data(pa.Table).schema
+        try:
+            with pa.ipc.new_stream(self.wfile, schema) as writer:
+                if first is not None:
+                    writer.write_batch(first)
+                for batch in batches:
+                    writer.write_batch(batch)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info('client closed the connection of a streamed query')
+
+    def __send(self, status: int, headers: dict[str, str], body: bytes):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __error(self, status: int, message: str):
+        self.__send(status, {'Content-Type': 'application/json'}, json.dumps({'error': message}).encode())
+
+    def log_message(self, format, *args):
+        logger.info(f'{self.address_string()} {format % args}')
+
+
+class QueryServer(ThreadingHTTPServer):
+    """HTTP server of the named queries of `broker`, a LocalBroker over the
+    configured catalog by default."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int] = ('localhost', 8000), broker: Broker | None = None):
+        if broker is None:
+            from .brokers.local import LocalBroker
+            broker = LocalBroker()
+        self.broker = broker
+        super().__init__(address, QueryHandler)
+
+    @property
+    def url(self) -> str:
+        """URL of the server, the connection string of its clients."""
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the EMO BON named queries over HTTP.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--data-dir', help='root of the tables, the contracts directory by default')
+    parser.add_argument('--backend', choices=['pandas', 'arrow', 'duckdb'], default='pandas')
+    parser.add_argument('--result-cache', help='directory of the results kept on disk (local backends)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.backend == 'duckdb':
+        from .brokers.duckdb import DuckDBBroker
+        broker = DuckDBBroker(data_dir=args.data_dir)
+    else:
+        from .brokers.local import LocalBroker, ResultCache
+        resultCache = ResultCache(args.result_cache) if args.result_cache else None
+        broker = LocalBroker(backend=args.backend, data_dir=args.data_dir, result_cache=resultCache)
+    server = QueryServer((args.host, args.port), broker)
+    logger.info(f'serving {len(broker.queries)} queries at {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Synthetic EMO BON datasets for load and scaling tests.
+
+The tables are generated from the bundled contracts tables: samples are drawn
+from the logsheets, and each sample gets a set of GO terms, KO entries, taxa,
+… drawn with the popularity they have in the contracts, with abundances drawn
+from the contracts distribution. The tables keep the file names, schemas and
+sample-by-sample row order of the contracts, so a LocalBroker can serve them
+with `LocalBroker(data_dir=...)`.
+
+    python -m mgo.synthetic /tmp/emobon-x10 --samples 1810
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+from typing import Literal, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .catalog import CONTRACTS_DIR
+
+
+logger = logging.getLogger(__name__)
+
+
+LOGSHEETS = 'Batch1and2_combined_logsheets_2024-11-12.parquet'
+OBSERVATORIES = 'Observatory_combined_logsheets_validated.parquet'
+
+
+class Spec(NamedTuple):
+    """Generated table: file name, columns identifying a vocabulary entry and
+    whether its vocabulary size follows the `terms` or `taxa` option."""
+
+    filename: str
+    keys: list[str]
+    scale: Literal['terms', 'taxa'] | None
+
+
+TABLES = {
+    'go': Spec('metagoflow_analyses.go.parquet', ['id'], 'terms'),
+    'go_slim': Spec('metagoflow_analyses.go_slim.parquet', ['id'], None),
+    'ips': Spec('metagoflow_analyses.ips.parquet', ['accession'], 'terms'),
+    'ko': Spec('metagoflow_analyses.ko.parquet', ['entry'], 'terms'),
+    'lsu': Spec('metagoflow_analyses.LSU.parquet', ['ncbi_tax_id'], 'taxa'),
+    'pfam': Spec('metagoflow_analyses.pfam.parquet', ['entry'], 'terms'),
+    'ssu': Spec('metagoflow_analyses.SSU.parquet', ['ncbi_tax_id'], 'taxa'),
+}
+
+# vocabularies of the tables missing from the contracts
+FALLBACK_VOCABULARIES = {
+    'ips': {'accession': 'IPR{:06d}', 'description': 'synthetic InterPro entry {}'},
+    'pfam': {'entry': 'PF{:05d}', 'name': 'synthetic Pfam family {}'},
+}
+FALLBACK_TERMS = 5000
+FALLBACK_ROWS = 2000
+
+
+class Profile(NamedTuple):
+    """What a table looks like: its vocabulary with the share of samples each
+    entry appears in, the number of rows per sample, the abundances and the
+    columns of the table in order."""
+
+    vocabulary: pd.DataFrame
+    popularity: np.ndarray
+    rows: np.ndarray
+    abundance: pd.Series
+    columns: list[str]
+
+
+def profile(data: pd.DataFrame) -> Profile:
+    """Profile of a metaGOflow table."""
+    columns = [c for c in data.columns if c not in ('ref_code', 'abundance')]
+    grouped = data.groupby(columns, dropna=False, sort=False)
+    popularity = grouped['ref_code'].nunique().to_numpy(dtype=float)
+    vocabulary = grouped.size().reset_index()[columns]
+    rows = data.groupby('ref_code', sort=False).size().to_numpy()
+    return Profile(vocabulary, popularity / popularity.sum(), rows, data['abundance'], list(data.columns))
+
+
+def fallback_profile(name: str, terms: int | None, rng: np.random.Generator) -> Profile:
+    """Profile of a table missing from the contracts, with Zipf distributed
+    popularity, Poisson distributed rows per sample and log-normal
+    abundances."""
+    size = terms or FALLBACK_TERMS
+    vocabulary = pd.DataFrame({
+        column: [pattern.format(i) for i in range(1, size + 1)]
+        for column, pattern in FALLBACK_VOCABULARIES[name].items()
+    })
+    popularity = 1 / np.arange(1, size + 1)
+    rows = np.clip(rng.poisson(min(FALLBACK_ROWS, size), size=1000), 1, size)
+    abundance = pd.Series(np.ceil(rng.lognormal(3, 2, size=10_000)).astype(np.int64))
+    columns = ['ref_code', *vocabulary.columns, 'abundance']
+    return Profile(vocabulary, popularity / popularity.sum(), rows, abundance, columns)
+
+
+def resize(profile: Profile, keys: list[str], size: int) -> Profile:
+    """Profile with a vocabulary of `size` entries.
+
+    A smaller vocabulary keeps the most popular entries. A larger one adds
+    copies of the entries with distinct keys (`GO:0055085.1`, or numeric keys
+    offset past the largest one) and the same popularity.
+    """
+    vocabulary, popularity = profile.vocabulary, profile.popularity
+    current = len(vocabulary)
+    if size <= current:
+        kept = np.sort(np.argsort(-popularity, kind='stable')[:size])
+        vocabulary, popularity = vocabulary.iloc[kept], popularity[kept]
+    else:
+        copies = [vocabulary]
+        for k in range(1, -(-size // current)):
+            copy = vocabulary.copy()
+            for key in keys:
+                if pd.api.types.is_numeric_dtype(copy[key]):
+                    copy[key] = copy[key] + k * (int(vocabulary[key].max()) + 1)
+                else:
+                    copy[key] = copy[key].astype(str) + f'.{k}'
+            copies.append(copy)
+        vocabulary = pd.concat(copies).iloc[:size]
+        popularity = np.resize(popularity, size)
+    rows = np.maximum(1, np.round(profile.rows * size / current)).astype(np.int64)
+    return profile._replace(
+        vocabulary=vocabulary.reset_index(drop=True),
+        popularity=popularity / popularity.sum(),
+        rows=rows,
+    )
+
+
+def draw_abundance(
+        profile: Profile,
+        size: int,
+        rng: np.random.Generator,
+        abundance: Literal['empirical', 'lognormal'],
+        ) -> np.ndarray:
+    values = profile.abundance.dropna().to_numpy()
+    if abundance == 'empirical':
+        return rng.choice(values, size=size)
+    if abundance == 'lognormal':
+        logs = np.log(values[values > 0])
+        drawn = rng.lognormal(logs.mean(), logs.std(), size=size)
+        if pd.api.types.is_integer_dtype(profile.abundance.dtype):
+            return np.ceil(drawn).astype(profile.abundance.dtype)
+        return drawn
+    raise Exception(f'unknown abundance distribution "{abundance}"')
+
+
+def sample_table(
+        profile: Profile,
+        ref_codes: list[str],
+        rng: np.random.Generator,
+        abundance: Literal['empirical', 'lognormal'] = 'empirical',
+        ) -> pd.DataFrame:
+    """Rows of a metaGOflow table for the samples `ref_codes`, written
+    sample by sample."""
+    size = len(profile.vocabulary)
+    counts = np.minimum(rng.choice(profile.rows, size=len(ref_codes)), size)
+    entries = np.concatenate([
+        rng.choice(size, size=count, replace=False, p=profile.popularity)
+        for count in counts
+    ]) if len(ref_codes) else np.empty(0, np.int64)
+    data = profile.vocabulary.take(entries).reset_index(drop=True)
+    data.insert(0, 'ref_code', np.repeat(np.asarray(ref_codes, dtype=object), counts))
+    data['abundance'] = draw_abundance(profile, len(data), rng, abundance).astype(profile.abundance.dtype)
+    return data[profile.columns]
+
+
+def generate(
+        target: str | os.PathLike,
+        samples: int = 1000,
+        taxa: int | None = None,
+        terms: int | None = None,
+        abundance: Literal['empirical', 'lognormal'] = 'empirical',
+        seed: int = 0,
+        source: str | os.PathLike = CONTRACTS_DIR,
+        ) -> dict[str, pathlib.Path]:
+    """Write a synthetic dataset of `samples` sequenced samples to `target`.
+
+    `taxa` and `terms` set the number of distinct taxa of the LSU and SSU
+    tables and of distinct entries of the GO, IPS, KO and PFAM tables (as in
+    the contracts by default). Abundances are drawn from the contracts values
+    or from a log-normal distribution fitted to them. Returns the paths of
+    the tables by name.
+    """
+    target = pathlib.Path(target)
+    source = pathlib.Path(source)
+    target.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ref_codes = [f'SYN{i:08d}' for i in range(1, samples + 1)]
+    paths = {}
+
+    logsheets = pd.read_parquet(source / LOGSHEETS)
+    logsheets = logsheets.iloc[rng.choice(len(logsheets), size=samples)].copy()
+    logsheets.index = pd.Index([f'SYN_{i:08d}' for i in range(1, samples + 1)], name=logsheets.index.name)
+    logsheets['ref_code'] = ref_codes
+    paths['logsheets'] = target / LOGSHEETS
+    logsheets.to_parquet(paths['logsheets'])
+
+    # logsheets are drawn from the observatories, which are kept as they are
+    paths['observatories'] = target / OBSERVATORIES
+    pd.read_parquet(source / OBSERVATORIES).to_parquet(paths['observatories'])
+
+    for name, spec in TABLES.items():
+        size = {'terms': terms, 'taxa': taxa}.get(spec.scale)
+        if (source / spec.filename).exists():
+            table_profile = profile(pd.read_parquet(source / spec.filename))
+            if size is not None:
+                table_profile = resize(table_profile, spec.keys, size)
+        else:
+            logger.info(f'{spec.filename} not found in {source}, generating {name} from a fallback vocabulary')
+            table_profile = fallback_profile(name, size, rng)
+        paths[name] = target / spec.filename
+        sample_table(table_profile, ref_codes, rng, abundance).to_parquet(paths[name], index=False)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic EMO BON dataset.')
+    parser.add_argument('target', help='directory to write the tables to')
+    parser.add_argument('--samples', type=int, default=1000, help='number of sequenced samples')
+    parser.add_argument('--taxa', type=int, help='distinct taxa of the LSU and SSU tables')
+    parser.add_argument('--terms', type=int, help='distinct entries of the GO, IPS, KO and PFAM tables')
+    parser.add_argument('--abundance', choices=['empirical', 'lognormal'], default='empirical')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = generate(args.target, args.samples, args.taxa, args.terms, args.abundance, args.seed)
+    for name, path in paths.items():
+        print(f'{name:<14} {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from mgo.brokers.local import LocalBroker, TableCache
+from mgo.catalog import CONTRACTS_DIR
+import numpy as np
+import pandas as pd
+import pytest
+
+
+SSU = CONTRACTS_DIR / "metagoflow_analyses.SSU.parquet"
+GO = CONTRACTS_DIR / "metagoflow_analyses.go.parquet"
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+def test_abundance_by_rank(backend):
+    """
+    Test that the abundance is summed per sample and rank, unassigned included.
+    """
+    ssu = pd.read_parquet(SSU)
+    ssu = ssu.loc[ssu["abundance"] >= 2]
+    expected = ssu.groupby(["ref_code", "class"], dropna=False)["abundance"].sum()
+    result = LocalBroker(cache=TableCache(), backend=backend).execute(
+        "urn:embrc.eu:emobon:abundance_by_rank", {"table": "ssu", "rank": "class", "abundance_lower": 2}).data()
+    assert list(result.columns) == ["ref_code", "class", "abundance"]
+    assert len(result) == len(expected)
+    assert result["abundance"].sum() == pytest.approx(ssu["abundance"].sum())
+    assert result["class"].isna().sum() == expected.index.get_level_values("class").isna().sum()
+    first = result.loc[result["ref_code"] == result["ref_code"].iloc[0]]
+    assert first["abundance"].is_monotonic_decreasing
+
+
+def test_top_terms():
+    go = pd.read_parquet(GO)
+    go = go.loc[go["aspect"] == "biological_process"]
+    result = LocalBroker(cache=TableCache()).execute(
+        "urn:embrc.eu:emobon:top_terms", {"table": "go", "n": 5, "aspect": "biological_process"}).data()
+    assert list(result.columns) == ["ref_code", "id", "name", "abundance"]
+    assert result.groupby("ref_code").size().max() == 5
+    expected = go.groupby("ref_code")["abundance"].nlargest(5).groupby(level=0).sum()
+    pd.testing.assert_series_equal(
+        result.groupby("ref_code")["abundance"].sum(), expected, check_names=False, check_index_type=False)
+
+
+def test_abundance_matrix():
+    """
+    Test the sparse sample × term matrix against a dense pivot.
+    """
+    go = pd.read_parquet(GO)
+    expected = go.pivot_table(index="ref_code", columns="id", values="abundance", aggfunc="sum", fill_value=0)
+    result = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:abundance_matrix", {"table": "go"}).data()
+    assert all(isinstance(dtype, pd.SparseDtype) for dtype in result.dtypes)
+    assert result.sparse.density < 1
+    np.testing.assert_array_equal(result.sparse.to_dense().to_numpy(), expected.to_numpy())
+    assert list(result.index) == list(expected.index) and list(result.columns) == list(expected.columns)
+
+
+def test_aggregates_cached(tmp_path):
+    """
+    Test that aggregates are cached until their table changes.
+    """
+    go = pd.read_parquet(GO)
+    go.loc[go["ref_code"] == "EMOBON00084"].to_parquet(tmp_path / "metagoflow_analyses.go.parquet")
+    cache = TableCache()
+    broker = LocalBroker(cache=cache, data_dir=tmp_path)
+    params = {"table": "go", "n": 3}
+    first = broker.execute("urn:embrc.eu:emobon:top_terms", params).data()
+    hits = cache.stats()["hits"]
+    assert broker.execute("urn:embrc.eu:emobon:top_terms", params).data().equals(first)
+    assert cache.stats()["hits"] == hits + 1
+    assert len(broker.execute("urn:embrc.eu:emobon:top_terms", {"table": "go", "n": 1}).data()) == 1
+
+    go.loc[go["ref_code"] == "EMOBON00085"].to_parquet(tmp_path / "metagoflow_analyses.go.parquet")
+    assert set(broker.execute("urn:embrc.eu:emobon:top_terms", params).data()["ref_code"]) == {"EMOBON00085"}
+
+
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:abundance_by_rank", {"rank": "phylum"}),
+        ("urn:embrc.eu:emobon:abundance_by_rank", {"table": "go", "rank": "phylum"}),
+        ("urn:embrc.eu:emobon:abundance_by_rank", {"table": "ssu", "rank": "domain"}),
+        ("urn:embrc.eu:emobon:top_terms", {"table": "go", "n": 0}),
+        ("urn:embrc.eu:emobon:abundance_matrix", {"table": "go", "feature": "name"}),
+    ],
+)
+def test_invalid_aggregates(query_name, params):
+    with pytest.raises(Exception):
+        LocalBroker(cache=TableCache()).execute(query_name, params)
@@ -0,0 +1,109 @@
+from mgo.broker import Broker
+from mgo.brokers.local import LocalBroker, TableCache
+from mgo.result import Result
+from mgo.udal import UDAL
+import asyncio
+import threading
+import pandas as pd
+
+import pytest
+
+
+class SlowBroker(Broker):
+    """Broker whose queries block until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    @property
+    def queries(self):
+        return {}
+
+    def execute(self, name, params=None, stream=False) -> Result:
+        self.started.set()
+        self.release.wait(10)
+        return Result(None, pd.DataFrame())
+
+
+def test_aexecute_gather():
+    """
+    Test that gathered queries return the results of execute.
+    """
+    broker = LocalBroker(cache=TableCache())
+    queries = [
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}),
+        ("urn:embrc.eu:emobon:ssu", {"phylum": "Proteobacteria", "abundance_lower": 2}),
+        ("urn:embrc.eu:emobon:observatories", {}),
+        ("urn:embrc.eu:emobon:top_terms", {"table": "ko", "n": 3}),
+    ]
+
+    async def gather():
+        return await asyncio.gather(*(broker.aexecute(name, params) for name, params in queries))
+
+    for (name, params), result in zip(queries, asyncio.run(gather())):
+        assert result.data().equals(broker.execute(name, params).data())
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_aexecute_all_by_ref_code(lazy, backend):
+    params = {"ref_code": ["EMOBON00084", "EMOBON00090"], "lazy": lazy}
+    broker = LocalBroker(cache=TableCache(), backend=backend)
+    result = asyncio.run(broker.aexecute("urn:embrc.eu:emobon:all_by_ref_code", params))
+    expected = broker.execute("urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": params["ref_code"]})
+    assert isinstance(result.data(), dict) != lazy
+    assert set(result.data()) == set(expected.data())
+    for name in expected.data():
+        # the same types as execute, Arrow tables on the arrow backend
+        assert type(result.native()[name]) is type(expected.native()[name])
+        assert result.data()[name].equals(expected.data()[name])
+
+
+def test_aexecute_all_by_ref_code_profile():
+    """
+    Test that the tables loaded by the awaited all_by_ref_code are profiled
+    as when executed directly.
+    """
+    params = {"ref_code": "EMOBON00084"}
+    broker = LocalBroker(cache=TableCache())
+    result = asyncio.run(broker.aexecute("urn:embrc.eu:emobon:all_by_ref_code", params))
+    expected = broker.execute("urn:embrc.eu:emobon:all_by_ref_code", params)
+
+    def loads(result):
+        return sorted(record["table"] for record in result.metadata["profile"]["stages"] if record["stage"] == "load")
+
+    assert loads(result) and loads(result) == loads(expected)
+
+
+def test_aexecute_timeout():
+    broker = SlowBroker()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(broker.aexecute("urn:embrc.eu:emobon:go", timeout=0.05))
+    broker.release.set()
+
+
+def test_aexecute_cancel():
+    """
+    Test that cancelling a query returns control to the event loop at once.
+    """
+    broker = SlowBroker()
+
+    async def cancel():
+        task = asyncio.create_task(broker.aexecute("urn:embrc.eu:emobon:go"))
+        while not broker.started.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(cancel(), 5))
+    broker.release.set()
+
+
+def test_udal_aexecute():
+    udal = UDAL()
+    result = asyncio.run(udal.aexecute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}))
+    assert set(result.data()["ref_code"]) == {"EMOBON00084"}
+    with pytest.raises(Exception):
+        asyncio.run(udal.aexecute("urn:embrc.eu:emobon:missing"))
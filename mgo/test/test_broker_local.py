@@ -1,9 +1,19 @@
 from mgo.udal import UDAL
 from mgo.broker import Broker
+from mgo.brokers.local import LocalBroker, ResultCache, TableCache
+from mgo.catalog import Catalog, CONTRACTS_DIR
+from mgo import instrument
 from mgo.namedqueries import NamedQueryInfo, QueryName, QUERY_NAMES, QUERY_REGISTRY
-from mgo.result import Result
+from mgo.queries import predicates
+from mgo.result import LazyTables, Result
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+import io
 from pathlib import Path
+import os
 
 import pytest
 
@@ -87,4 +97,750 @@ def test_abundance_range(query_name, table_path, params):
     assert isinstance(result, Result)
     assert isinstance(result.data(), pd.DataFrame)
     assert not result.data().empty
-    assert len(result.data()) == len(df)
\ No newline at end of file
+    assert len(result.data()) == len(df)
+
+def test_table_cache_hits():
+    """
+    Test that repeated queries are served from the table cache.
+    """
+    cache = TableCache()
+    broker = LocalBroker(cache=cache)
+    first = broker.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}).data()
+    second = broker.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}).data()
+    assert first.equals(second)
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["entries"] == 1
+
+    # unfiltered results must not expose the cached frame
+    whole = broker.execute("urn:embrc.eu:emobon:go").data()
+    assert not cache.holds(whole)
+
+
+def test_table_cache_invalidation(tmp_path):
+    """
+    Test reloading a cached table when its file changes.
+    """
+    path = tmp_path / "table.csv"
+    pd.DataFrame({"a": [1, 2, 3]}).to_csv(path)
+    cache = TableCache()
+    loader = lambda p: pd.read_csv(p, index_col=[0])
+    assert len(cache.get(path, loader)) == 3
+    assert len(cache.get(path, loader)) == 3
+
+    pd.DataFrame({"a": [1, 2, 3, 4]}).to_csv(path)
+    assert len(cache.get(path, loader)) == 4
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_table_cache_eviction(tmp_path):
+    """
+    Test LRU eviction once the memory budget is exceeded.
+    """
+    loader = lambda p: pd.read_csv(p, index_col=[0])
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"table{i}.csv"
+        pd.DataFrame({"a": range(1000)}).to_csv(path)
+        paths.append(path)
+    nbytes = int(loader(paths[0]).memory_usage(index=True, deep=True).sum())
+
+    cache = TableCache(max_bytes=2 * nbytes)
+    cache.get(paths[0], loader)
+    cache.get(paths[1], loader)
+    cache.get(paths[0], loader)  # paths[1] is now least recently used
+    cache.get(paths[2], loader)
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["evicted_bytes"] == nbytes
+    assert stats["nbytes"] <= stats["max_bytes"]
+
+    cache.get(paths[0], loader)
+    assert cache.stats()["hits"] == 2
+
+
+@pytest.mark.parametrize("schema", [None, {"tidal_stage": "category"}])
+def test_stream_csv_schema(tmp_path, schema):
+    """
+    Test that the batches streamed from a CSV table share the types of the
+    table read at once, whatever the types inferred for each chunk.
+    """
+    csv = CONTRACTS_DIR / "Batch1and2_combined_logsheets_2024-11-12.csv"
+    (tmp_path / "logsheets.csv").write_bytes(csv.read_bytes())
+    catalog = Catalog(tmp_path, {"logsheets": {"location": "logsheets.csv", "format": "csv", "schema": schema}})
+    broker = LocalBroker(cache=TableCache(), catalog=catalog, batch_size=20)
+    streamed = broker.execute("urn:embrc.eu:emobon:logsheets", {"failure": "MISSING"}, stream=True)
+    batches = list(streamed.batches(pa.RecordBatch))
+    assert len(batches) > 1
+    assert all(batch.schema.equals(batches[0].schema, check_metadata=True) for batch in batches)
+    table = pa.Table.from_batches(batches)
+    assert streamed.to_ipc().size > 0
+
+    expected = broker.execute("urn:embrc.eu:emobon:logsheets", {"failure": "MISSING"}).data()
+    result = streamed.data()
+    assert table.num_rows == len(expected)
+    assert list(result.dtypes) == list(expected.dtypes)
+    # arrow has no NaN strings, missing strings come back as None
+    pd.testing.assert_frame_equal(result.isna(), expected.isna())
+    pd.testing.assert_frame_equal(result.astype(str).where(result.notna()), expected.astype(str).where(expected.notna()),
+                                  check_categorical=False)
+
+
+def test_table_cache_loading_locks(tmp_path):
+    """
+    Test that the locks of concurrent loads are dropped once they finish.
+    """
+    loader = lambda p: pd.read_csv(p, index_col=[0])
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"table{i}.csv"
+        pd.DataFrame({"a": range(100)}).to_csv(path)
+        paths.append(path)
+    cache = TableCache(max_bytes=1)  # nothing fits, every request loads
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda path: cache.get(path, loader), paths * 4))
+    assert cache._loading == {}
+    with pytest.raises(ValueError):
+        cache.get(paths[0], lambda p: pd.read_csv(p, usecols=["missing"]))
+    assert cache._loading == {}
+
+
+def test_table_cache_refused():
+    """
+    Test that tables decoding to more than the budget, while their parquet
+    footer is within it, are loaded once and then read with pushdown.
+    """
+    location = CONTRACTS_DIR / "metagoflow_analyses.go.parquet"
+    metadata = pq.ParquetFile(location).metadata
+    footer = sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+    cache = TableCache(max_bytes=2 * footer)
+    broker = LocalBroker(cache=cache, categorical=False)
+    expected = LocalBroker(cache=TableCache(), categorical=False).execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}).data()
+
+    first = broker.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"})
+    assert first.metadata["profile"]["stages"][0]["stage"] == "load"
+    assert cache.fits(location) is False and cache.stats()["entries"] == 0
+    for _ in range(2):
+        result = broker.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"})
+        stages = [record["stage"] for record in result.metadata["profile"]["stages"]]
+        assert stages == ["read"] and result.metadata["profile"]["stages"][0]["pushdown"]
+        pd.testing.assert_frame_equal(result.data().reset_index(drop=True), expected.reset_index(drop=True))
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084", "aspect": "molecular_function"}),
+        ("urn:embrc.eu:emobon:ssu", {"obs_id": "VB", "columns": ["ref_code", "phylum"]}),
+        ("urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": ["EMOBON00084", "EMOBON00085"]}),
+    ],
+)
+def test_row_labels_independent_of_cache(query_name, params):
+    """
+    Test that results have the same row labels whether their table is read
+    through the cache or with pushdown.
+    """
+    pushdown = LocalBroker(cache=TableCache(max_bytes=0)).execute(query_name, params).data()
+    cached = LocalBroker(cache=TableCache()).execute(query_name, params).data()
+    if not isinstance(cached, dict):
+        pushdown, cached = {"": pushdown}, {"": cached}
+    for name in cached:
+        assert not cached[name].empty
+        pd.testing.assert_index_equal(pushdown[name].index, cached[name].index)
+        pd.testing.assert_frame_equal(pushdown[name], cached[name], check_categorical=False)
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}),
+        ("urn:embrc.eu:emobon:ssu", {"obs_id": "VB", "phylum": "Proteobacteria"}),
+        ("urn:embrc.eu:emobon:observatories", {"env_package": "water_column"}),
+        ("urn:embrc.eu:emobon:top_terms", {"table": "ko", "n": 3}),
+        ("urn:embrc.eu:emobon:abundance_by_rank", {"table": "ssu", "rank": "phylum"}),
+    ],
+)
+def test_result_cache(tmp_path, backend, query_name, params):
+    """
+    Test that results are served from disk by other brokers, without
+    reading the tables, with the type of the computed result.
+    """
+    expected = LocalBroker(cache=TableCache(), backend=backend).execute(query_name, params).data()
+    first = LocalBroker(cache=TableCache(), backend=backend, result_cache=ResultCache(tmp_path))
+    miss = first.execute(query_name, params)
+    assert miss.metadata["result_cache"] == "miss"
+    assert type(first.execute(query_name, params).native()) is type(miss.native())
+
+    cache = TableCache()
+    second = LocalBroker(cache=cache, backend=backend, result_cache=ResultCache(tmp_path))
+    result = second.execute(query_name, params)
+    assert result.metadata["result_cache"] == "hit"
+    pd.testing.assert_frame_equal(result.data(), expected)
+    assert cache.stats()["entries"] == 0
+    assert second.result_cache.stats()["hits"] == 1
+
+
+def test_result_cache_invalidation(tmp_path):
+    """
+    Test that results are recomputed when their table changes.
+    """
+    go = pd.read_parquet(CONTRACTS_DIR / "metagoflow_analyses.go.parquet")
+    path = tmp_path / "go.parquet"
+    go.loc[go["ref_code"] == "EMOBON00084"].to_parquet(path)
+    broker = LocalBroker(
+        cache=TableCache(), catalog={"tables": {"go": str(path)}}, result_cache=ResultCache(tmp_path / "results"))
+    assert broker.execute("urn:embrc.eu:emobon:go").metadata["result_cache"] == "miss"
+    assert broker.execute("urn:embrc.eu:emobon:go").metadata["result_cache"] == "hit"
+
+    go.loc[go["ref_code"] == "EMOBON00085"].to_parquet(path)
+    result = broker.execute("urn:embrc.eu:emobon:go")
+    assert result.metadata["result_cache"] == "miss"
+    assert set(result.data()["ref_code"]) == {"EMOBON00085"}
+    for name, params, stream in [
+        ("urn:embrc.eu:emobon:go", {}, True),
+        ("urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": "EMOBON00085"}, False),
+        ("urn:embrc.eu:emobon:abundance_matrix", {"table": "go"}, False),
+    ]:
+        assert broker.execute(name, params, stream=stream).metadata["result_cache"] == "bypass"
+
+
+def test_result_cache_eviction(tmp_path):
+    """
+    Test that the least recently used results are deleted beyond the budget.
+    """
+    cache = ResultCache(tmp_path)
+    tables = { key: pa.table({"a": range(size)}) for key, size in zip("abc", [1000, 2000, 2000]) }
+    cache.put("a", tables["a"])
+    cache.put("b", tables["b"])
+    nbytes = cache.stats()["nbytes"]
+    cache.max_bytes = nbytes + 1
+    assert cache.get("a").equals(tables["a"])
+    os.utime(tmp_path / "b.arrow", (0, 0))  # b is now least recently used
+    cache.put("c", tables["c"])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["nbytes"] <= stats["max_bytes"]
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+def test_profile(backend):
+    """
+    Test the stages recorded in the profile of a query.
+    """
+    broker = LocalBroker(cache=TableCache(), backend=backend)
+    params = {"ref_code": "EMOBON00084", "aspect": "biological_process"}
+    broker.execute("urn:embrc.eu:emobon:go", params)
+    result = broker.execute("urn:embrc.eu:emobon:go", params)
+    profile = result.metadata["profile"]
+    assert profile["query"] == "urn:embrc.eu:emobon:go" and profile["seconds"] > 0
+    stages = { record["stage"]: record for record in profile["stages"] }
+    assert stages["load"]["cache"] == "hit" and stages["load"]["bytes_read"] == 0
+    assert stages["index"]["column"] == "ref_code"
+    assert stages["index"]["rows_out"] == stages["filter"]["rows_in"] < stages["index"]["rows_in"]
+    assert stages["filter"]["rows_out"] == len(result.data())
+    assert all(record["seconds"] >= 0 for record in profile["stages"])
+
+    result.data(dict)
+    assert profile["stages"][-1]["stage"] == "convert"
+
+
+def test_profile_stages():
+    """
+    Test the stages of cold, pushed down and aggregation queries.
+    """
+    cold = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:observatories", {"env_package": "water_column"})
+    load = cold.metadata["profile"]["stages"][0]
+    assert load["stage"] == "load" and load["cache"] == "miss" and load["bytes_read"] > 0
+
+    pushed = LocalBroker(cache=None).execute("urn:embrc.eu:emobon:ssu", {"ref_code": "EMOBON00084"})
+    read = pushed.metadata["profile"]["stages"][0]
+    assert read["stage"] == "read" and read["pushdown"] and read["rows_out"] == len(pushed.data())
+
+    top = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:top_terms", {"table": "ko", "n": 3})
+    aggregated = next(record for record in top.metadata["profile"]["stages"] if record["stage"] == "aggregate")
+    assert aggregated["table"] == "ko" and aggregated["rows_out"] == len(top.data())
+
+    every = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": "EMOBON00084"})
+    loaded = { record["table"] for record in every.metadata["profile"]["stages"] if record["stage"] == "load" }
+    assert len(loaded) == len(every.data())
+
+
+def test_profile_hook():
+    records = []
+    instrument.set_hook(lambda name, record: records.append((name, record)))
+    try:
+        result = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"})
+    finally:
+        instrument.set_hook(None)
+    assert records[-1] == ("query", result.metadata["profile"])
+    assert [record for name, record in records[:-1]] == result.metadata["profile"]["stages"]
+
+    # failing hooks do not fail the queries
+    instrument.set_hook(lambda name, record: 1 / 0)
+    try:
+        LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"})
+    finally:
+        instrument.set_hook(None)
+
+
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084", "aspect": "biological_process"}),
+        ("urn:embrc.eu:emobon:go_slim", {"ref_code": ["EMOBON00084", "EMOBON00085"], "abundance_lower": 100}),
+        ("urn:embrc.eu:emobon:ko", {"entry": ["K07497", "K07486"], "abundance_upper": 5000}),
+        ("urn:embrc.eu:emobon:lsu", {"ref_code": "EMOBON00084", "ncbi_tax_id": 2157}),
+        ("urn:embrc.eu:emobon:ssu", {"superkingdom": "Archaea", "phylum": ["Euryarchaeota"]}),
+        ("urn:embrc.eu:emobon:ssu", {"ref_code": []}),
+    ],
+)
+def test_pushdown_matches_in_memory(query_name, params):
+    """
+    Test that filters pushed down to the parquet reader select the same rows
+    as filtering the cached table.
+    """
+    cached = LocalBroker(cache=TableCache()).execute(query_name, params).data()
+    pushed = LocalBroker(cache=None).execute(query_name, params).data()
+    assert len(cached) == len(pushed)
+    # categories of pushed down reads only cover the decoded row groups
+    pd.testing.assert_frame_equal(
+        cached.reset_index(drop=True),
+        pushed.reset_index(drop=True),
+        check_categorical=False,
+    )
+
+
+@pytest.mark.parametrize("cache", [TableCache(), None])
+def test_columns_projection(cache):
+    """
+    Test selecting columns with the `columns` parameter.
+    """
+    broker = LocalBroker(cache=cache)
+    params = {"ref_code": "EMOBON00084", "columns": ["id", "abundance"]}
+    data = broker.execute("urn:embrc.eu:emobon:go", params).data()
+    assert list(data.columns) == ["id", "abundance"]
+    assert not data.empty
+
+    with pytest.raises(Exception):
+        broker.execute("urn:embrc.eu:emobon:go", {"columns": ["missing"]})
+
+
+def test_all_by_ref_code():
+    """
+    Test querying every table for a sample, eagerly and lazily.
+    """
+    broker = LocalBroker(cache=TableCache())
+    data = broker.execute("urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": "EMOBON00084"}).data()
+    assert {"go", "go_slim", "ko", "lsu", "ssu", "logsheets"} <= set(data.keys())
+    for table in data.values():
+        assert not table.empty
+        assert set(table["ref_code"]) == {"EMOBON00084"}
+
+    lazy = broker.execute(
+        "urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": "EMOBON00084", "lazy": True}
+    ).data()
+    assert isinstance(lazy, LazyTables)
+    assert set(lazy.keys()) == set(data.keys())
+    assert lazy.loaded() == []
+    assert lazy["ko"].equals(data["ko"])
+    assert lazy.loaded() == ["ko"]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"collection_date": "2021-06-28"},
+        {"collection_date": ["2021-06-28", "2021-09-17"], "tidal_stage": "no_tide"},
+        {"scientific_name": "marine plankton metagenome", "tax_id": 1874687},
+        {"source_mat_id": ["EMOBON_HCMR-1_Wa_1", "EMOBON_HCMR-1_Wa_2"]},
+    ],
+)
+def test_logsheets_typed_copy(params):
+    """
+    Test that the typed logsheets copy answers queries like the CSV.
+    """
+    csv = pd.read_csv(
+        Path(__file__).parent.parent.parent / "contracts" / "Batch1and2_combined_logsheets_2024-11-12.csv",
+        index_col=[0],
+    )
+    selected = pd.Series(True, index=csv.index)
+    for column, value in params.items():
+        values = value if isinstance(value, list) else [value]
+        column_values = csv.index.to_series() if column == csv.index.name else csv[column]
+        selected &= column_values.isin(values)
+    expected = csv.loc[selected]
+
+    result = LocalBroker(cache=None).execute("urn:embrc.eu:emobon:logsheets", params).data()
+    assert not result.empty
+    assert list(result.index) == list(expected.index)
+    assert pd.api.types.is_datetime64_any_dtype(result["collection_date"])
+    assert isinstance(result["tidal_stage"].dtype, pd.CategoricalDtype)
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize(
+    "params, expected",
+    [
+        ({"collection_date_lower": "2021-06-01", "collection_date_upper": "2021-06-30"},
+         lambda csv: csv["collection_date"].between("2021-06-01", "2021-06-30")),
+        ({"depth_lower": 1, "depth_upper": 5.5, "ph_method": "PRESENT"},
+         lambda csv: csv["depth"].between(1, 5.5) & csv["ph_method"].notna()),
+        ({"sea_surf_temp_lower": 20, "chlorophyll_method": "MISSING", "failure": "MISSING"},
+         lambda csv: (csv["sea_surf_temp"] >= 20) & csv["chlorophyll_method"].isna()),
+        ({"collection_date_upper": "2021-06-28", "nitrate_upper": 1.0, "columns": ["ref_code", "nitrate"]},
+         lambda csv: (csv["collection_date"] <= "2021-06-28") & (csv["nitrate"] <= 1.0)),
+        ({"size_frac_low_upper": 1, "density_method": "MISSING", "env_package": "water_column"},
+         lambda csv: (csv["size_frac_low"] <= 1) & csv["density_method"].isna() & (csv["env_package"] == "water_column")),
+    ],
+)
+def test_logsheets_ranges(backend, params, expected):
+    """
+    Test the range and PRESENT/MISSING filters of the logsheets measurements.
+    """
+    csv = pd.read_csv(
+        Path(__file__).parent.parent.parent / "contracts" / "Batch1and2_combined_logsheets_2024-11-12.csv",
+        index_col=[0],
+    )
+    expected = csv.loc[expected(csv)]
+    result = LocalBroker(cache=TableCache(), backend=backend).execute("urn:embrc.eu:emobon:logsheets", params).data()
+    assert not result.empty
+    assert list(result.index) == list(expected.index)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"depth_lower": "deep"},
+        {"collection_date_lower": "not a date"},
+        {"collection_date_upper": 2021},
+        {"ph_method": "yes"},
+    ],
+)
+def test_logsheets_invalid_ranges(params):
+    with pytest.raises(Exception):
+        LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:logsheets", params)
+
+
+def test_logsheets_registry():
+    """
+    Test that every parameter of the logsheets query is filtered on.
+    """
+    values = {"scientific_name": "metagenome", "tidal_stage": "low_tide", "env_package": "water_column",
+              "tax_id": 1, "failure": "PRESENT", "collection_date_lower": "2021-06-01",
+              "collection_date_upper": "2021-06-30"}
+    for param in QUERY_REGISTRY["urn:embrc.eu:emobon:logsheets"].params:
+        if param == "columns":
+            continue
+        elif param.endswith("_method"):
+            value = "PRESENT"
+        elif param.endswith(("_lower", "_upper")):
+            value = values.get(param, 1.0)
+        else:
+            value = values.get(param, "x")
+        assert predicates("logsheets", {param: value}), param
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"table": "ko", "observatories": {"env_package": "water_column", "obs_id": ["VB", "HCMR-1", "BPNS"]},
+         "logsheets": {"sea_surf_temp_lower": 15}, "abundance_lower": 3},
+        {"table": "ssu", "logsheets": {"tidal_stage": "high_tide"}, "ref_code": ["EMOBON00045", "EMOBON00084"]},
+        {"table": "go", "observatories": {"env_package": "soft_sediment"}},
+    ],
+)
+def test_join(backend, params):
+    """
+    Test the join query against merging the logsheets and observatories by hand.
+    """
+    contracts = Path(__file__).parent.parent.parent / "contracts"
+    sites = pd.read_parquet(contracts / "Observatory_combined_logsheets_validated.parquet")
+    for column, value in params.get("observatories", {}).items():
+        sites = sites.loc[sites[column].isin(value if isinstance(value, list) else [value])]
+    selected = LocalBroker(cache=TableCache()).execute(
+        "urn:embrc.eu:emobon:logsheets", params.get("logsheets", {})).data()
+    samples = selected.astype({"obs_id": str, "env_package": str}).merge(
+        sites[["obs_id", "env_package"]].astype(str), on=["obs_id", "env_package"])["ref_code"]
+
+    target = {k: v for k, v in params.items() if k not in ("table", "logsheets", "observatories")}
+    expected = LocalBroker(cache=TableCache()).execute(f"urn:embrc.eu:emobon:{params['table']}", target).data()
+    expected = expected.loc[expected["ref_code"].isin(samples)]
+
+    result = LocalBroker(cache=TableCache(), backend=backend).execute("urn:embrc.eu:emobon:join", params).data()
+    assert not result.empty
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True), expected.reset_index(drop=True), check_categorical=False)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"logsheets": {"tidal_stage": "high_tide"}},
+        {"table": "logsheets"},
+        {"table": "go", "observatories": "VB"},
+        {"table": "go", "logsheets": {"ph_method": "yes"}},
+    ],
+)
+def test_invalid_join(params):
+    with pytest.raises(Exception):
+        LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:join", params)
+
+
+@pytest.mark.parametrize(
+    "broker",
+    [
+        lambda: LocalBroker(cache=TableCache()),
+        lambda: LocalBroker(cache=None),
+        lambda: LocalBroker(cache=TableCache(), backend="arrow"),
+    ],
+    ids=["cached", "pushdown", "arrow"],
+)
+def test_execute_many(broker):
+    """
+    Test that grouped queries return the results of executing them one by one.
+    """
+    requests = [
+        ("urn:embrc.eu:emobon:go", {"ref_code": ["EMOBON00084", "EMOBON00090"]}),
+        ("urn:embrc.eu:emobon:ko", {"ref_code": "EMOBON00084"}),
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00085", "aspect": "biological_process", "columns": ["id"]}),
+        ("urn:embrc.eu:emobon:top_terms", {"table": "go", "n": 2}),
+        ("urn:embrc.eu:emobon:go", {"obs_id": "VB", "abundance_lower": 10}),
+        ("urn:embrc.eu:emobon:join", {"table": "go", "logsheets": {"tidal_stage": "high_tide"}}),
+        ("urn:embrc.eu:emobon:ssu", {"ref_code": "EMOBON00084", "columns": ["ref_code", "phylum"]}),
+        ("urn:embrc.eu:emobon:ssu", {"ref_code": "missing", "columns": ["abundance"]}),
+        ("urn:embrc.eu:emobon:logsheets", {"tidal_stage": "high_tide"}),
+        ("urn:embrc.eu:emobon:logsheets", {"source_mat_id": "EMOBON_HCMR-1_Wa_1"}),
+    ]
+    results = broker().execute_many(requests)
+    assert len(results) == len(requests)
+    for (name, params), result in zip(requests, results):
+        assert result.query == QUERY_REGISTRY[name]
+        expected = broker().execute(name, params).data()
+        assert result.data().equals(expected)
+
+
+def test_udal_execute_many():
+    udal = UDAL()
+    go, ko = udal.execute_many([
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}),
+        ("urn:embrc.eu:emobon:ko", {"ref_code": "EMOBON00084"}),
+    ])
+    assert set(go.data()["ref_code"]) == set(ko.data()["ref_code"]) == {"EMOBON00084"}
+    with pytest.raises(Exception):
+        udal.execute_many([("urn:embrc.eu:emobon:missing", {})])
+
+
+@pytest.mark.parametrize("categorical", [True, False])
+def test_categorical_columns(categorical):
+    """
+    Test decoding string columns as categoricals, or opting out.
+    """
+    broker = LocalBroker(cache=TableCache(), categorical=categorical)
+    data = broker.execute("urn:embrc.eu:emobon:lsu", {"ref_code": ["EMOBON00084"], "phylum": "Euryarchaeota"}).data()
+    assert not data.empty
+    assert set(data["phylum"]) == {"Euryarchaeota"}
+    assert isinstance(data["ref_code"].dtype, pd.CategoricalDtype) == categorical
+    assert data["ncbi_tax_id"].dtype == "int64"
+
+
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:go", {}),
+        ("urn:embrc.eu:emobon:go", {"ref_code": ["EMOBON00084", "EMOBON00085"], "aspect": "biological_process"}),
+        ("urn:embrc.eu:emobon:ko", {"ref_code": "EMOBON00084", "columns": ["entry", "abundance"]}),
+        ("urn:embrc.eu:emobon:ssu", {"ref_code": [], "phylum": "Proteobacteria"}),
+        ("urn:embrc.eu:emobon:lsu", {"superkingdom": "Archaea", "abundance_lower": 2}),
+        ("urn:embrc.eu:emobon:logsheets", {"collection_date": ["2021-06-28"], "columns": ["ref_code"]}),
+        ("urn:embrc.eu:emobon:observatories", {"env_package": "water_column"}),
+    ],
+)
+def test_arrow_backend(query_name, params):
+    """
+    Test that the memory-mapped Arrow backend returns the pandas results.
+    """
+    expected = LocalBroker(cache=TableCache()).execute(query_name, params).data()
+    result = LocalBroker(cache=TableCache(), backend="arrow").execute(query_name, params)
+    assert isinstance(result.data(pa.Table), pa.Table)
+    assert result.data(pa.Table) is result.data(pa.Table)
+    # unnamed row labels of filtered pandas results are not carried over
+    drop = expected.index.name is None
+    pd.testing.assert_frame_equal(
+        result.data().reset_index(drop=drop),
+        expected.reset_index(drop=drop),
+        check_categorical=False,
+    )
+
+
+def test_result_arrow_conversion():
+    """
+    Test requesting an Arrow table from the pandas backend.
+    """
+    result = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"})
+    table = result.data(pa.Table)
+    assert isinstance(table, pa.Table)
+    assert table.num_rows == len(result.data())
+    with pytest.raises(Exception):
+        result.data(list)
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize("stream", [False, True])
+def test_result_serialization(tmp_path, backend, stream):
+    """
+    Test the NumPy, Arrow IPC and parquet conversions of results.
+    """
+    params = {"ref_code": ["EMOBON00084", "EMOBON00090"]}
+    broker = LocalBroker(cache=TableCache(), backend=backend)
+    expected = broker.execute("urn:embrc.eu:emobon:go", params).data(pa.Table)
+    result = broker.execute("urn:embrc.eu:emobon:go", params, stream=stream)
+
+    def check(table):
+        # streamed dictionaries may have wider indices
+        pd.testing.assert_frame_equal(table.to_pandas(), expected.to_pandas())
+
+    arrays = result.data(dict)
+    assert result.data(dict) is arrays
+    assert list(arrays) == expected.column_names
+    np.testing.assert_array_equal(arrays["abundance"], expected.column("abundance").to_numpy())
+
+    buffer = result.to_ipc()
+    assert result.to_ipc() is buffer
+    check(pa.ipc.open_stream(buffer).read_all())
+    result.to_ipc(tmp_path / "go.arrows")
+    check(pa.ipc.open_stream(pa.OSFile(str(tmp_path / "go.arrows"))).read_all())
+
+    result.to_parquet(tmp_path / "go.parquet")
+    check(pq.read_table(tmp_path / "go.parquet"))
+    sink = io.BytesIO()
+    result.to_parquet(sink, compression="zstd")
+    check(pq.read_table(io.BytesIO(sink.getvalue())))
+
+
+def test_result_zero_copy():
+    """
+    Test that numeric columns of Arrow results are not copied to NumPy.
+    """
+    result = LocalBroker(cache=TableCache(), backend="arrow").execute("urn:embrc.eu:emobon:go")
+    table = result.data(pa.Table).combine_chunks()
+    chunk = table.column("abundance").chunk(0)
+    abundance = Result(result.query, table).data(dict)["abundance"]
+    assert np.shares_memory(abundance, np.frombuffer(chunk.buffers()[1], dtype=abundance.dtype))
+    with pytest.raises(Exception):
+        LocalBroker(cache=TableCache()).execute(
+            "urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": "EMOBON00084"}).to_ipc()
+
+
+def test_result_polars():
+    polars = pytest.importorskip("polars")
+    result = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"})
+    frame = result.data(polars.DataFrame)
+    assert isinstance(frame, polars.DataFrame)
+    assert result.data(polars.DataFrame) is frame
+    assert frame.to_arrow().num_rows == len(result.data())
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize(
+    "query_name, params, feature",
+    [
+        ("urn:embrc.eu:emobon:go", {"aspect": "biological_process"}, "id"),
+        ("urn:embrc.eu:emobon:ssu", {"ref_code": ["EMOBON00084", "EMOBON00090"]}, "ncbi_tax_id"),
+        ("urn:embrc.eu:emobon:abundance_by_rank", {"table": "lsu", "rank": "phylum"}, "phylum"),
+    ],
+)
+def test_result_sparse(query_name, params, feature, backend):
+    """
+    Test sparse matrices of samples × features against a dense pivot.
+    """
+    sparse = pytest.importorskip("scipy.sparse")
+    result = LocalBroker(cache=TableCache(), backend=backend).execute(query_name, params)
+    data = result.data()
+    expected = data.astype({feature: object, "ref_code": object}).pivot_table(
+        index="ref_code", columns=feature, values="abundance", aggfunc="sum", fill_value=0)
+    matrix, rows, columns = result.data(sparse.csr_matrix)
+    assert isinstance(matrix, sparse.csr_matrix)
+    assert result.data(sparse.csr_matrix) is result.data(sparse.csr_matrix)
+    assert list(rows) == list(expected.index) and list(columns) == list(expected.columns)
+    np.testing.assert_array_equal(matrix.toarray(), expected.to_numpy())
+    assert isinstance(result.matrix(type=sparse.csr_array).matrix, sparse.csr_array)
+
+
+def test_result_sparse_wide():
+    """
+    Test that abundance_matrix results convert to the matrix of their table.
+    """
+    sparse = pytest.importorskip("scipy.sparse")
+    broker = LocalBroker(cache=TableCache())
+    wide = broker.execute("urn:embrc.eu:emobon:abundance_matrix", {"table": "go_slim"}).data(sparse.csr_matrix)
+    long = broker.execute("urn:embrc.eu:emobon:go_slim").data(sparse.csr_matrix)
+    assert (wide.matrix != long.matrix).nnz == 0
+    assert list(wide.rows) == list(long.rows) and list(wide.columns) == list(long.columns)
+    with pytest.raises(Exception):
+        broker.execute("urn:embrc.eu:emobon:observatories").data(sparse.csr_matrix)
+
+
+@pytest.mark.parametrize("conversion", ["table", "ipc", "parquet"])
+def test_result_sparse_arrow(tmp_path, conversion):
+    """
+    Test that abundance_matrix results are converted to Arrow as the
+    triplets of their non-zero values.
+    """
+    result = LocalBroker(cache=TableCache()).execute(
+        "urn:embrc.eu:emobon:abundance_matrix", {"table": "ssu", "feature": "phylum"})
+    wide = result.data()
+    if conversion == "table":
+        table = result.data(pa.Table)
+    elif conversion == "ipc":
+        table = pa.ipc.open_stream(result.to_ipc()).read_all()
+    else:
+        result.to_parquet(tmp_path / "matrix.parquet")
+        table = pq.read_table(tmp_path / "matrix.parquet")
+    assert table.column_names == ["ref_code", "phylum", "abundance"]
+    expected = wide.sparse.to_dense().stack()
+    values = table.to_pandas().set_index(["ref_code", "phylum"])["abundance"]
+    pd.testing.assert_series_equal(
+        values.loc[values != 0].sort_index(), expected.loc[expected != 0].sort_index(), check_names=False)
+
+
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:go", {}),
+        ("urn:embrc.eu:emobon:ssu", {"phylum": "Proteobacteria", "columns": ["ref_code", "abundance"]}),
+        ("urn:embrc.eu:emobon:lsu", {"ref_code": ["EMOBON00084", "EMOBON00090"], "abundance_lower": 2}),
+        ("urn:embrc.eu:emobon:logsheets", {"tidal_stage": "high_tide", "collection_date": ["2021-06-28", "2022-09-14"]}),
+        ("urn:embrc.eu:emobon:observatories", {"env_package": "water_column"}),
+    ],
+)
+def test_stream(query_name, params):
+    """
+    Test that streamed results hold the rows of the regular results.
+    """
+    expected = LocalBroker(cache=TableCache()).execute(query_name, params).data()
+    result = LocalBroker(cache=TableCache(), batch_size=1000).execute(query_name, params, stream=True)
+    assert result.streamed
+    chunks = list(result.batches())
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert sum(len(chunk) for chunk in chunks) == len(expected)
+    drop = expected.index.name is None
+    pd.testing.assert_frame_equal(
+        result.data().reset_index(drop=drop),
+        expected.reset_index(drop=drop),
+        check_categorical=False,
+    )
+
+
+def test_stream_all_by_ref_code():
+    with pytest.raises(Exception):
+        LocalBroker().execute("urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": "EMOBON00084"}, stream=True)
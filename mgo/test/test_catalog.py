@@ -0,0 +1,150 @@
+from mgo.brokers.local import LocalBroker, TableCache
+from mgo.catalog import CONTRACTS_DIR, Catalog, Location, TableEntry
+from mgo.config import Config
+from mgo.udal import UDAL
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+
+def test_location_local(tmp_path):
+    location = Location(tmp_path)
+    assert location.local == tmp_path
+    table = location.joinpath("go.parquet")
+    assert table.local == tmp_path / "go.parquet"
+    assert table.name == "go.parquet" and table.suffix == ".parquet"
+    assert table.with_name("go.csv").local == tmp_path / "go.csv"
+    assert not table.exists()
+    # absolute locations are kept
+    assert location.joinpath("memory://emobon/go.parquet").url == "memory://emobon/go.parquet"
+
+
+def test_catalog_entries(tmp_path):
+    catalog = Catalog(tmp_path, {
+        "go": "go.parquet",
+        "logsheets": {"location": "/data/logsheets.csv", "format": "csv", "schema": {"depth": "float64"}},
+    })
+    assert catalog.location("go").local == tmp_path / "go.parquet"
+    assert catalog["logsheets"] == TableEntry("/data/logsheets.csv", "csv", {"depth": "float64"})
+    assert str(catalog.location("logsheets")) == "/data/logsheets.csv"
+    # tables left out keep their default entry
+    assert catalog.location("ssu").local == tmp_path / "metagoflow_analyses.SSU.parquet"
+    with pytest.raises(Exception):
+        catalog["unknown"]
+
+
+def test_catalog_from_json(tmp_path):
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps({"root": str(tmp_path), "tables": {"go": "go.parquet"}}))
+    assert Catalog.from_config(path).location("go").local == tmp_path / "go.parquet"
+    with pytest.raises(Exception):
+        Catalog.from_config({"root": str(tmp_path), "table": {}})
+
+
+def test_catalog_stale_typed_copy(tmp_path, caplog):
+    """
+    Test that a typed copy older than its CSV is not read.
+    """
+    csv = tmp_path / "observatories.csv"
+    typed = tmp_path / "observatories.parquet"
+    pd.DataFrame({"obs_id": ["VB", "BPNS"]}).to_csv(csv)
+    pd.DataFrame({"obs_id": ["VB", "BPNS"]}).to_parquet(typed)
+    catalog = Catalog(tmp_path, {"observatories": {"location": "observatories.csv", "format": "csv"}})
+    assert catalog.source("observatories") == (Location(typed), "parquet")
+
+    pd.DataFrame({"obs_id": ["VB", "BPNS", "RFormosa"]}).to_csv(csv)
+    os.utime(csv, ns=(typed.stat().st_mtime_ns + 10**9,) * 2)
+    assert catalog.source("observatories") == (Location(csv), "csv")
+    assert "older than" in caplog.text
+    result = LocalBroker(cache=TableCache(), catalog=catalog).execute("urn:embrc.eu:emobon:observatories")
+    assert list(result.data()["obs_id"]) == ["VB", "BPNS", "RFormosa"]
+
+
+def test_broker_data_dir_or_catalog(tmp_path):
+    with pytest.raises(Exception):
+        LocalBroker(data_dir=tmp_path, catalog=Catalog(tmp_path))
+
+
+def test_udal_config(tmp_path):
+    """
+    Test that UDAL serves the tables of the configured catalog.
+    """
+    go = pd.read_parquet(CONTRACTS_DIR / "metagoflow_analyses.go.parquet")
+    go.loc[go["ref_code"] == "EMOBON00084"].to_parquet(tmp_path / "go.parquet")
+    udal = UDAL(config=Config(catalog={"tables": {"go": str(tmp_path / "go.parquet")}}))
+    result = udal.execute("urn:embrc.eu:emobon:go").data()
+    assert set(result["ref_code"]) == {"EMOBON00084"}
+    assert len(udal.execute("urn:embrc.eu:emobon:go_slim").data()["ref_code"].unique()) > 1
+
+
+def test_udal_result_cache(tmp_path):
+    udal = UDAL(config=Config(result_cache=tmp_path))
+    assert udal.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}).metadata["result_cache"] == "miss"
+    assert UDAL(config=Config(result_cache=tmp_path)).execute(
+        "urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}).metadata["result_cache"] == "hit"
+
+
+@pytest.fixture
+def memory_root():
+    fsspec = pytest.importorskip("fsspec")
+    fs = fsspec.filesystem("memory")
+    for name in ["metagoflow_analyses.go.parquet", "metagoflow_analyses.SSU.parquet",
+                 "Observatory_combined_logsheets_validated.csv", "Observatory_combined_logsheets_validated.parquet"]:
+        fs.pipe(f"/emobon/{name}", (CONTRACTS_DIR / name).read_bytes())
+    yield "memory://emobon"
+    fs.rm("/emobon", recursive=True)
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize("cache", [True, False])
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}),
+        ("urn:embrc.eu:emobon:ssu", {"phylum": "Proteobacteria", "abundance_lower": 2}),
+        ("urn:embrc.eu:emobon:observatories", {"env_package": "water_column"}),
+    ],
+)
+def test_fsspec_storage(memory_root, query_name, params, backend, cache):
+    """
+    Test that tables on an fsspec filesystem are served like local ones.
+    """
+    expected = LocalBroker(cache=TableCache()).execute(query_name, params).data()
+    broker = LocalBroker(cache=TableCache() if cache else None, backend=backend, data_dir=memory_root)
+    result = broker.execute(query_name, params)
+    drop = expected.index.name is None
+    pd.testing.assert_frame_equal(
+        result.data().reset_index(drop=drop),
+        expected.reset_index(drop=drop),
+        check_categorical=False,
+    )
+    streamed = broker.execute(query_name, params, stream=True)
+    assert sum(batch.num_rows for batch in streamed.batches(pa.RecordBatch)) == len(expected)
+
+
+def test_fsspec_all_by_ref_code(memory_root):
+    tables = LocalBroker(cache=TableCache(), data_dir=memory_root).execute(
+        "urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": "EMOBON00084"}).data()
+    assert set(tables) == {"go", "ssu"}
+    assert all(set(table["ref_code"]) == {"EMOBON00084"} for table in tables.values())
+
+
+def test_csv_schema(memory_root):
+    """
+    Test that CSV tables are read with the dtypes of their catalog entry.
+    """
+    fsspec = pytest.importorskip("fsspec")
+    fsspec.filesystem("memory").rm("/emobon/Observatory_combined_logsheets_validated.parquet")
+    schema = {"env_package": "category", "latitude": "float32"}
+    catalog = {"root": memory_root, "tables": {"observatories": {
+        "location": "Observatory_combined_logsheets_validated.csv", "format": "csv", "schema": schema,
+    }}}
+    expected = pd.read_csv(CONTRACTS_DIR / "Observatory_combined_logsheets_validated.csv", index_col=[0])
+    for backend in ["pandas", "arrow"]:
+        result = LocalBroker(cache=TableCache(), backend=backend, catalog=catalog).execute(
+            "urn:embrc.eu:emobon:observatories").data()
+        assert len(result) == len(expected)
+        assert isinstance(result["env_package"].dtype, pd.CategoricalDtype)
+        assert result["latitude"].dtype == "float32"
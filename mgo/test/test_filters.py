@@ -0,0 +1,130 @@
+from mgo import filters
+from mgo.filters import FilterPlan, Predicate
+import pandas as pd
+from pathlib import Path
+
+import pytest
+
+
+CONTRACTS = Path(__file__).parent.parent.parent / "contracts"
+
+
+def chained(data, predicates):
+    """Reference implementation selecting rows one predicate at a time."""
+    for predicate in predicates:
+        data = data.loc[filters.mask(data, predicate)]
+    return data
+
+
+@pytest.mark.parametrize(
+    "table_path, params",
+    [
+        ("metagoflow_analyses.LSU.parquet", {"ref_code": "EMOBON00084", "abundance_lower": 2}),
+        ("metagoflow_analyses.SSU.parquet", {
+            "superkingdom": "Bacteria", "kingdom": ["Bacteria"], "phylum": "Proteobacteria",
+            "class": "Alphaproteobacteria", "abundance_lower": 1, "abundance_upper": 100,
+        }),
+        ("metagoflow_analyses.SSU.parquet", {"ncbi_tax_id": [2157, 2], "genus": []}),
+        ("metagoflow_analyses.go.parquet", {"aspect": "cellular_component", "name": 42}),
+    ],
+)
+def test_plan_matches_chained_filters(table_path, params):
+    """
+    Test that the single-pass plan selects the same rows as chained masks.
+    """
+    data = pd.read_parquet(CONTRACTS / table_path)
+    predicates = [
+        *filters.equality(params, "ref_code"),
+        *filters.equality(params, "ncbi_tax_id", scalar=int),
+        *filters.abundance(params),
+        *[p for rank in ("superkingdom", "kingdom", "phylum", "class", "genus")
+          for p in filters.equality(params, rank)],
+        *filters.equality(params, "aspect"),
+        *filters.equality(params, "name"),
+    ]
+    assert FilterPlan(predicates).apply(data).equals(chained(data, predicates))
+
+
+def test_plan_without_predicates():
+    """
+    Test that an empty plan leaves the data untouched.
+    """
+    data = pd.DataFrame({"a": [1, 2]})
+    plan = FilterPlan([])
+    assert not plan
+    assert plan.mask(data) is None
+    assert plan.apply(data) is data
+
+
+def test_plan_filters_index():
+    """
+    Test filtering on the column read as index of a CSV table.
+    """
+    data = pd.DataFrame({"a": [1, 2, 3]}, index=pd.Index(["x", "y", "z"], name="id"))
+    plan = FilterPlan([Predicate("id", "in", ["x", "z"]), Predicate("a", ">=", 2)])
+    assert list(plan.apply(data).index) == ["z"]
+
+
+def test_invalid_values():
+    """
+    Test that values outside the accepted ones are rejected.
+    """
+    with pytest.raises(Exception):
+        filters.equality({"tidal_stage": "spring_tide"}, "tidal_stage", valid_values=["no_tide"])
+    with pytest.raises(Exception):
+        filters.abundance({"abundance_lower": 1.5})
+    with pytest.raises(Exception):
+        filters.bounds({"depth_lower": True}, "depth")
+    with pytest.raises(Exception):
+        filters.presence({"ph_method": "present"}, "ph_method")
+
+
+def test_date_bounds():
+    """
+    Test that dates without zero padding are compared as ISO dates.
+    """
+    predicates = filters.date_bounds({"date_lower": "2021-6-1", "date_upper": "2021-06-30"}, "date")
+    assert [predicate.value for predicate in predicates] == ["2021-06-01", "2021-06-30"]
+    data = pd.DataFrame({"date": ["2021-05-31", "2021-06-01", "2021-06-15", "2021-07-01"]})
+    assert list(FilterPlan(predicates).apply(data).index) == [1, 2]
+
+
+def test_bounds_and_presence():
+    """
+    Test that bounds and PRESENT/MISSING select the same rows in every evaluator.
+    """
+    import pyarrow as pa
+    data = pd.DataFrame({"depth": [0.5, 2.0, None, 10.0], "method": ["a", None, "b", None]})
+    predicates = [
+        *filters.bounds({"depth_lower": 1, "depth_upper": 10.0}, "depth"),
+        *filters.presence({"method": "MISSING"}, "method"),
+    ]
+    assert list(FilterPlan(predicates).apply(data).index) == [1, 3]
+    assert FilterPlan(predicates).apply_table(pa.Table.from_pandas(data)).num_rows == 2
+
+    missing = filters.presence({"depth": "MISSING"}, "depth")
+    assert list(FilterPlan(missing).apply(data).index) == [2]
+    # NaN rather than null, as in float columns converted from pandas
+    nan = pa.table({"depth": pa.array([0.5, float("nan"), None])})
+    assert FilterPlan(missing).apply_table(nan).num_rows == 2
+
+
+def test_to_sql():
+    """
+    Test the SQL condition of a conjunction of predicates.
+    """
+    import pyarrow as pa
+    schema = pa.schema([("order", pa.string()), ("date", pa.timestamp("ns")), ("abundance", pa.int64())])
+    condition, values = filters.to_sql([
+        Predicate("order", "in", ["Rhodobacterales"]),
+        Predicate("date", "==", "2021-06-08"),
+        Predicate("abundance", ">=", 2),
+    ], schema)
+    assert condition == 'list_contains(?, "order") AND "date" = ? AND "abundance" >= ?'
+    assert values == [["Rhodobacterales"], pd.Timestamp("2021-06-08").to_pydatetime(), 2]
+    assert filters.to_sql([Predicate("abundance", "isna", None), Predicate("order", "notna", None)], schema) \
+        == ('"abundance" IS NULL AND "order" IS NOT NULL', [])
+    assert filters.to_sql([Predicate("depth", "isna", None)], pa.schema([("depth", pa.float64())])) \
+        == ('("depth" IS NULL OR isnan("depth"))', [])
+    assert filters.to_sql([]) == ("TRUE", [])
+    assert filters.to_sql([Predicate("a", "in", [])]) == ("FALSE", [])
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+HEAVY_MODULES = ["pandas", "pyarrow", "numpy", "mgo.result", "mgo.brokers.local"]
+"""Modules which listing the queries must not import."""
+
+
+def importtime(code: str) -> dict[str, tuple[int, int]]:
+    """Self and cumulative import times (µs) of the modules imported by
+    running `code` in a new interpreter, from `python -X importtime`."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(path for path in sys.path if path)}
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+@pytest.mark.parametrize("code", [
+    "import mgo.udal",
+    "import mgo.udal, mgo.config; mgo.udal.UDAL(config=mgo.config.Config()).queries",
+])
+def test_import_udal(code):
+    """
+    Test that listing the queries imports neither pandas, pyarrow nor the
+    brokers, unless the UDAL specification does.
+    """
+    baseline = importtime("import udal.specification")
+    times = importtime(code)
+    assert [module for module in HEAVY_MODULES if module in times and module not in baseline] == []
+    # the modules of the package itself, the dependencies are checked above
+    assert sum(own for module, (own, _) in times.items() if module.startswith("mgo")) < 50_000
+
+
+def test_import_broker():
+    """
+    Test that the broker is imported with the first query.
+    """
+    times = importtime(
+        "import mgo.udal; udal = mgo.udal.UDAL(); assert 'mgo.brokers.local' not in __import__('sys').modules; "
+        "udal.execute('urn:embrc.eu:emobon:observatories')")
+    assert "mgo.brokers.local" in times and "pandas" in times
@@ -0,0 +1,57 @@
+from mgo.index import ColumnIndex
+from mgo.filters import FilterPlan, Predicate
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import pytest
+
+
+CONTRACTS = Path(__file__).parent.parent.parent / "contracts"
+
+
+def test_positions():
+    """
+    Test looking up runs, including values split over several runs.
+    """
+    values = pd.Series(["a", "a", "b", None, "c", "c", "a"])
+    index = ColumnIndex.build(values)
+    assert len(index) == 3
+    assert "a" in index and "z" not in index
+    assert list(index.positions("a")) == [0, 1, 6]
+    assert list(index.positions(["c", "b"])) == [2, 4, 5]
+    assert list(index.positions(["z"])) == []
+
+
+@pytest.mark.parametrize(
+    "table_path, ref_codes",
+    [
+        ("metagoflow_analyses.go.parquet", ["EMOBON00084"]),
+        ("metagoflow_analyses.SSU.parquet", ["EMOBON00100", "EMOBON00084", "missing"]),
+    ],
+)
+def test_index_matches_scan(table_path, ref_codes):
+    """
+    Test that indexed ref_code lookups return the rows of a full scan.
+    """
+    data = pd.read_parquet(CONTRACTS / table_path)
+    index = ColumnIndex.build(data["ref_code"])
+    plan = FilterPlan([Predicate("ref_code", "in", ref_codes), Predicate("abundance", ">=", 2)])
+    assert plan.apply(data, {"ref_code": index}).equals(plan.apply(data))
+
+
+def test_sidecar(tmp_path):
+    """
+    Test persisting the index and discarding it once the table changes.
+    """
+    path = tmp_path / "table.parquet"
+    path.touch()
+    values = pd.Series(["a", "a", "b"])
+    built = ColumnIndex.open(path, "ref_code", (1, 3), values)
+    sidecar = ColumnIndex.sidecar(path, "ref_code")
+    assert sidecar.exists()
+
+    loaded = ColumnIndex.load(sidecar, (1, 3))
+    assert loaded is not None
+    assert np.array_equal(loaded.positions("a"), built.positions("a"))
+    assert ColumnIndex.load(sidecar, (2, 3)) is None
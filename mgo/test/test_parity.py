@@ -0,0 +1,190 @@
+from mgo.brokers.local import LocalBroker, TableCache
+from mgo.catalog import Catalog
+from mgo.namedqueries import QUERY_REGISTRY
+from mgo import queries
+from mgo.udal import UDAL
+import pandas as pd
+import pyarrow as pa
+import pytest
+import threading
+
+
+def duckdb_broker(**kwargs):
+    pytest.importorskip("duckdb")
+    from mgo.brokers.duckdb import DuckDBBroker
+    return DuckDBBroker(**kwargs)
+
+
+SERVERS = {}
+
+
+def remote_broker(**kwargs):
+    """Client of a server running a LocalBroker in-process, shared by the
+    tests of the default tables."""
+    from mgo.brokers.remote import RemoteBroker
+    from mgo.server import QueryServer
+    key = repr(sorted(kwargs.items()))
+    if key not in SERVERS:
+        SERVERS[key] = QueryServer(("localhost", 0), LocalBroker(cache=TableCache(), **kwargs))
+        threading.Thread(target=SERVERS[key].serve_forever, daemon=True).start()
+    return RemoteBroker(SERVERS[key].url)
+
+
+# brokers which must answer every named query like LocalBroker
+BROKERS = {
+    "duckdb": duckdb_broker,
+    "remote": remote_broker,
+}
+
+
+CASES = {
+    "urn:embrc.eu:emobon:abundance_by_rank": [
+        {"table": "ssu", "rank": "phylum"},
+        {"table": "lsu", "rank": "genus", "obs_id": "VB", "superkingdom": "Bacteria", "abundance_lower": 2},
+    ],
+    "urn:embrc.eu:emobon:abundance_matrix": [
+        {"table": "go_slim"},
+        {"table": "ssu", "feature": "class", "ref_code": ["EMOBON00084", "EMOBON00090"]},
+    ],
+    "urn:embrc.eu:emobon:all_by_ref_code": [
+        {"ref_code": "EMOBON00084"},
+        {"ref_code": ["EMOBON00084", "EMOBON00090", "missing"]},
+    ],
+    "urn:embrc.eu:emobon:go": [
+        {},
+        {"ref_code": "EMOBON00084"},
+        {"aspect": "biological_process", "abundance_lower": 10, "abundance_upper": 100},
+        {"obs_id": ["VB", "HCMR-1"], "columns": ["ref_code", "name"]},
+        {"ref_code": "missing"},
+    ],
+    "urn:embrc.eu:emobon:go_slim": [{"ref_code": ["EMOBON00084", "EMOBON00090"], "id": "GO:0003824"}],
+    "urn:embrc.eu:emobon:ips": [{"ref_code": "EMOBON00084"}],
+    "urn:embrc.eu:emobon:join": [
+        {"table": "ko", "observatories": {"env_package": "water_column"}, "logsheets": {"sea_surf_temp_lower": 15},
+         "abundance_lower": 3},
+        {"table": "ssu", "logsheets": {"tidal_stage": "high_tide"}, "phylum": "Proteobacteria",
+         "columns": ["ref_code", "class", "abundance"]},
+        {"table": "go", "observatories": {"obs_id": "missing"}},
+    ],
+    "urn:embrc.eu:emobon:ko": [{"obs_id": "VB", "abundance_lower": 5}],
+    "urn:embrc.eu:emobon:logsheets": [
+        {},
+        {"tidal_stage": "high_tide"},
+        {"collection_date": ["2021-06-08", "not a date"]},
+        {"source_mat_id": "EMOBON_VB_Wa_210608_micro_1", "columns": ["ref_code", "obs_id"]},
+        {"collection_date_lower": "2021-06-01", "collection_date_upper": "2021-06-30", "depth_upper": 5},
+        {"chlorophyll_method": "PRESENT", "sea_surf_temp_lower": 15.5, "failure": "MISSING"},
+        {"ph_method": "MISSING", "ph_lower": 8},
+    ],
+    "urn:embrc.eu:emobon:lsu": [{"phylum": "Proteobacteria", "abundance_lower": 2}],
+    "urn:embrc.eu:emobon:observatories": [
+        {},
+        {"env_package": "water_column", "columns": ["obs_id", "organization_country"]},
+        {"obs_id": ["VB", "missing"]},
+    ],
+    "urn:embrc.eu:emobon:pfam": [{"ref_code": "EMOBON00084"}],
+    "urn:embrc.eu:emobon:ssu": [
+        {"ref_code": "EMOBON00084", "order": "Rhodobacterales"},
+        {"obs_id": "VB", "class": ["Alphaproteobacteria", "Gammaproteobacteria"], "abundance_upper": 3},
+    ],
+    "urn:embrc.eu:emobon:top_terms": [
+        {"table": "go", "aspect": "molecular_function"},
+        {"table": "ko", "n": 3, "obs_id": ["VB", "HCMR-1"]},
+    ],
+}
+
+
+def test_cases_cover_registry():
+    assert set(CASES) == set(QUERY_REGISTRY)
+
+
+def assert_same(result: pd.DataFrame, expected: pd.DataFrame):
+    # filtered frames keep the labels of the full table only in LocalBroker
+    drop = expected.index.name is None
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=drop),
+        expected.reset_index(drop=drop),
+        check_categorical=False,
+    )
+
+
+def assert_same_table(result: pa.Table, expected: pa.Table):
+    # the same columns, of the same values
+    assert result.column_names == expected.column_names
+    pd.testing.assert_frame_equal(result.to_pandas(), expected.to_pandas(), check_categorical=False, check_dtype=False)
+
+
+@pytest.mark.parametrize("broker", BROKERS)
+@pytest.mark.parametrize(
+    "query_name, params",
+    [(query_name, params) for query_name, cases in CASES.items() for params in cases],
+)
+def test_parity(broker, query_name, params):
+    """
+    Test that the brokers return the frames and Arrow tables of LocalBroker.
+    """
+    table = queries.QUERY_TABLES.get(query_name, params.get("table"))
+    if table is not None and not Catalog().source(table)[0].exists():
+        pytest.skip(f"missing table {table}")
+    local = LocalBroker(cache=TableCache()).execute(query_name, params)
+    expected = local.data()
+    result = BROKERS[broker]().execute(query_name, params)
+    assert result.query == QUERY_REGISTRY[query_name]
+    if isinstance(expected, dict):
+        assert set(result.data()) == set(expected)
+        for name in expected:
+            assert_same(result.data()[name], expected[name])
+        return
+    assert_same(result.data(), expected)
+    assert_same_table(result.data(pa.Table), local.data(pa.Table))
+    if query_name not in queries.QUERY_TABLES and query_name != "urn:embrc.eu:emobon:join":
+        return
+    streamed = BROKERS[broker]().execute(query_name, params, stream=True)
+    assert sum(batch.num_rows for batch in streamed.batches(pa.RecordBatch)) == len(expected)
+
+
+@pytest.mark.parametrize("broker", BROKERS)
+def test_parity_partitioned(broker, tmp_path):
+    """
+    Test that the brokers serve partitioned tables.
+    """
+    from mgo import partition
+    catalog = partition.convert(tmp_path, tables=["ssu"])
+    params = {"obs_id": ["VB", "HCMR-1"], "phylum": "Proteobacteria"}
+    expected = LocalBroker(cache=TableCache(), catalog=catalog).execute("urn:embrc.eu:emobon:ssu", params).data()
+    result = BROKERS[broker](catalog=catalog).execute("urn:embrc.eu:emobon:ssu", params).data()
+    sort = lambda data: data.astype(str).sort_values(list(data.columns)).reset_index(drop=True)
+    pd.testing.assert_frame_equal(sort(result), sort(expected))
+
+
+def test_udal_duckdb():
+    pytest.importorskip("duckdb")
+    from mgo.brokers.duckdb import DuckDBBroker
+    udal = UDAL("duckdb")
+    assert isinstance(udal._broker, DuckDBBroker)
+    assert set(udal.queries) == set(LocalBroker().queries)
+    result = udal.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}).data()
+    assert set(result["ref_code"]) == {"EMOBON00084"}
+
+
+@pytest.mark.parametrize("broker", BROKERS)
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:logsheets", {}),
+        ("urn:embrc.eu:emobon:logsheets", {"collection_date_upper": "2021-06-28", "nitrate_method": "PRESENT"}),
+        ("urn:embrc.eu:emobon:observatories", {"env_package": "water_column"}),
+        ("urn:embrc.eu:emobon:go", {"obs_id": "VB", "columns": ["ref_code", "abundance"]}),
+    ],
+)
+def test_parity_csv(broker, tmp_path, query_name, params):
+    """
+    Test that the brokers read CSV tables without typed copies like LocalBroker.
+    """
+    from mgo.catalog import CONTRACTS_DIR
+    for name in ["metagoflow_analyses.go.parquet", "Batch1and2_combined_logsheets_2024-11-12.csv",
+                 "Observatory_combined_logsheets_validated.csv"]:
+        (tmp_path / name).write_bytes((CONTRACTS_DIR / name).read_bytes())
+    expected = LocalBroker(cache=TableCache(), data_dir=tmp_path).execute(query_name, params).data()
+    result = BROKERS[broker](data_dir=tmp_path).execute(query_name, params).data()
+    assert_same(result, expected)
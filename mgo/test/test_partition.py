@@ -0,0 +1,89 @@
+from mgo import partition
+from mgo.brokers.local import LocalBroker, TableCache
+from mgo.catalog import CONTRACTS_DIR, Catalog
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+
+@pytest.fixture(scope="module")
+def partitioned(tmp_path_factory):
+    target = tmp_path_factory.mktemp("partitioned")
+    return partition.convert(target, tables=["go", "ssu"])
+
+
+def sort(data: pd.DataFrame) -> pd.DataFrame:
+    data = data.astype({c: object for c in data.columns if isinstance(data[c].dtype, pd.CategoricalDtype)})
+    return data.sort_values(list(data.columns)).reset_index(drop=True)
+
+
+def test_layout(partitioned):
+    root = Catalog.from_config(partitioned).location("go").local
+    files = sorted(root.glob("batch=1-2/obs_id=*/*.parquet"))
+    assert len(files) > 1
+    manifest = pd.read_parquet(root / partition.MANIFEST)
+    go = pd.read_parquet(CONTRACTS_DIR / "metagoflow_analyses.go.parquet", columns=["ref_code"])
+    assert set(manifest["ref_code"]) == set(go["ref_code"])
+    assert {root / path for path in manifest["path"]} == set(files)
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+@pytest.mark.parametrize(
+    "query_name, params",
+    [
+        ("urn:embrc.eu:emobon:go", {}),
+        ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}),
+        ("urn:embrc.eu:emobon:go", {"ref_code": ["EMOBON00084", "EMOBON00090", "missing"], "abundance_lower": 10}),
+        ("urn:embrc.eu:emobon:go", {"ref_code": "missing"}),
+        ("urn:embrc.eu:emobon:ssu", {"obs_id": "VB"}),
+        ("urn:embrc.eu:emobon:ssu", {"obs_id": ["VB", "HCMR-1"], "phylum": "Proteobacteria", "columns": ["ref_code", "abundance"]}),
+    ],
+)
+def test_partitioned_matches_monolithic(partitioned, query_name, params, backend):
+    """
+    Test that partitioned tables answer queries like the monolithic tables.
+    """
+    expected = LocalBroker(cache=TableCache()).execute(query_name, params).data()
+    result = LocalBroker(cache=TableCache(), catalog=partitioned, backend=backend).execute(query_name, params)
+    pd.testing.assert_frame_equal(sort(result.data()), sort(expected))
+    streamed = LocalBroker(catalog=partitioned).execute(query_name, params, stream=True)
+    assert sum(batch.num_rows for batch in streamed.batches(pa.RecordBatch)) == len(expected)
+
+
+def test_observatories_of_monolithic_tables():
+    obs_ids = partition.observatories(pd.read_parquet(CONTRACTS_DIR / "Batch1and2_combined_logsheets_2024-11-12.parquet"))
+    result = LocalBroker(cache=TableCache()).execute("urn:embrc.eu:emobon:ssu", {"obs_id": "VB"}).data()
+    assert len(result) > 0
+    assert set(result["ref_code"].astype(str).map(obs_ids)) == {"VB"}
+
+
+def test_pruning(tmp_path):
+    """
+    Test that queries on samples only open the files of their partitions.
+    """
+    catalog = partition.convert(tmp_path, tables=["go"])
+    manifest = pd.read_parquet(tmp_path / "go" / partition.MANIFEST)
+    ref_code = manifest["ref_code"].iloc[0]
+    own = manifest.loc[manifest["ref_code"] == ref_code, "path"].iloc[0]
+    for path in set(manifest["path"]) - {own}:
+        (tmp_path / "go" / path).write_bytes(b"not a parquet file")
+    result = LocalBroker(cache=None, catalog=catalog).execute("urn:embrc.eu:emobon:go", {"ref_code": ref_code}).data()
+    assert len(result) > 0 and set(result["ref_code"]) == {ref_code}
+
+
+def test_add_batch(tmp_path):
+    """
+    Test adding a batch without rewriting the partitions of the others.
+    """
+    catalog = partition.convert(tmp_path, tables=["go"])
+    existing = {path: path.stat().st_mtime_ns for path in (tmp_path / "go").glob("batch=1-2/**/*.parquet")}
+    go = pd.read_parquet(CONTRACTS_DIR / "metagoflow_analyses.go.parquet")
+    batch = go.loc[go["ref_code"] == "EMOBON00084"].assign(ref_code="EMOBON99999")
+    partition.write_batch(batch, tmp_path / "go", "3", {"EMOBON99999": "VB"})
+
+    assert {path: path.stat().st_mtime_ns for path in existing} == existing
+    assert (tmp_path / "go" / "batch=3" / "obs_id=VB").is_dir()
+    broker = LocalBroker(cache=TableCache(), catalog=catalog)
+    result = broker.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON99999"}).data()
+    assert len(result) == len(batch)
+    assert len(broker.execute("urn:embrc.eu:emobon:go").data()) == len(go) + len(batch)
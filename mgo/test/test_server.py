@@ -0,0 +1,123 @@
+from mgo.brokers.local import LocalBroker, TableCache
+from mgo.brokers.remote import RemoteBroker
+from mgo.catalog import Catalog
+from mgo.server import QueryServer
+from mgo.udal import UDAL
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import urllib.error
+import urllib.request
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = QueryServer(("localhost", 0), LocalBroker(cache=TableCache()))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_queries(server):
+    with urllib.request.urlopen(f"{server.url}/queries") as response:
+        names = json.loads(response.read())
+    assert set(names) == set(server.broker.queries)
+    assert set(RemoteBroker(server.url).queries) == set(server.broker.queries)
+
+
+@pytest.mark.parametrize("format", ["arrow", "parquet"])
+@pytest.mark.parametrize("name,params", [
+    ("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"}),
+    ("urn:embrc.eu:emobon:ssu", {"phylum": "Proteobacteria", "abundance_lower": 2}),
+    ("urn:embrc.eu:emobon:observatories", {}),
+    ("urn:embrc.eu:emobon:abundance_matrix", {"table": "ssu", "feature": "phylum"}),
+])
+def test_remote(server, format, name, params):
+    result = RemoteBroker(server.url, format=format).execute(name, params).data()
+    expected = server.broker.execute(name, params).data()
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_remote_stream(server):
+    params = {"ref_code": ["EMOBON00084", "EMOBON00090"]}
+    result = RemoteBroker(server.url).execute("urn:embrc.eu:emobon:go", params, stream=True)
+    assert result.streamed
+    expected = server.broker.execute("urn:embrc.eu:emobon:go", params).data()
+    pd.testing.assert_frame_equal(result.data(), expected)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_remote_all_by_ref_code(server, lazy):
+    params = {"ref_code": "EMOBON00084"}
+    result = RemoteBroker(server.url).execute("urn:embrc.eu:emobon:all_by_ref_code", {**params, "lazy": lazy}).data()
+    expected = server.broker.execute("urn:embrc.eu:emobon:all_by_ref_code", params).data()
+    assert isinstance(result, dict) != lazy
+    assert set(result) == set(expected)
+    for name in expected:
+        pd.testing.assert_frame_equal(result[name], expected[name])
+
+
+def test_remote_errors(server):
+    broker = RemoteBroker(server.url)
+    with pytest.raises(Exception, match="unknown query name"):
+        broker.execute("urn:embrc.eu:emobon:missing")
+    with pytest.raises(Exception, match="table"):
+        broker.execute("urn:embrc.eu:emobon:top_terms", {"table": "unknown"})
+    with pytest.raises(Exception):
+        RemoteBroker(server.url, format="json")
+
+
+@pytest.mark.parametrize("broken, params, status", [
+    (False, {"ref_code": "EMOBON00084", "abundance_lower": "many"}, 400),
+    (False, {"ref_code": "EMOBON00084", "columns": ["missing"]}, 400),
+    (True, {"ref_code": "EMOBON00084"}, 500),
+])
+def test_error_status(server, tmp_path, broken, params, status):
+    """
+    Test that invalid parameters are answered with 400 and failures of the
+    broker with 500.
+    """
+    if broken:
+        catalog = Catalog(tmp_path, {"go": {"location": "missing.parquet"}})
+        server = QueryServer(("localhost", 0), LocalBroker(cache=None, catalog=catalog))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    body = json.dumps({"name": "urn:embrc.eu:emobon:go", "params": params}).encode()
+    request = urllib.request.Request(f"{server.url}/query", data=body, method="POST")
+    try:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == status
+        assert "error" in json.loads(e.value.read())
+    finally:
+        if broken:
+            server.shutdown()
+            server.server_close()
+
+
+def test_concurrent_clients(server):
+    """
+    Test that concurrent clients are answered from the cache of the server.
+    """
+    params = {"ref_code": "EMOBON00084"}
+    expected = server.broker.execute("urn:embrc.eu:emobon:ko", params).data()
+    misses = server.broker.cache.stats()["misses"]
+
+    def query(_):
+        return RemoteBroker(server.url).execute("urn:embrc.eu:emobon:ko", params).data()
+
+    with ThreadPoolExecutor(8) as pool:
+        for result in pool.map(query, range(16)):
+            pd.testing.assert_frame_equal(result, expected)
+    assert server.broker.cache.stats()["misses"] == misses
+
+
+def test_udal_connection_string(server):
+    udal = UDAL(server.url)
+    assert isinstance(udal._broker, RemoteBroker)
+    result = udal.execute("urn:embrc.eu:emobon:go", {"ref_code": "EMOBON00084"})
+    assert set(result.data()["ref_code"]) == {"EMOBON00084"}
@@ -0,0 +1,71 @@
+from mgo import synthetic
+from mgo.brokers.local import LocalBroker, TableCache
+from mgo.catalog import CONTRACTS_DIR
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    target = tmp_path_factory.mktemp("synthetic")
+    return synthetic.generate(target, samples=12, taxa=500, terms=6000, seed=1)
+
+
+def test_ref_codes_consistent(dataset):
+    """
+    Test that the tables describe the samples of the logsheets.
+    """
+    ref_codes = set(pd.read_parquet(dataset["logsheets"])["ref_code"])
+    assert len(ref_codes) == 12
+    for name in synthetic.TABLES:
+        table = pd.read_parquet(dataset[name])
+        assert set(table["ref_code"]) == ref_codes
+        # written sample by sample
+        assert table["ref_code"].ne(table["ref_code"].shift()).sum() == 12
+    observatories = set(pd.read_parquet(dataset["observatories"])["obs_id"])
+    assert set(pd.read_parquet(dataset["logsheets"])["obs_id"].dropna()) <= observatories
+
+
+@pytest.mark.parametrize("name", ["go", "go_slim", "ko", "lsu", "ssu", "logsheets"])
+def test_schema(dataset, name):
+    """
+    Test that the synthetic tables have the columns and types of the contracts.
+    """
+    filename = dataset[name].name
+    expected = pd.read_parquet(CONTRACTS_DIR / filename).dtypes
+    pd.testing.assert_series_equal(pd.read_parquet(dataset[name]).dtypes, expected)
+
+
+@pytest.mark.parametrize(
+    "name, column, size",
+    [
+        ("lsu", "ncbi_tax_id", 500),
+        ("ssu", "ncbi_tax_id", 500),
+        ("go", "id", 6000),
+        ("ko", "entry", 6000),
+        ("pfam", "entry", 6000),
+    ],
+)
+def test_vocabulary_size(dataset, name, column, size):
+    table = pd.read_parquet(dataset[name])
+    assert table[column].nunique() <= size
+    assert not table.duplicated(["ref_code", column]).any()
+
+
+def test_deterministic(tmp_path, dataset):
+    paths = synthetic.generate(tmp_path, samples=12, taxa=500, terms=6000, seed=1)
+    for name, path in paths.items():
+        pd.testing.assert_frame_equal(pd.read_parquet(path), pd.read_parquet(dataset[name]))
+
+
+def test_broker_data_dir(dataset):
+    """
+    Test serving the synthetic tables with LocalBroker.
+    """
+    broker = LocalBroker(cache=TableCache(), data_dir=dataset["go"].parent)
+    ref_code = pd.read_parquet(dataset["logsheets"])["ref_code"].iloc[0]
+    go = broker.execute("urn:embrc.eu:emobon:go", {"ref_code": ref_code}).data()
+    assert len(go) > 0 and set(go["ref_code"]) == {ref_code}
+    tables = broker.execute("urn:embrc.eu:emobon:all_by_ref_code", {"ref_code": ref_code}).data()
+    assert set(tables) == {"go", "go_slim", "ips", "ko", "lsu", "pfam", "ssu", "logsheets"}
+    assert all(len(table) > 0 for table in tables.values())
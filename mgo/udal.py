@@ -1,34 +1,94 @@
-import pandas as pd
 import typing
-from typing import Any, Literal
-from pathlib import Path
+from typing import Literal
 
 import udal.specification as udal
-from .namedqueries import QUERY_NAMES, QueryName
-from .result import Result
-from .brokers.local import LocalBroker
+from .namedqueries import QUERY_NAMES, QUERY_REGISTRY, QueryName
+
+if typing.TYPE_CHECKING:
+    from .broker import Broker
+    from .result import Result
 
 # SparQL endpoint will go here
-Connection = Literal['']
+Connection = Literal['', 'duckdb'] | str
+"""'duckdb', or the http(s) URL of an `mgo.server`."""
 
 class UDAL(udal.UDAL):
-    """Uniform Data Access Layer"""
+    """Uniform Data Access Layer
+
+    The broker of the connection, and pandas and pyarrow with it, are only
+    imported when the first query is executed, so that short-lived processes
+    listing the `queries` start fast.
+    """
 
     def __init__(self, connectionString: Connection | None = None, config: udal.Config = udal.Config()):
         self._config = config
-        if connectionString is None:
-            self._broker = LocalBroker()
-        else:
+        if connectionString is not None and connectionString != 'duckdb' \
+                and not connectionString.startswith(('http://', 'https://')):
             raise Exception(f'connection string {connectionString} not supported')
+        self._connectionString = connectionString
+        self.__broker: 'Broker | None' = None
 
-    def execute(self, name: str, params: dict | None = None) -> Result:
-        """Find and execute the query with the given name."""
+    @property
+    def _broker(self) -> 'Broker':
+        if self.__broker is None:
+            self.__broker = self.__connect()
+        return self.__broker
+
+    def __connect(self) -> 'Broker':
+        config = self._config
+        connectionString = self._connectionString
+        if connectionString is None:
+            # the catalog of mgo.config.Config, the contracts tables otherwise
+            from .brokers.local import LocalBroker, ResultCache
+            resultCache = getattr(config, 'result_cache', None)
+            if resultCache is not None and not isinstance(resultCache, ResultCache):
+                resultCache = ResultCache(resultCache)
+            return LocalBroker(catalog=getattr(config, 'catalog', None), result_cache=resultCache)
+        if connectionString == 'duckdb':
+            # SQL on the same tables, requires the duckdb extra
+            from .brokers.duckdb import DuckDBBroker
+            return DuckDBBroker(catalog=getattr(config, 'catalog', None))
+        # queries answered by an mgo.server, which keeps the tables warm
+        from .brokers.remote import RemoteBroker
+        return RemoteBroker(connectionString)
+
+    def execute(self, name: str, params: dict | None = None, stream: bool = False) -> 'Result':
+        """Find and execute the query with the given name.
+
+        With `stream`, the data is read in batches when iterating over
+        `Result.batches()` instead of being loaded in full."""
         if name in QUERY_NAMES:
-            return self._broker.execute(name, params)
+            return self._broker.execute(name, params, stream=stream)
         else:
             raise Exception(f'query {name} not supported')
 
+    def execute_many(self, requests: list[tuple[str, dict | None]]) -> list['Result']:
+        """Execute several queries, given as (name, params) pairs, and return
+        their results in the same order. Queries of the same table are
+        answered with a single read of it where the broker supports it."""
+        for name, _ in requests:
+            if name not in QUERY_NAMES:
+                raise Exception(f'query {name} not supported')
+        return self._broker.execute_many(requests)
+
+    async def aexecute(
+            self,
+            name: str,
+            params: dict | None = None,
+            stream: bool = False,
+            timeout: float | None = None,
+            ) -> 'Result':
+        """Find and execute the query with the given name without blocking
+        the event loop, see `Broker.aexecute`."""
+        if name in QUERY_NAMES:
+            return await self._broker.aexecute(name, params, stream=stream, timeout=timeout)
+        else:
+            raise Exception(f'query {name} not supported')
 
     @property
     def queries(self) -> dict[str, udal.NamedQueryInfo]:
+        if self.__broker is None and self._connectionString is None:
+            # the queries of the local broker, without loading it
+            from .brokers import localBrokerQueryNames
+            return { name: QUERY_REGISTRY[name] for name in localBrokerQueryNames }
         return self._broker.queries